@@ -1,9 +1,18 @@
 import logging
+import os
 import sys
 
 from .applebooks import AppleBooks
+from .batch import BatchExport
+from .clippings import Clippings
+from .config import config
+from .errors import ApplicationError
+from .database import AnnotationDatabase
+from .export import Export, process_pool
+from .objects import ObjectStore
 from .utilities import utilities
 from .defaults import AppDefaults
+from .watch import watcher
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -12,8 +21,15 @@ logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
+# Origins that can be listed in config.json's origins keyed by their name.
+ORIGINS = {origin.name: origin for origin in [AppleBooks, Clippings]}
+
+
 class App:
-    def __init__(self):
+    def __init__(self, filters: dict = None):
+
+        # Filters that take precedence over those of config.json.
+        self.filters = filters
 
         self._setup()
 
@@ -24,6 +40,173 @@ class App:
         utilities.make_dir(path=AppDefaults.day_dir)
 
     def run(self):
+        """ Export every origin in config.json's origins. A single origin is
+        exported to its own directory. Several are exported together to the
+        day's export directory, see Export. """
+
+        config.reload()
+
+        if len(config.origins) == 1:
+            self._export(origin=self._origins()[0])
+            return
+
+        workers = config.workers or os.cpu_count()
+
+        # Origins are processed from threads so they share a pool of spawned
+        # worker processes.
+        with process_pool(workers) as executor:
+
+            origins = self._origins(executor=executor)
+
+            export = Export()
+            export.run(origins=origins)
+
+        if config.store:
+            self._store(day_dir=export.paths.local_root_dir.parent, origins=origins)
+
+    def watch(self, debounce: float = 1.0, interval: float = 2.0):
+        """ Export once and then again every time the Books databases change
+        until interrupted. Annotations are kept in memory between exports so
+        only new or changed ones are processed again. Only the databases that
+        changed are snapshot and queried again. """
+
+        self.applebooks = AppleBooks(warm=True, filters=self.filters)
+
+        paths = self.applebooks.paths
+        directories = [paths.src_aeannotation_dir, paths.src_bklibrary_dir]
+
+        with watcher(directories, debounce=debounce, interval=interval) as changes:
+
+            self._export(origin=self.applebooks)
+
+            log.info("Watching for changes...")
+
+            try:
+                while True:
+
+                    changed = changes.wait()
+
+                    log.info(f"Changes in {', '.join(d.name for d in changed)}.")
+
+                    try:
+                        self._export(origin=self.applebooks, changed=changed)
+                    except ApplicationError as error:
+                        """ The next change might well fix whatever went wrong
+                        so keep watching. """
+                        log.error(f"Export failed. {repr(error)}")
+            except KeyboardInterrupt:
+                log.info("Stopped watching.")
+
+    def batch(self, libraries: dict, jobs: int = None) -> dict:
+        """ Export several libraries at once. libraries maps the name of each
+        library to its root. Prints how long each library took and returns the
+        summary of the batch. """
+
+        batch = BatchExport(libraries=libraries, jobs=jobs, filters=self.filters)
+        summary = batch.run()
+
+        if config.store:
+            self._store(
+                day_dir=batch.libraries_dir.parent, origins=batch.exports.values()
+            )
+
+        stages = {
+            "copy_databases": "copy",
+            "query_and_cache_data": "query",
+            "save_data": "save",
+        }
+
+        print(f"\n{'library':<32}{'annotations':>12}{'total':>10}", end="")
+        print("".join(f"{label:>10}" for label in stages.values()))
+
+        for name, result in summary["libraries"].items():
+
+            count = result.get("count_annotations", "failed")
+            times = [
+                f"{result['stages'][stage]:>9.3f}s"
+                if stage in result["stages"]
+                else f"{'-':>10}"
+                for stage in stages
+            ]
+
+            print(f"{name[:31]:<32}{count:>12}{result['wall_time']:>9.3f}s", end="")
+            print("".join(times))
+
+        print(f"\nExported {len(libraries)} libraries in {summary['wall_time']:.3f}s.")
+
+        return summary
+
+    def restore(self, date: str):
+        """ Restore the files of the day directory for date from the object
+        store. """
+
+        ObjectStore().restore(day_dir=AppDefaults.root_dir / date)
+
+    def search(self, query: str, limit: int = 20):
+        """ Print the annotations best matching query. """
+
+        for result in AnnotationDatabase().search(query=query, limit=limit):
+
+            text = " ".join(result["text"].split())
+
+            print(f"{result['source_name']} - {result['source_author']}")
+            print(f"    {text}")
+
+            if result["notes"]:
+                print(f"    Notes: {result['notes']}")
+
+            print(f"    {result['id']}\n")
+
+    def _origins(self, executor=None) -> list:
+        """ Create the origins listed in config.json's origins. """
+
+        if not config.origins:
+            raise ApplicationError("No origins configured.")
+
+        origins = []
+
+        for name, settings in config.origins.items():
+
+            try:
+                origin_class = ORIGINS[name]
+            except KeyError:
+                raise ApplicationError(
+                    f"Unknown origin '{name}'. Choose from {', '.join(ORIGINS)}."
+                )
+
+            origins.append(
+                origin_class.from_config(
+                    settings=settings, filters=self.filters, executor=executor
+                )
+            )
+
+        return origins
+
+    def _export(self, origin, changed: list = None):
+
+        origin.run(changed=changed)
+
+        if config.store:
+            # The day directory of the export rather than AppDefaults.day_dir
+            # as the date may have changed since it started.
+            self._store(day_dir=origin.paths.local_root_dir.parent, origins=[origin])
+
+    def _store(self, day_dir, origins: list):
+        """ Move the files of day_dir along with the snapshots of each origin
+        into the object store. """
+
+        files = {
+            path.relative_to(day_dir): path
+            for path in day_dir.rglob("*")
+            if path.is_file() and path != day_dir / ObjectStore.manifest_name
+        }
+
+        for origin in origins:
+
+            local_root_dir = origin.paths.local_root_dir.relative_to(day_dir)
+
+            for name, path in origin.snapshot_files.items():
+                files[local_root_dir / name] = path
 
-        self.applebooks = AppleBooks()
-        self.applebooks.run()
+        store = ObjectStore(compression=config.store_compression)
+        store.commit(day_dir=day_dir, files=files)
@@ -1,37 +1,142 @@
-import json
+import contextlib
+import itertools
 import logging
+import os
+import pathlib
+from collections import defaultdict, deque
+from concurrent.futures import Executor
 from datetime import datetime
+from typing import Iterator
 
-import psutil
-
+from ..config import config
+from ..export import Export
+from ..origins import Origin
+from ..stats import RunStats, Stopwatch
 from ..utilities import utilities
+from .cache import AnnotationCache
 from .db import AppleBooksDB
-from .defaults import AppleBooksDefaults
+from .defaults import AppleBooksDefaults, AppleBooksPaths
 from .errors import AppleBooksError
-from .models import Annotation, Source
+from .filters import AppleBooksFilters
+from .models import SOURCE_COLUMNS, Annotation, ConvertedAnnotation, Source
+from .snapshot import AppleBooksSnapshot
+from .sync import AppleBooksSync
 
 
 log = logging.getLogger(__name__)
 
 
-class AppleBooks:
-    def __init__(self):
+class AppleBooks(Origin):
+    """ Export the sources and annotations of a Books library.
+
+    A warm AppleBooks is meant to be run repeatedly. It keeps the Annotations
+    of its previous run in memory and reuses those whose rows haven't changed.
+    The rows queried from each database are kept too and only queried again
+    once the database changes. As it runs while Books is open it doesn't
+    check whether Books is running. Databases are always snapshot through
+    SQLite so they're consistent even while Books is writing to them. """
+
+    name = AppleBooksDefaults.name
+
+    # Names its stages are recorded under in stats, see Export.
+    stages = {
+        "snapshot": "copy_databases",
+        "query": "query_and_cache_data",
+        "process": "process_data",
+        "save": "save_data",
+    }
+
+    def __init__(
+        self,
+        paths: AppleBooksPaths = None,
+        warm: bool = False,
+        filters: dict = None,
+        executor: Executor = None,
+    ):
+
+        self.paths = paths or AppleBooksPaths()
+
+        # Default paths are derived again every run as the day directory
+        # changes at midnight.
+        self._default_paths = paths is None
+
+        # Filters that take precedence over those of config.json.
+        self._filters = filters or {}
+
+        # Pool of worker processes shared with other AppleBooks exporting at
+        # the same time. Each run creates its own when there's none.
+        self._executor = executor
 
-        if self._is_applebooks_running():
+        # Annotations of the previous run and the rows they were created from
+        # keyed by their id.
+        self._warm = {} if warm else None
+
+        # Rows of the previous warm run queried from each database along with
+        # the conditions they were queried with.
+        self._warm_rows = None
+
+        # Source directories that changed since the previous run or None when
+        # that isn't known. See run.
+        self._changed = None
+
+        self._reset()
+
+        if not warm and self._is_applebooks_running():
             raise AppleBooksError("Apple Books currently running.")
 
-    def run(self):
+    @classmethod
+    def from_config(
+        cls, settings: dict, filters: dict = None, executor: Executor = None
+    ) -> "AppleBooks":
+        """ settings may set the root of the library, see AppleBooksPaths. """
 
-        self._setup()
-        self._copy_databases()
-        self._query_and_cache_data()
-        self._process_data()
-        self._save_data()
+        root = settings.get("root")
+        paths = None
+
+        if root is not None:
+            paths = AppleBooksPaths(src_root_dir=pathlib.Path(root).expanduser())
+
+        return cls(paths=paths, filters=filters, executor=executor)
+
+    def run(self, changed: list = None):
+
+        config.reload()
+
+        self._reset()
+
+        self._changed = changed
+
+        self.export.run(origins=[self])
+
+    def _reset(self):
+        """ Reset the state of a run. Relative filter dates are resolved every
+        time. """
+
+        if self._default_paths:
+            self.paths = AppleBooksPaths()
+
+        self.filters = AppleBooksFilters({**config.filters, **self._filters})
+        self.stats = RunStats()
+        self.export = Export(
+            paths=self.paths,
+            stats=self.stats,
+            metadata=lambda: self._metadata,
+            stages=self.stages,
+        )
+        self.index = self.export.index
+        self.changes = self.export.changes
+
+        # Directories of the snapshots written by this run or None until the
+        # databases are snapshot.
+        self._updated = None
 
     @staticmethod
     def _is_applebooks_running():
         """ Check to see if AppleBooks is currently running. """
 
+        # Imported here as it's slow to import and only needed once.
+        import psutil
+
         for proc in psutil.process_iter():
 
             try:
@@ -50,109 +155,424 @@ class AppleBooks:
 
         return False
 
-    def _setup(self):
-        """ Build all relevant directories for AppleBooks. We don't create the
-        directories for local_bklibrary_dir and local_aeannotation_dir seeing
-        as these are created when the source databases are copied over. """
+    def _copy_databases(self):
+        """ Snapshot AppleBooks databases to local directory. Only the
+        databases that changed are checked when that's known. """
 
-        # Delete local_root_dir. Just incase app is run more than once a day.
-        utilities.delete_dir(path=AppleBooksDefaults.local_root_dir)
+        snapshot = AppleBooksSnapshot(paths=self.paths)
+        bytes_written = snapshot.run(src_dirs=self._changed)
 
-        # Create local_root_dir and local_db_dir.
-        utilities.make_dir(path=AppleBooksDefaults.local_root_dir)
-        utilities.make_dir(path=AppleBooksDefaults.local_db_dir)
+        self._updated = snapshot.updated
 
-    def _copy_databases(self):
-        """ Copy AppleBooks databases to local directory. """
+        self.stats.record(bytes_written=bytes_written)
 
-        # Copy directory containing BKLibrary###.sqlite files.
-        utilities.copy_dir(
-            src=AppleBooksDefaults.src_bklibrary_dir,
-            dest=AppleBooksDefaults.local_bklibrary_dir,
-        )
+    def _query_and_cache_data(self):
+        """ Query database data. Annotations are streamed from the database
+        while they're processed and saved. Incremental annotations are merged
+        with the rows saved by previous runs so they're queried up front. """
+
+        db = AppleBooksDB(paths=self.paths, filters=self.filters)
+
+        # Rows queried up front are always queried unconverted.
+        self._annotation_class = Annotation
+        self._is_streamed = False
+        self._sync = None
+
+        if self._warm is not None:
+            sources, annotations = self._query_warm(db)
+
+            self._rows = self._join_rows(sources=sources, annotations=annotations)
+            self.stats.record(rows_out=len(sources) + len(annotations))
+        elif config.incremental:
+            self._sync = AppleBooksSync(db, paths=self.paths, filters=self.filters)
+
+            sources = db.query_sources_db()
+            annotations = self._sync.query(sources)
+
+            self._rows = self._join_rows(sources=sources, annotations=annotations)
+            self.stats.record(rows_out=len(sources) + len(annotations))
+        else:
+            self._rows = db.iter_annotations(pushdown=config.pushdown)
+            self._is_streamed = True
+
+            if config.pushdown:
+                self._annotation_class = ConvertedAnnotation
+
+    def _query_warm(self, db: AppleBooksDB) -> tuple:
+        """ Query the sources and annotations of a warm run. Rows of the
+        previous run are reused for each database whose snapshot wasn't
+        updated as long as the filters resolve to the same conditions. """
+
+        previous = self._warm_rows or {}
+        updated = self._updated
+        where = self.filters.joined_where()
+
+        # Only set again once the databases were queried successfully.
+        self._warm_rows = None
+
+        if updated is None or previous.get("where") != where:
+            previous = {}
+
+        sources = previous.get("sources")
+        annotations = previous.get("annotations")
+
+        if sources is None or self.paths.local_bklibrary_dir in updated:
+            log.info("Querying sources...")
+
+            sources = db.query_sources_db()
+
+            # Annotations are filtered by the ids of the sources that match.
+            if self.filters.filters_sources:
+                annotations = None
+
+        if annotations is None or self.paths.local_aeannotation_dir in updated:
+            log.info("Querying annotations...")
+
+            annotations = db.query_annotations_db()
+
+        self._warm_rows = {
+            "where": where,
+            "sources": sources,
+            "annotations": annotations,
+        }
+
+        return sources, annotations
+
+    @staticmethod
+    def _join_rows(sources: list, annotations: list) -> Iterator[tuple]:
+        """ Join sources and annotations queried as dicts into rows like the
+        ones streamed by AppleBooksDB.iter_annotations. """
+
+        # Group annotations by source_id in a single pass. The grouped lists
+        # keep the query's ordering so the output is identical to comparing
+        # every annotation against every source.
+        annotations_by_source = defaultdict(list)
+
+        for _annotation in annotations:
+            annotations_by_source[_annotation["source_id"]].append(_annotation)
+
+        for source_pk, _source in enumerate(sources):
+
+            source = tuple(_source.get(column) for column in SOURCE_COLUMNS)
+
+            for _annotation in annotations_by_source.get(_source["source_id"], []):
+                yield (source_pk, *source, *Annotation.row({**_annotation, **_source}))
+
+    def _iter_sources(self):
+        """ Yield each Source that has annotations along with its annotations
+        in the order they were processed. Each row holds the source's key and
+        columns followed by the annotation's columns. Rows of the same source
+        are consecutive. """
+
+        # Restored and processed annotations are cached until the last
+        # source is yielded.
+        with self._cache:
+
+            # The source part of each row waits here while the annotation part
+            # is being processed. Processing keeps the order of the rows so
+            # they're paired back up in order.
+            sources = deque()
+            size = 1 + len(SOURCE_COLUMNS)
+
+            # Rows are only counted as they're streamed so they're recorded
+            # for the stages they went through once they've all been
+            # processed.
+            count_rows = 0
+            count_annotations = 0
+
+            # Rows are queried and processed while the Sources are being saved
+            # so the time spent doing so is measured here and attributed to
+            # the query and process stages rather than the save stage.
+            # Processing time excludes the time spent querying the rows.
+            query_time = Stopwatch()
+            process_time = Stopwatch()
+
+            def rows():
+
+                nonlocal count_rows
+
+                _rows = iter(self._rows)
+
+                while True:
+
+                    query_time.start()
+                    row = next(_rows, None)
+                    query_time.stop()
 
-        # Copy directory containing AEAnnotation###.sqlite files.
-        utilities.copy_dir(
-            src=AppleBooksDefaults.src_aeannotation_dir,
-            dest=AppleBooksDefaults.local_aeannotation_dir,
+                    if row is None:
+                        break
+
+                    count_rows += 1
+                    sources.append(row[:size])
+                    yield row[size:]
+
+            process_time.start()
+
+            processed = zip(
+                self._process_rows(rows=rows()), iter(sources.popleft, None)
+            )
+
+            for _, group in itertools.groupby(processed, key=lambda item: item[1][0]):
+
+                annotations = []
+
+                for annotation, _source in group:
+                    annotations.append(annotation)
+
+                source = Source(_source[1:])
+
+                if self.filters.starred:
+                    # The query only matched the starred collection anywhere
+                    # in the notes so each Annotation is checked once it's
+                    # processed.
+                    annotations = [a for a in annotations if a.is_starred]
+
+                    if not annotations:
+                        continue
+
+                for annotation in annotations:
+                    source.add_annotation(annotation)
+
+                count_annotations += len(annotations)
+
+                process_time.stop()
+
+                yield source, annotations
+
+                process_time.start()
+
+            process_time.stop()
+
+            self.stats.attribute(
+                self.stages["query"], query_time.wall_time, query_time.cpu_time
+            )
+            self.stats.attribute(
+                self.stages["process"],
+                process_time.wall_time - query_time.wall_time,
+                process_time.cpu_time - query_time.cpu_time,
+            )
+
+            if self._is_streamed:
+                # Rows queried up front are counted as they're queried.
+                self.stats.record(stage=self.stages["query"], rows_out=count_rows)
+
+            self.stats.record(
+                stage=self.stages["process"],
+                rows_in=count_rows,
+                rows_out=count_annotations,
+            )
+
+    def _iter_synced(self):
+        """ Yield the Sources of an incremental run in the order they're
+        exported in. Sources that didn't change since the previous run are
+        restored as they were exported. The rest are processed and saved for
+        the next run. See AppleBooksSync. """
+
+        # Restoring and saving the outputs of Sources is part of processing
+        # them. See _iter_sources.
+        process_time = Stopwatch()
+
+        with self._sync:
+
+            processed = self._iter_sources()
+            pending = next(processed, None)
+
+            for source_id in self._sync.sources:
+
+                process_time.start()
+
+                source = self._sync.restore(source_id)
+
+                if source is None and pending is not None:
+                    if pending[0].id == source_id:
+                        source = self._sync.put(*pending)
+                        process_time.stop()
+                        pending = next(processed, None)
+                        process_time.start()
+
+                process_time.stop()
+
+                if source is not None:
+                    yield source, source.annotations
+
+        self.stats.attribute(
+            self.stages["process"], process_time.wall_time, process_time.cpu_time
         )
 
-    def _query_and_cache_data(self):
-        """ Query and cache database data. """
+    def _process_rows(self, rows: Iterator[tuple]) -> Iterator[Annotation]:
+        """ Yield an Annotation for each row in order. Rows are processed in
+        chunks. Annotations cached by previous runs are restored and only the
+        remaining rows of each chunk are processed, across a pool of worker
+        processes when more than one worker is configured. """
+
+        if self._warm is not None:
+            yield from self._process_rows_warm(rows)
+            return
+
+        workers = config.workers or os.cpu_count()
+        chunk_size = config.chunk_size
+
+        # Inputs that fit in a single chunk aren't worth sending to a worker.
+        head = list(itertools.islice(rows, chunk_size + 1))
+        rows = itertools.chain(head, rows)
+
+        chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
 
-        db = AppleBooksDB()
+        if workers <= 1 or len(head) <= chunk_size:
+            for chunk in chunks:
+                yield from self._process_chunk(chunk)
+            return
 
-        self._query_data_sources = db.query_sources_db()
-        self._query_data_annotations = db.query_annotations_db()
+        log.info(f"Processing annotations with {workers} workers...")
 
-    def _process_data(self):
+        if self._executor is not None:
+            pool = contextlib.nullcontext(self._executor)
+        else:
+            # Imported here as it pulls in multiprocessing which is only
+            # needed with more than one worker.
+            from concurrent.futures import ProcessPoolExecutor
 
-        log.info(
-            f"Processing {len(self._query_data_sources)} sources with "
-            f"{len(self._query_data_annotations)} annotations."
+            pool = ProcessPoolExecutor(max_workers=workers)
+
+        # Keep a bounded number of chunks in flight and collect them in the
+        # order they were submitted so the output stays deterministic.
+        with pool as executor:
+
+            pending = deque()
+
+            for chunk in chunks:
+
+                annotations = self._cache.get(chunk, cls=self._annotation_class)
+                misses = [row for row, a in zip(chunk, annotations) if a is None]
+
+                future = executor.submit(self._annotation_class.from_rows, misses)
+                pending.append((annotations, misses, future))
+
+                if len(pending) >= workers * 2:
+                    annotations, misses, future = pending.popleft()
+                    yield from self._merge(annotations, misses, future.result())
+
+            while pending:
+                annotations, misses, future = pending.popleft()
+                yield from self._merge(annotations, misses, future.result())
+
+    def _process_rows_warm(self, rows: Iterator[tuple]) -> Iterator[Annotation]:
+        """ Yield an Annotation for each row in order reusing the Annotations
+        of the previous run whose rows are unchanged. """
+
+        previous = self._warm
+        current = {}
+        count_reused = 0
+
+        for chunk in iter(lambda: list(itertools.islice(rows, config.chunk_size)), []):
+
+            annotations = []
+
+            for row in chunk:
+
+                cached = previous.get(row[0])
+
+                if cached is not None and cached[0] == row:
+                    count_reused += 1
+                    annotations.append(cached[1])
+                else:
+                    annotations.append(None)
+
+            misses = [row for row, a in zip(chunk, annotations) if a is None]
+            annotations = self._fill(annotations, self._process_chunk(misses))
+
+            for row, annotation in zip(chunk, annotations):
+                current[row[0]] = (row, annotation)
+
+            yield from annotations
+
+        log.info(f"Reused {count_reused} of {len(current)} annotations.")
+
+        self._warm = current
+
+    def _process_chunk(self, chunk: list) -> list:
+        """ Restore the Annotations of chunk from the cache and process the
+        rows that weren't cached. """
+
+        annotations = self._cache.get(chunk, cls=self._annotation_class)
+        misses = [row for row, a in zip(chunk, annotations) if a is None]
+
+        return self._merge(
+            annotations, misses, self._annotation_class.from_rows(misses)
         )
 
-        self._sources = []
-        self._annotations = []
+    def _merge(self, annotations: list, misses: list, processed: list) -> list:
+        """ Cache the Annotations processed from the rows missing from the
+        cache and put them back in place. """
 
-        for _source in self._query_data_sources:
+        self._cache.put(misses, processed)
 
-            source = Source(_source)
+        return self._fill(annotations, processed)
 
-            for _annotation in self._query_data_annotations:
-                if _annotation["source_id"] == _source["source_id"]:
+    @staticmethod
+    def _fill(annotations: list, processed: list) -> list:
+        """ Replace each None in annotations with the next processed
+        Annotation. """
 
-                    _annotation["source_name"] = _source["source_name"]
-                    _annotation["source_author"] = _source["source_author"]
+        processed = iter(processed)
 
-                    annotation = Annotation(_annotation)
-                    source.add_annotation(annotation)
+        return [a if a is not None else next(processed) for a in annotations]
 
-                    self._annotations.append(annotation)
+    def snapshot(self):
+        """ The database snapshots live in local_db_dir which is kept between
+        runs so unchanged databases don't need to be copied again. """
 
-            if source.has_annotations:
-                self._sources.append(source)
+        utilities.make_dir(path=self.paths.local_db_dir)
 
-    def _save_data(self):
-        """ """
-        log.info(f"Saving sources to {AppleBooksDefaults.sources_json}...")
+        self._copy_databases()
 
-        with open(AppleBooksDefaults.sources_json, "w", encoding="utf-8") as f:
-            json.dump(self._data_sources, f, indent=4, ensure_ascii=False)
+    def query(self):
 
-        log.info(f"Saving annotations to {AppleBooksDefaults.annotations_json}...")
+        self._query_and_cache_data()
 
-        with open(AppleBooksDefaults.annotations_json, "w", encoding="utf-8") as f:
-            json.dump(self._data_annotations, f, indent=4, ensure_ascii=False)
+    def process(self) -> Iterator[tuple]:
+        """ Sources are processed lazily while they're being saved so only one
+        source and its annotations are held in memory at a time. """
+
+        log.info("Processing sources and annotations.")
+
+        self._cache = AnnotationCache(self.paths.cache_sqlite)
+
+        if self._sync is not None:
+            return self._iter_synced()
+
+        return self._iter_sources()
 
     @property
-    def _data_sources(self):
+    def snapshot_files(self) -> dict:
+        """ Database snapshots keyed by their path relative to local_root_dir
+        as they were laid out before snapshots were kept between runs. """
 
-        data = {
-            "sources": [s.serialize() for s in self._sources],
-            "metadata": self._metadata,
+        return {
+            pathlib.Path("db") / path.relative_to(self.paths.local_db_dir): path
+            for path in self.paths.local_db_dir.glob("*/*.sqlite")
         }
 
-        return data
-
     @property
-    def _data_annotations(self):
+    def metadata(self) -> dict:
 
-        data = {
-            "annotations": [a.serialize() for a in self._annotations],
-            "metadata": self._metadata,
+        metadata = {
+            "version": AppleBooksDefaults.version,
+            "cache": self._cache.serialize(),
         }
 
-        return data
+        return metadata
 
     @property
     def _metadata(self):
 
         metadata = {
             "date": datetime.utcnow().isoformat(),
-            "count_sources": len(self._sources),
-            "count_annotations": len(self._annotations),
+            "count_sources": self.export.count_sources,
+            "count_annotations": self.export.count_annotations,
             "version": AppleBooksDefaults.version,
+            "stats": self.stats.serialize(),
+            "cache": self._cache.serialize(),
         }
 
         return metadata
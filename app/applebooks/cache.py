@@ -0,0 +1,270 @@
+import json
+import logging
+import marshal
+import pathlib
+import sqlite3
+
+from ..config import config
+from .errors import AppleBooksError
+from .models import DATE_MODIFIED, PROCESSED_SLOTS, Annotation
+
+
+log = logging.getLogger(__name__)
+
+
+class AnnotationCache:
+    """ Persistent cache of processed Annotations keyed by their id i.e. their
+    ZANNOTATIONUUID and their date_modified. An Annotation whose row has the
+    same id and date_modified as a cached one is restored from its cached
+    record instead of being processed again.
+
+    Records are only valid for the note syntax and version they were processed
+    with so the cache is cleared whenever either changes. Every record is
+    stamped with the run it was last used in and the least recently used
+    records are evicted once the cache holds more than max_size. Records used
+    by the current run are never evicted so a library larger than max_size
+    doesn't evict the records it's about to use again. A max_size of 0, the
+    default, disables the cache. """
+
+    # Number of ids looked up per query. Kept well below SQLite's limit on the
+    # number of parameters.
+    batch_size = 500
+
+    # Size of SQLite's page cache, negative sizes being in KiB. Records are
+    # inserted in the order of their random UUIDs so it's large enough to hold
+    # most of the records' B-tree.
+    page_cache_size = -64 * 1024
+
+    # Bump whenever PROCESSED_SLOTS or their values change.
+    version = 2
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS records (
+            id TEXT PRIMARY KEY,
+            date_modified,
+            record BLOB NOT NULL,
+            used INTEGER NOT NULL
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS records_used ON records (used);
+    """
+
+    def __init__(self, path: pathlib.Path, max_size: int = None):
+
+        self.path = path
+        self.max_size = config.cache_size if max_size is None else max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+
+        self._connection = None
+        self._run = None
+        self._records = []
+
+    def __enter__(self):
+
+        self.open()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def open(self) -> None:
+
+        if not self.enabled:
+            return
+
+        self._connection = self._connect()
+
+        self._connection.execute("BEGIN")
+
+        meta = dict(self._connection.execute("SELECT key, value FROM meta"))
+        signature = self._signature()
+
+        if meta.get("signature") != signature:
+            if meta:
+                log.info("Cached annotations are out of date. Clearing cache...")
+            self._connection.execute("DELETE FROM records")
+
+        self._run = int(meta.get("run", 0)) + 1
+
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [("signature", signature), ("run", str(self._run))],
+        )
+
+    def get(self, rows: list, cls: type = Annotation) -> list:
+        """ Restore the Annotation of each row from the cache. Rows that aren't
+        cached or were modified since they were cached are None. """
+
+        if self._connection is None:
+            self.misses += len(rows)
+            return [None] * len(rows)
+
+        annotations = []
+
+        for start in range(0, len(rows), self.batch_size):
+
+            batch = rows[start : start + self.batch_size]
+            ids = [row[0] for row in batch]
+            placeholders = ", ".join("?" for _ in ids)
+
+            records = {
+                id_: (date_modified, record)
+                for id_, date_modified, record in self._connection.execute(
+                    f"""
+                    SELECT id, date_modified, record
+                    FROM records
+                    WHERE id IN ({placeholders});
+                    """,
+                    ids,
+                )
+            }
+
+            if records:
+                placeholders = ", ".join("?" for _ in records)
+                self._connection.execute(
+                    f"UPDATE records SET used = ? WHERE id IN ({placeholders});",
+                    [self._run, *records],
+                )
+
+            for row in batch:
+
+                date_modified, record = records.get(row[0], (None, None))
+
+                if record is None or date_modified != row[DATE_MODIFIED]:
+                    self.misses += 1
+                    annotations.append(None)
+                    continue
+
+                self.hits += 1
+                annotations.append(cls.from_record(row, marshal.loads(record)))
+
+        return annotations
+
+    def put(self, rows: list, annotations: list) -> None:
+        """ Queue processed Annotations along with their rows to be cached. """
+
+        if self._connection is None:
+            return
+
+        for row, annotation in zip(rows, annotations):
+            self._records.append(
+                (
+                    row[0],
+                    row[DATE_MODIFIED],
+                    marshal.dumps(annotation.record()),
+                    self._run,
+                )
+            )
+
+        if len(self._records) >= self.batch_size:
+            self._flush()
+
+    def close(self) -> None:
+
+        if self._connection is None:
+            return
+
+        self._flush()
+
+        (self.size,) = self._connection.execute(
+            "SELECT COUNT(*) FROM records"
+        ).fetchone()
+
+        if self.size > self.max_size:
+
+            cursor = self._connection.execute(
+                """
+                DELETE FROM records WHERE id IN (
+                    SELECT id FROM records WHERE used < ? ORDER BY used LIMIT ?
+                );
+                """,
+                (self._run, self.size - self.max_size),
+            )
+
+            log.info(f"Evicted {cursor.rowcount} cached annotations.")
+
+            self.size -= cursor.rowcount
+
+        self._connection.execute("COMMIT")
+        self._connection.close()
+        self._connection = None
+
+    def abort(self) -> None:
+
+        if self._connection is None:
+            return
+
+        self._connection.execute("ROLLBACK")
+        self._connection.close()
+        self._connection = None
+
+    def serialize(self) -> dict:
+
+        lookups = self.hits + self.misses
+
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "size": self.size,
+        }
+
+    def _flush(self) -> None:
+
+        self._connection.executemany(
+            """
+            INSERT OR REPLACE INTO records (id, date_modified, record, used)
+            VALUES (?, ?, ?, ?);
+            """,
+            self._records,
+        )
+
+        self._records = []
+
+    def _signature(self) -> str:
+        """ Everything the cached records depend on besides their rows. """
+
+        return json.dumps(
+            {
+                "version": self.version,
+                "marshal": marshal.version,
+                "slots": PROCESSED_SLOTS,
+                "tag_prefix": config.tag_prefix,
+                "collection_prefix": config.collection_prefix,
+                "starred_collection": config.starred_collection,
+            }
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+
+        try:
+            # Transactions are managed explicitly.
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute(f"PRAGMA cache_size = {self.page_cache_size}")
+            connection.executescript(self.schema)
+        except sqlite3.Error as error:
+            raise AppleBooksError(f"SQLite Error: {repr(error)}")
+        except Exception as error:
+            raise AppleBooksError(f"Unexpected Error: {repr(error)}")
+
+        return connection
@@ -1,18 +1,36 @@
 import logging
 import pathlib
 import sqlite3
+from typing import Iterator
 
-from .defaults import AppleBooksDefaults
+from .defaults import AppleBooksDefaults, AppleBooksPaths
 from .errors import AppleBooksError
+from .filters import AppleBooksFilters
 
 
 log = logging.getLogger(__name__)
 
 
 class AppleBooksDB:
+
+    fetch_size = 1000
+
+    # Number of source ids an annotations query is restricted to at once.
+    batch_size = 500
+
+    def __init__(
+        self, paths: AppleBooksPaths = None, filters: AppleBooksFilters = None
+    ):
+
+        self._paths = paths or AppleBooksPaths()
+        self._filters = filters or AppleBooksFilters()
+        self._source_ids = None
+
     def query_sources_db(self):
 
-        query = """
+        where, parameters = self._filters.sources_where()
+
+        query = f"""
             SELECT
                 ZBKLIBRARYASSET.ZASSETID as source_id,
                 ZBKLIBRARYASSET.ZTITLE as source_name,
@@ -20,17 +38,47 @@ class AppleBooksDB:
                 ZBKLIBRARYASSET.ZPATH as source_path
             FROM ZBKLIBRARYASSET
 
-            ORDER BY ZBKLIBRARYASSET.ZTITLE;
+            WHERE {where}
+
+            ORDER BY ZBKLIBRARYASSET.ZTITLE, ZBKLIBRARYASSET.Z_PK;
         """
 
-        db = self._get_sqlite_file(path=AppleBooksDefaults.local_bklibrary_dir)
-        data = self._execute_query(sqlite_file=db, query=query)
+        db = self._get_sqlite_file(path=self._paths.local_bklibrary_dir)
+        data = self._execute_query(sqlite_file=db, query=query, parameters=parameters)
 
         return data
 
-    def query_annotations_db(self):
+    def query_annotations_db(self, source_ids: list = None):
+        """ Query annotations ordered by their source's id. source_ids
+        restricts them to those of some sources, an annotation without a
+        source having the source id "". """
+
+        if source_ids is not None:
+
+            source_ids = sorted(source_ids)
+
+            # Queried in batches to stay below SQLite's limit on the number of
+            # parameters.
+            return [
+                row
+                for start in range(0, len(source_ids), self.batch_size)
+                for row in self._query_annotations_db(
+                    source_ids=source_ids[start : start + self.batch_size]
+                )
+            ]
+
+        return self._query_annotations_db()
+
+    def _query_annotations_db(self, source_ids: list = None):
 
-        query = """
+        where, parameters = self._annotations_where()
+
+        if source_ids is not None:
+            placeholders = ", ".join("?" for _ in source_ids)
+            where = f"{where} AND IFNULL(ZANNOTATIONASSETID, '') IN ({placeholders})"
+            parameters = (*parameters, *source_ids)
+
+        query = f"""
             SELECT
                 ZAEANNOTATION.ZANNOTATIONASSETID as source_id,
                 ZANNOTATIONUUID as id,
@@ -39,21 +87,231 @@ class AppleBooksDB:
                 ZANNOTATIONSTYLE as style,
                 ZANNOTATIONLOCATION as epubcfi,
                 ZANNOTATIONCREATIONDATE as date_created,
-                ZANNOTATIONMODIFICATIONDATE as date_modified
+                ZANNOTATIONMODIFICATIONDATE as date_modified,
+                Z_PK as pk
 
             FROM ZAEANNOTATION
 
             WHERE ZANNOTATIONSELECTEDTEXT IS NOT NULL
                 AND ZANNOTATIONDELETED = 0
+                AND {where}
 
-            ORDER BY ZANNOTATIONASSETID;
+            ORDER BY ZANNOTATIONASSETID, Z_PK;
         """
 
-        db = self._get_sqlite_file(path=AppleBooksDefaults.local_aeannotation_dir)
-        data = self._execute_query(sqlite_file=db, query=query)
+        db = self._get_sqlite_file(path=self._paths.local_aeannotation_dir)
+        data = self._execute_query(sqlite_file=db, query=query, parameters=parameters)
 
         return data
 
+    def iter_annotations(self, pushdown: bool = False) -> Iterator[tuple]:
+        """ Stream annotations joined with their sources ordered by source name
+        then by annotation. Rows are fetched in batches of fetch_size so only
+        one batch is held in memory. Each row is a tuple of the source's
+        Z_PK, the SOURCE_COLUMNS and the ANNOTATION_COLUMNS.
+
+        With pushdown their dates and style are converted by SQLite and
+        returned ready to be used by a ConvertedAnnotation. That's slower
+        than converting them in Python, see _convert_date. The location is
+        always None as it's derived from the epubcfi by the Annotation. """
+
+        where, parameters = self._filters.joined_where()
+
+        if pushdown:
+            styles = " ".join(
+                f"WHEN {index} THEN '{style}'"
+                for index, style in AppleBooksDefaults.styles.items()
+            )
+            epoch = AppleBooksDefaults.ns_time_interval_since_1970
+
+            style = f"CASE ZANNOTATIONSTYLE {styles} END"
+            date_created = f"ZANNOTATIONCREATIONDATE + {epoch}"
+            date_modified = f"ZANNOTATIONMODIFICATIONDATE + {epoch}"
+        else:
+            style = "ZANNOTATIONSTYLE"
+            date_created = "ZANNOTATIONCREATIONDATE"
+            date_modified = "ZANNOTATIONMODIFICATIONDATE"
+
+        query = f"""
+            SELECT
+                ZBKLIBRARYASSET.Z_PK as source_pk,
+                ZBKLIBRARYASSET.ZASSETID as source_id,
+                ZBKLIBRARYASSET.ZTITLE as source_name,
+                ZBKLIBRARYASSET.ZAUTHOR as source_author,
+                ZBKLIBRARYASSET.ZPATH as source_path,
+                ZANNOTATIONUUID as id,
+                ZAEANNOTATION.ZANNOTATIONASSETID as annotation_source_id,
+                ZBKLIBRARYASSET.ZTITLE as annotation_source_name,
+                ZBKLIBRARYASSET.ZAUTHOR as annotation_source_author,
+                ZANNOTATIONSELECTEDTEXT as text,
+                ZANNOTATIONNOTE as notes,
+                {style} as style,
+                ZANNOTATIONLOCATION as epubcfi,
+                {date_created} as date_created,
+                {date_modified} as date_modified,
+                NULL as location,
+                ZAEANNOTATION.Z_PK as pk
+
+            FROM ZAEANNOTATION
+
+            JOIN library.ZBKLIBRARYASSET
+                ON ZBKLIBRARYASSET.ZASSETID = ZAEANNOTATION.ZANNOTATIONASSETID
+
+            WHERE ZANNOTATIONSELECTEDTEXT IS NOT NULL
+                AND ZANNOTATIONDELETED = 0
+                AND {where}
+        """
+
+        if pushdown:
+            date_created = self._convert_date("date_created")
+            date_modified = self._convert_date("date_modified")
+        else:
+            date_created = "date_created"
+            date_modified = "date_modified"
+
+        query = f"""
+            SELECT
+                source_pk,
+                source_id,
+                source_name,
+                source_author,
+                source_path,
+                id,
+                annotation_source_id,
+                annotation_source_name,
+                annotation_source_author,
+                text,
+                notes,
+                style,
+                epubcfi,
+                {date_created} as date_created,
+                {date_modified} as date_modified,
+                location
+
+            FROM ({query})
+
+            ORDER BY source_name, source_pk, pk;
+        """
+
+        db = self._get_sqlite_file(path=self._paths.local_aeannotation_dir)
+        library = self._get_sqlite_file(path=self._paths.local_bklibrary_dir)
+
+        yield from self._iter_query(
+            sqlite_file=db, query=query, parameters=parameters, attach=library
+        )
+
+    def query_annotations_db_since(self, date_modified: float) -> list:
+        """ Query annotations modified on or after date_modified along with
+        every deleted annotation. Rows flagged with is_deleted or missing their
+        text are tombstones and should be removed from any previous results.
+        Rows that no longer match the filters are flagged as deleted too.
+        """
+
+        where, parameters = self._annotations_where()
+
+        query = f"""
+            SELECT
+                ZAEANNOTATION.ZANNOTATIONASSETID as source_id,
+                ZANNOTATIONUUID as id,
+                ZANNOTATIONSELECTEDTEXT as text,
+                ZANNOTATIONNOTE as notes,
+                ZANNOTATIONSTYLE as style,
+                ZANNOTATIONLOCATION as epubcfi,
+                ZANNOTATIONCREATIONDATE as date_created,
+                ZANNOTATIONMODIFICATIONDATE as date_modified,
+                Z_PK as pk,
+                CASE WHEN {where} THEN ZANNOTATIONDELETED ELSE 1 END as is_deleted
+
+            FROM ZAEANNOTATION
+
+            WHERE ZANNOTATIONMODIFICATIONDATE >= ?
+                OR ZANNOTATIONMODIFICATIONDATE IS NULL
+                OR ZANNOTATIONDELETED = 1
+
+            ORDER BY ZANNOTATIONASSETID, Z_PK;
+        """
+
+        db = self._get_sqlite_file(path=self._paths.local_aeannotation_dir)
+        data = self._execute_query(
+            sqlite_file=db, query=query, parameters=(*parameters, date_modified)
+        )
+
+        return data
+
+    def count_annotations_db(self) -> int:
+
+        where, parameters = self._annotations_where()
+
+        query = f"""
+            SELECT
+                COUNT(*) as count
+
+            FROM ZAEANNOTATION
+
+            WHERE ZANNOTATIONSELECTEDTEXT IS NOT NULL
+                AND ZANNOTATIONDELETED = 0
+                AND {where};
+        """
+
+        db = self._get_sqlite_file(path=self._paths.local_aeannotation_dir)
+        data = self._execute_query(sqlite_file=db, query=query, parameters=parameters)
+
+        return data[0]["count"]
+
+    def _annotations_where(self) -> tuple:
+        """ Conditions filtering annotations. Sources are filtered in the
+        library database so the ids of the matching sources are queried once
+        and used to filter annotations. """
+
+        if self._filters.filters_sources and self._source_ids is None:
+            self._source_ids = [row["source_id"] for row in self.query_sources_db()]
+
+        return self._filters.annotations_where(source_ids=self._source_ids)
+
+    @staticmethod
+    def _convert_date(name: str) -> str:
+        """ Expression formatting the unix timestamp <name> exactly like
+        Annotation._convert_date in a single pass. Like datetime, the fraction
+        of a second is rounded half to even to whole microseconds which are
+        only appended when they aren't zero.
+
+        datetime and substr are used as they're about twice as fast as
+        strftime and printf and the common case of microseconds that don't
+        carry over into the seconds is checked first. Even so, SQLite formats
+        dates more slowly than datetime does. """
+
+        # Whole seconds rounded towards zero and the fraction of a second in
+        # microseconds. Both are exact.
+        seconds = f"CAST({name} AS INTEGER)"
+        fraction = f"(({name} - {seconds}) * 1000000.0)"
+
+        # Whole microseconds rounded towards zero and the fraction of a
+        # microsecond they're rounded half to even with.
+        whole = f"CAST({fraction} AS INTEGER)"
+        rest = f"({fraction} - {whole})"
+        micros = f"""
+            ({whole}
+                + ({rest} > 0.5 OR ({rest} = 0.5 AND {whole} % 2 != 0))
+                - ({rest} < -0.5 OR ({rest} = -0.5 AND {whole} % 2 != 0)))
+        """
+
+        # Microseconds rounded to a whole second or below zero carry over into
+        # the seconds.
+        carry = f"(({micros} >= 1000000) - ({micros} < 0))"
+
+        return f"""
+            CASE
+                WHEN {micros} BETWEEN 1 AND 999999 THEN
+                    replace(datetime({seconds}, 'unixepoch'), ' ', 'T')
+                    || '.' || substr(1000000 + {micros}, 2)
+                WHEN {micros} IN (-1000000, 0, 1000000) THEN
+                    replace(datetime({seconds} + {carry}, 'unixepoch'), ' ', 'T')
+                ELSE
+                    replace(datetime({seconds} + {carry}, 'unixepoch'), ' ', 'T')
+                    || '.' || substr(1000000 + {micros} - 1000000 * {carry}, 2)
+            END
+        """
+
     def _get_sqlite_file(self, path: pathlib.Path) -> pathlib.Path:
         """ Glob full database path. """
 
@@ -67,17 +325,39 @@ class AppleBooksDB:
         except Exception as error:
             raise AppleBooksError(f"Unexpected Error: {repr(error)}")
 
-    def _execute_query(self, sqlite_file, query) -> list:
+    def _execute_query(self, sqlite_file, query, parameters=()) -> list:
 
         connection = self._connect_to_db(sqlite_file)
 
         with connection:
             cursor = connection.cursor()
-            cursor.execute(query)
+            cursor.execute(query, parameters)
             data = cursor.fetchall()
 
         return data
 
+    def _iter_query(
+        self, sqlite_file, query, parameters=(), attach=None
+    ) -> Iterator[tuple]:
+        """ Execute query yielding rows as tuples. The database attach is
+        attached to the connection as library. """
+
+        connection = self._connect_to_db(sqlite_file)
+        connection.row_factory = None
+
+        try:
+            if attach is not None:
+                connection.execute("ATTACH DATABASE ? AS library", (str(attach),))
+
+            cursor = connection.execute(query, parameters)
+
+            for rows in iter(lambda: cursor.fetchmany(self.fetch_size), []):
+                yield from rows
+        except sqlite3.Error as error:
+            raise AppleBooksError(f"SQLite Error: {repr(error)}")
+        finally:
+            connection.close()
+
     def _connect_to_db(self, sqlite_file: pathlib.Path) -> sqlite3.Connection:
         """ Create a database connection to SQLite database. """
 
@@ -1,4 +1,7 @@
-from ..defaults import AppDefaults
+import os
+import pathlib
+
+from ..defaults import AppDefaults, ExportPaths, classproperty
 
 
 class AppleBooksDefaults:
@@ -7,19 +10,87 @@ class AppleBooksDefaults:
     version = "Books v1.19 (1645)"
 
     # applebooks data
-    src_root_dir = (
-        AppDefaults.home / "Library/Containers/com.apple.iBooksX/Data/Documents"
+    src_root_dir = pathlib.Path(
+        os.environ.get(
+            "HLTS_APPLEBOOKS_ROOT",
+            AppDefaults.home / "Library/Containers/com.apple.iBooksX/Data/Documents",
+        )
     )
-    src_bklibrary_dir = src_root_dir / "BKLibrary"
-    src_aeannotation_dir = src_root_dir / "AEAnnotation"
 
     # local data
-    local_root_dir = AppDefaults.day_dir / "applebooks"
-    local_db_dir = local_root_dir / "db"
-    local_bklibrary_dir = local_db_dir / "BKLibrary"
-    local_aeannotation_dir = local_db_dir / "AEAnnotation"
-    sources_json = local_root_dir / "sources.json"
-    annotations_json = local_root_dir / "annotations.json"
+    @classproperty
+    def local_root_dir(cls) -> pathlib.Path:
+        return AppDefaults.day_dir / "applebooks"
+
+    # persistent data
+    state_dir = AppDefaults.root_dir / "applebooks"
+
+    # batch exports of several libraries
+    @classproperty
+    def libraries_dir(cls) -> pathlib.Path:
+        return AppDefaults.day_dir / "libraries"
+
+    libraries_state_dir = AppDefaults.root_dir / "libraries"
 
     # misc
     ns_time_interval_since_1970 = 978307200.0
+    styles = {
+        0: "underline",
+        1: "green",
+        2: "blue",
+        3: "yellow",
+        4: "pink",
+        5: "purple",
+    }
+
+
+class AppleBooksPaths(ExportPaths):
+    """ All paths used by a single AppleBooks library. They're derived from
+    the directory the Books databases are read from, the directory the day's
+    exports are written to and the directory snapshots and sync state are kept
+    in between runs. Each defaults to its AppleBooksDefaults counterpart. The
+    annotation database defaults to the app's. See ExportPaths for the paths
+    of the export itself. """
+
+    def __init__(
+        self,
+        src_root_dir: pathlib.Path = None,
+        local_root_dir: pathlib.Path = None,
+        state_dir: pathlib.Path = None,
+        database_file: pathlib.Path = None,
+    ):
+
+        super().__init__(
+            local_root_dir=local_root_dir or AppleBooksDefaults.local_root_dir,
+            state_dir=state_dir or AppleBooksDefaults.state_dir,
+            database_file=database_file,
+        )
+
+        self.src_root_dir = src_root_dir or AppleBooksDefaults.src_root_dir
+
+        # applebooks data
+        self.src_bklibrary_dir = self.src_root_dir / "BKLibrary"
+        self.src_aeannotation_dir = self.src_root_dir / "AEAnnotation"
+
+        # persistent data
+        self.sync_sqlite = self.state_dir / "sync.sqlite"
+        self.cache_sqlite = self.state_dir / "cache.sqlite"
+        self.local_db_dir = self.state_dir / "db"
+        self.local_bklibrary_dir = self.local_db_dir / "BKLibrary"
+        self.local_aeannotation_dir = self.local_db_dir / "AEAnnotation"
+        self.snapshot_json = self.local_db_dir / "snapshot.json"
+
+    @classmethod
+    def for_library(cls, name: str, src_root_dir: pathlib.Path) -> "AppleBooksPaths":
+        """ Paths of one of several libraries exported together. Everything
+        the library writes is namespaced by name so libraries never share a
+        file. """
+
+        state_dir = AppleBooksDefaults.libraries_state_dir / name
+
+        return cls(
+            src_root_dir=src_root_dir,
+            local_root_dir=AppleBooksDefaults.libraries_dir / name,
+            state_dir=state_dir,
+            database_file=state_dir / "hlts.sqlite",
+        )
@@ -0,0 +1,93 @@
+import functools
+import logging
+import re
+from typing import Optional
+
+
+log = logging.getLogger(__name__)
+
+
+# An assertion e.g. [part01] or [;s=b] where ^ escapes the next character.
+_ASSERTION = r"\[(?:\^.|[^\]^])*\]"
+
+# Splits the inside of an epubcfi(...) into its path and, for ranges, the
+# local paths of the range's start and end. Commas only separate them outside
+# of assertions and when they aren't escaped.
+_PART = rf"(?:\^.|{_ASSERTION}|[^,\[^])*"
+RE_EPUBCFI = re.compile(
+    rf"epubcfi\(({_PART})(?:,({_PART}),({_PART}))?\)", re.DOTALL
+)
+
+# A path made up of steps, character offsets, indirections, temporal and
+# spatial offsets. Steps and character offsets make up the key. The others
+# don't change the order of locations within a book.
+RE_PATH = re.compile(
+    rf"(?:/\d+(?:{_ASSERTION})?"
+    rf"|:\d+(?:{_ASSERTION})?"
+    r"|!"
+    r"|~\d+(?:\.\d+)?"
+    r"|@\d+(?:\.\d+)?:\d+(?:\.\d+)?)*",
+    re.DOTALL,
+)
+
+# Captures the integer of each step and character offset of a valid path.
+# Assertions, temporal and spatial offsets are matched without capturing so
+# their digits are skipped.
+RE_INTEGERS = re.compile(rf"{_ASSERTION}|[~@][\d.:]+|[/:](\d+)", re.DOTALL)
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_epubcfi(epubcfi: str) -> Optional[tuple]:
+    """ Parse an EPUB canonical fragment identifier into a sort key. Starting
+    with: epubcfi(/6/20[part01]!/4/182,/1:0,/3:23)
+
+    Returns the (start, end) of the location it points to where each is a
+    tuple of the integers of its steps followed by its character offset e.g.
+    ((6, 20, 4, 182, 1, 0), (6, 20, 4, 182, 3, 23)). start and end are the
+    same when it isn't a range. Keys of the same book sort in reading order by
+    comparing them. Returns None for a missing or malformed epubcfi.
+
+    See https://idpf.org/epub/linking/cfi/epub-cfi.html """
+
+    if not epubcfi:
+        return None
+
+    match = RE_EPUBCFI.fullmatch(epubcfi)
+
+    if match is None:
+        log.warning(f"Couldn't parse epubcfi {epubcfi}.")
+        return None
+
+    path, start, end = match.groups()
+
+    try:
+        path = _parse_path(path)
+
+        if start is None:
+            return path, path
+
+        # The local paths of a range continue its path.
+        return path + _parse_path(start), path + _parse_path(end)
+    except ValueError:
+        log.warning(f"Couldn't parse epubcfi {epubcfi}.")
+        return None
+
+
+def format_location(key: Optional[tuple]) -> Optional[str]:
+    """ The start of a key returned by parse_epubcfi as a string of zero-padded
+    integers e.g. 0006.0020.0004.0182.0001.0000. Kept as the location
+    exported with each annotation. It doesn't sort correctly once a step is
+    over 9999 so compare keys instead. """
+
+    if key is None:
+        return None
+
+    return ".".join([f"{i:04}" for i in key[0]])
+
+
+def _parse_path(path: str) -> tuple:
+
+    if RE_PATH.fullmatch(path) is None:
+        raise ValueError(f"Invalid path {path!r}.")
+
+    return tuple(map(int, filter(None, RE_INTEGERS.findall(path))))
@@ -0,0 +1,181 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+from ..config import config
+from .defaults import AppleBooksDefaults
+from .errors import AppleBooksError
+
+
+# Matches a relative date e.g. 7d for seven days ago.
+RE_DAYS = re.compile(r"^(\d+)d$")
+
+
+class AppleBooksFilters:
+    """ Restrict which sources and annotations are queried from the Books
+    databases. Each filter becomes a parameterized condition of the queries'
+    WHERE clauses so rows that don't match are never fetched.
+
+    Dates are ISO 8601 dates or datetimes in UTC, or a number of days ago
+    e.g. 7d, resolved when the filters are created. The *_after filters are
+    inclusive and *_before filters exclusive.
+    The starred filter is only a LIKE prefilter on the raw notes. Annotations
+    still need to be checked with Annotation.is_starred once processed. """
+
+    keys = (
+        "source_ids",
+        "authors",
+        "created_after",
+        "created_before",
+        "modified_after",
+        "modified_before",
+        "styles",
+        "starred",
+    )
+
+    def __init__(self, data: dict = None):
+
+        data = data or {}
+
+        for key in data:
+            if key not in self.keys:
+                raise AppleBooksError(f"Unknown filter '{key}'.")
+
+        self.source_ids = data.get("source_ids") or []
+        self.authors = data.get("authors") or []
+        self.created_after = data.get("created_after")
+        self.created_before = data.get("created_before")
+        self.modified_after = data.get("modified_after")
+        self.modified_before = data.get("modified_before")
+        self.styles = data.get("styles") or []
+        self.starred = data.get("starred", False)
+
+        self._style_indexes = [self._convert_style(style) for style in self.styles]
+        self._dates = [
+            (column, operator, self._convert_date(date))
+            for column, operator, date in [
+                ("ZANNOTATIONCREATIONDATE", ">=", self.created_after),
+                ("ZANNOTATIONCREATIONDATE", "<", self.created_before),
+                ("ZANNOTATIONMODIFICATIONDATE", ">=", self.modified_after),
+                ("ZANNOTATIONMODIFICATIONDATE", "<", self.modified_before),
+            ]
+            if date is not None
+        ]
+
+    def __bool__(self):
+        return any(self.serialize().values())
+
+    @property
+    def filters_sources(self) -> bool:
+        """ Whether only some sources are queried. """
+        return bool(self.source_ids or self.authors)
+
+    def sources_where(self) -> tuple:
+        """ Conditions on ZBKLIBRARYASSET and their parameters. """
+
+        conditions = []
+        parameters = []
+
+        self._where_in(conditions, parameters, "ZASSETID", self.source_ids)
+        self._where_in(conditions, parameters, "ZAUTHOR", self.authors)
+
+        return self._join(conditions), tuple(parameters)
+
+    def annotations_where(self, source_ids: list = None) -> tuple:
+        """ Conditions on ZAEANNOTATION and their parameters. source_ids are
+        the ids of the sources matching sources_where when filters_sources. """
+
+        conditions = []
+        parameters = []
+
+        if self.filters_sources and not source_ids:
+            # No sources matched so no annotations can match either.
+            conditions.append("0")
+        elif self.filters_sources:
+            self._where_in(conditions, parameters, "ZANNOTATIONASSETID", source_ids)
+
+        self._annotations_conditions(conditions, parameters)
+
+        return self._join(conditions), tuple(parameters)
+
+    def joined_where(self) -> tuple:
+        """ Conditions on ZAEANNOTATION joined with ZBKLIBRARYASSET and their
+        parameters. """
+
+        conditions = []
+        parameters = []
+
+        self._where_in(conditions, parameters, "ZASSETID", self.source_ids)
+        self._where_in(conditions, parameters, "ZAUTHOR", self.authors)
+        self._annotations_conditions(conditions, parameters)
+
+        return self._join(conditions), tuple(parameters)
+
+    def serialize(self) -> dict:
+        return {key: getattr(self, key) for key in self.keys}
+
+    def _annotations_conditions(self, conditions: list, parameters: list):
+
+        for column, operator, date in self._dates:
+            conditions.append(f"{column} {operator} ?")
+            parameters.append(date)
+
+        self._where_in(conditions, parameters, "ZANNOTATIONSTYLE", self._style_indexes)
+
+        if self.starred:
+            conditions.append("ZANNOTATIONNOTE LIKE ? ESCAPE '\\'")
+            parameters.append(f"%{self._escape(self._starred_token)}%")
+
+    @property
+    def _starred_token(self) -> str:
+        return f"{config.collection_prefix}{config.starred_collection}"
+
+    @staticmethod
+    def _where_in(conditions: list, parameters: list, column: str, values: list):
+
+        if not values:
+            return
+
+        placeholders = ", ".join("?" for _ in values)
+
+        conditions.append(f"{column} IN ({placeholders})")
+        parameters.extend(values)
+
+    @staticmethod
+    def _join(conditions: list) -> str:
+        """ Join conditions into a single condition that's always true when
+        there are none. """
+        return " AND ".join(conditions) or "1"
+
+    @staticmethod
+    def _convert_date(date: str) -> float:
+        """ Converts a filter date to a Core Data timestamp. """
+
+        try:
+            match = RE_DAYS.match(date)
+
+            if match is not None:
+                date = datetime.now(timezone.utc) - timedelta(days=int(match[1]))
+            else:
+                date = datetime.fromisoformat(date)
+        except (TypeError, ValueError):
+            raise AppleBooksError(f"Invalid filter date '{date}'.")
+
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+
+        return date.timestamp() - AppleBooksDefaults.ns_time_interval_since_1970
+
+    @staticmethod
+    def _convert_style(style: str) -> int:
+        """ Converts a style string to its AppleBooks style index. """
+
+        for index, name in AppleBooksDefaults.styles.items():
+            if name == style:
+                return index
+
+        raise AppleBooksError(f"Unknown style '{style}'.")
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        """ Escape LIKE wildcards using \\ as the escape character. """
+        return re.sub(r"([\\%_])", r"\\\1", value)
@@ -1,34 +1,106 @@
+import bisect
+import functools
 import logging
 import re
 from datetime import datetime
+from typing import Iterable
 
 from ..config import config
 from .defaults import AppleBooksDefaults
+from .epubcfi import format_location, parse_epubcfi
 
 
 log = logging.getLogger(__name__)
 
 
-TAG_PREFIX = config.tag_prefix
-COLLECTION_PREFIX = config.collection_prefix
-STARRED_COLLECTION = config.starred_collection
-
-RE_TAGS = re.compile(f"\B{TAG_PREFIX}[^{TAG_PREFIX}\s]+\s?")
-RE_COLLECTIONS = re.compile(f"\B{COLLECTION_PREFIX}[^{COLLECTION_PREFIX}\s]+\s?")
+# Columns of the rows Sources and Annotations are created from. Rows are plain
+# tuples with their values in this order. See AppleBooksDB.iter_annotations.
+SOURCE_COLUMNS = ("source_id", "source_name", "source_author", "source_path")
+ANNOTATION_COLUMNS = (
+    "id",
+    "source_id",
+    "source_name",
+    "source_author",
+    "text",
+    "notes",
+    "style",
+    "epubcfi",
+    "date_created",
+    "date_modified",
+    "location",
+)
+
+# Index of each column processed by an Annotation in its row.
+TEXT, NOTES, STYLE, EPUBCFI, DATE_CREATED, DATE_MODIFIED, LOCATION = (
+    ANNOTATION_COLUMNS.index(column)
+    for column in (
+        "text",
+        "notes",
+        "style",
+        "epubcfi",
+        "date_created",
+        "date_modified",
+        "location",
+    )
+)
+
+# Slots of an Annotation derived by processing its row. Those not listed here
+# are copied straight from the row. See AnnotationCache.
+PROCESSED_SLOTS = (
+    "text",
+    "notes",
+    "tags",
+    "collections",
+    "date_created",
+    "date_modified",
+    "style",
+    "location",
+    "location_key",
+    "is_starred",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def notes_pattern(tag_prefix: str, collection_prefix: str) -> re.Pattern:
+    """ Matches a #tag or @collection token along with one trailing whitespace
+    character. Only one of the tag or collection groups is set per match.
+    Compiled on first use for each pair of prefixes so it follows config. """
+
+    tag = re.escape(tag_prefix)
+    collection = re.escape(collection_prefix)
+
+    return re.compile(
+        rf"\B(?:{tag}(?P<tag>[^{tag}\s]+)"
+        rf"|{collection}(?P<collection>[^{collection}\s]+))\s?"
+    )
 
 
 class Source:
-    def __init__(self, data: dict):
 
-        self._data = data
+    __slots__ = ("id", "name", "author", "path", "_annotations", "_keys")
+
+    # Its serialization encoded by json.dumps(..., indent=4, ensure_ascii=False)
+    # when it's already encoded e.g. by AppleBooksSync. See Export.save.
+    encoded = None
+
+    def __init__(self, row: tuple):
 
+        self.id, self.name, self.author, self.path = row
+
+        # Annotations are kept sorted by their location_key as they're added.
+        # The keys are kept in a parallel list to bisect against.
         self._annotations = []
+        self._keys = []
 
     def __repr__(self):
         return f"<{self.__class__.__name__}: {self.name} by {self.author}>"
 
     def add_annotation(self, annotation):
-        self._annotations.append(annotation)
+
+        index = bisect.bisect_right(self._keys, annotation.location_key)
+
+        self._annotations.insert(index, annotation)
+        self._keys.insert(index, annotation.location_key)
 
     @property
     def has_annotations(self):
@@ -36,23 +108,7 @@ class Source:
 
     @property
     def annotations(self):
-        return sorted(self._annotations, key=lambda a: a.location)
-
-    @property
-    def id(self):
-        return self._data.get("source_id")
-
-    @property
-    def name(self):
-        return self._data.get("source_name")
-
-    @property
-    def author(self):
-        return self._data.get("source_author")
-
-    @property
-    def path(self):
-        return self._data.get("source_path")
+        return self._annotations
 
     def serialize(self):
 
@@ -68,93 +124,183 @@ class Source:
 
 
 class Annotation:
+    """ All values are derived from the database row once when the Annotation
+    is created and stored in slots. The row itself isn't kept. """
+
+    __slots__ = (
+        "id",
+        "text",
+        "notes",
+        "source_id",
+        "source_name",
+        "source_author",
+        "tags",
+        "collections",
+        "date_created",
+        "date_modified",
+        "style",
+        "epubcfi",
+        "location",
+        "location_key",
+        "is_starred",
+    )
 
     origin = AppleBooksDefaults.name
 
-    _notes = ""
-    _tags = []
-    _collections = []
-    _is_starred = False
+    # Its serialization already encoded along with its hash, see Source.
+    encoded = None
+    digest = None
+
+    def __init__(self, row: tuple):
 
-    def __init__(self, data: dict):
+        self.id, self.source_id, self.source_name, self.source_author = row[:4]
+        self.epubcfi = row[EPUBCFI]
 
-        self._data = data
+        self.notes = ""
+        self.tags = []
+        self.collections = []
+        self.is_starred = False
 
-        self._process()
+        for step in self._pipeline:
+            step(self, row)
+
+    def __init_subclass__(cls, **kwargs):
+
+        super().__init_subclass__(**kwargs)
+
+        # Steps overridden by a subclass take the place of the ones they
+        # override. Resolved once per class like the pipeline itself.
+        cls._pipeline = tuple(getattr(cls, step.__name__) for step in cls._pipeline)
 
     def __repr__(self):
         return f"<{self.__class__.__name__}: {self.text[:50].strip()}...>"
 
-    def _process(self):
+    def __getstate__(self):
+        """ Pickle Annotations as a plain tuple of their slot values to keep
+        results sent back from worker processes compact. """
+        return tuple(getattr(self, name) for name in Annotation.__slots__)
+
+    def __setstate__(self, state):
+
+        for name, value in zip(Annotation.__slots__, state):
+            setattr(self, name, value)
 
-        for attr in dir(self):
-            if attr.startswith("_process_"):
-                getattr(self, attr)()
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> list:
+        """ Create Annotations from a batch of rows. """
+        return [cls(row) for row in rows]
 
-    def _process_text(self):
+    @classmethod
+    def from_record(cls, row: tuple, record: tuple) -> "Annotation":
+        """ Create an Annotation from its row and the values of its
+        PROCESSED_SLOTS as returned by Annotation.record, skipping
+        processing. """
 
-        _text = self._data.get("text", "")
+        annotation = cls.__new__(cls)
 
-        # Remove single and double curly quotes.
+        (
+            annotation.id,
+            annotation.source_id,
+            annotation.source_name,
+            annotation.source_author,
+        ) = row[:4]
+        annotation.epubcfi = row[EPUBCFI]
+
+        for name, value in zip(PROCESSED_SLOTS, record):
+            setattr(annotation, name, value)
+
+        return annotation
+
+    def record(self) -> tuple:
+        """ Values of the Annotation's PROCESSED_SLOTS. """
+        return tuple(getattr(self, name) for name in PROCESSED_SLOTS)
+
+    @classmethod
+    def row(cls, data: dict) -> tuple:
+        """ Convert a row queried as a dict to a tuple row. """
+        return tuple(data.get(column) for column in ANNOTATION_COLUMNS)
+
+    def _process_text(self, row: tuple):
+
+        _text = row[TEXT]
+
+        # Replace single and double curly quotes with straight quotes.
         _text = _text.replace("\u2018", "'").replace("\u2019", "'")
         _text = _text.replace("\u201c", '"').replace("\u201d", '"')
-        # Strip trailing new lines and split into paragraphs.
-        _text = _text.rstrip("\n").split("\n")
-        # Strip trailing whitespace.
-        _text = [t.strip() for t in _text]
-        # Remove any empty items in list.
-        _text = list(filter(None, _text))
 
-        self._text = _text
+        # Split into paragraphs.
+        _text = _text.split("\n")
+        # Strip surrounding whitespace and remove any empty paragraphs.
+        _text = [t for t in map(str.strip, _text) if t]
+
+        self.text = _text
 
-    def _process_tags(self):
+    def _process_notes(self, row: tuple):
+        """ Tokenize notes in a single pass. Tags and collections are collected
+        as they are removed from the notes. """
 
-        _notes = self._data.get("notes", "")
+        notes = row[NOTES]
 
-        if not _notes:
+        if not notes:
             return
 
-        _tags = re.findall(RE_TAGS, _notes)
-        _tags = [t.strip() for t in _tags]
-        _tags = [t.replace(TAG_PREFIX, "") for t in _tags]
+        tags = []
+        collections = []
 
-        self._tags = _tags
+        def tokenize(match):
 
-    def _process_collections(self):
+            tag, collection = match.group("tag", "collection")
 
-        _notes = self._data.get("notes", "")
+            if tag is not None:
+                tags.append(tag)
+            else:
+                collections.append(collection)
 
-        if not _notes:
-            return
+            return ""
+
+        pattern = notes_pattern(config.tag_prefix, config.collection_prefix)
 
-        _collections = re.findall(RE_COLLECTIONS, _notes)
-        _collections = [c.strip() for c in _collections]
-        _collections = [c.replace(COLLECTION_PREFIX, "") for c in _collections]
+        _notes = pattern.sub(tokenize, notes)
 
         try:
-            _collections.remove(STARRED_COLLECTION)
+            collections.remove(config.starred_collection)
         except ValueError:
-            """ ValueError means _collections does not contain the
+            """ ValueError means collections does not contain the
             starred_collection item therefore it was never 'starred'. """
             pass
         else:
-            self._is_starred = True
+            self.is_starred = True
 
-        self._collections = _collections
+        self.notes = _notes.strip()
+        self.tags = tags
+        self.collections = collections
 
-    def _process_notes(self):
+    def _process_dates(self, row: tuple):
 
-        _notes = self._data["notes"]
+        self.date_created = self._convert_date(row[DATE_CREATED])
+        self.date_modified = self._convert_date(row[DATE_MODIFIED])
 
-        if not _notes:
-            return
+    def _process_style(self, row: tuple):
+
+        self.style = self._convert_style(row[STYLE])
+
+    def _process_location(self, row: tuple):
 
-        # Remove tags and collections from notes.
-        _notes = re.sub(RE_TAGS, "", _notes)
-        _notes = re.sub(RE_COLLECTIONS, "", _notes)
-        _notes = _notes.strip()
+        # Rows of Books have no location. It is derived from the epubcfi.
+        key = parse_epubcfi(self.epubcfi)
 
-        self.__notes = _notes
+        self.location = format_location(key)
+        self.location_key = key or ()
+
+    # Steps run on every row in order. Resolved once here rather than looked
+    # up by name for every Annotation.
+    _pipeline = (
+        _process_text,
+        _process_notes,
+        _process_dates,
+        _process_style,
+        _process_location,
+    )
 
     def _convert_date(self, epoch: float) -> str:
         """ Converts Epoch to ISO861"""
@@ -175,102 +321,7 @@ class Annotation:
     @staticmethod
     def _convert_style(index: int) -> str:
         """ Converts AppleBooks style index to style string. """
-        return {
-            0: "underline",
-            1: "green",
-            2: "blue",
-            3: "yellow",
-            4: "pink",
-            5: "purple",
-        }.get(index)
-
-    @staticmethod
-    def _parse_epubcfi(epubcfi: str):
-        """ Starting with: epubcfi(/6/20[part01]!/4/182,/1:0,/3:23)
-        via https://github.com/matttrent/ibooks-highlights/blob/master/ibooks_highlights/util.py#L20
-        """
-
-        # Captures one or more numbers after a slash /0 /00 /000 etc.
-        RE_DIGITS = re.compile(r"\/(\d+)")
-
-        if not epubcfi:
-            return None
-
-        # "/6/20[part01]!/4/182,/1:0,/3:23"
-        core = epubcfi[8:-1]
-        # ["/6/20[part01]!/4/182", "/1:0", "/3:23"]
-        core_parts = core.split(",")
-        # "/6/20[part01]!/4/182/1:0"
-        head = core_parts[0] + core_parts[1]
-        # ["/6/20[part01]!/4/182/1", "0"]
-        head_parts = head.split(":")
-        # [6, 20, 4, 182, 1]
-        offsets = [int(x) for x in re.findall(RE_DIGITS, head_parts[0])]
-
-        try:
-            # [6, 20, 4, 182, 1, 0]
-            offsets.append(int(head_parts[1]))
-        except IndexError:
-            pass
-
-        # 0006.0020.0004.0182.0001.0000
-        return ".".join([f"{i:04}" for i in offsets])
-
-    @property
-    def id(self):
-        return self._data.get("id")
-
-    @property
-    def text(self):
-        return self._text
-
-    @property
-    def source_id(self):
-        return self._data.get("source_id")
-
-    @property
-    def source_name(self):
-        return self._data.get("source_name")
-
-    @property
-    def source_author(self):
-        return self._data.get("source_author")
-
-    @property
-    def notes(self):
-        return self._notes
-
-    @property
-    def tags(self):
-        return self._tags
-
-    @property
-    def collections(self):
-        return self._collections
-
-    @property
-    def date_created(self):
-        return self._convert_date(self._data.get("date_created"))
-
-    @property
-    def date_modified(self):
-        return self._convert_date(self._data.get("date_modified"))
-
-    @property
-    def style(self):
-        return self._convert_style(self._data.get("style"))
-
-    @property
-    def epubcfi(self):
-        return self._data.get("epubcfi")
-
-    @property
-    def location(self):
-        return self._parse_epubcfi(self._data.get("epubcfi"))
-
-    @property
-    def is_starred(self):
-        return self._is_starred
+        return AppleBooksDefaults.styles.get(index)
 
     def serialize(self, source=True):
 
@@ -300,3 +351,19 @@ class Annotation:
             del data["source"]
 
         return data
+
+
+class ConvertedAnnotation(Annotation):
+    """ Annotation created from a row whose dates and style were already
+    converted by the query. See AppleBooksDB.iter_annotations. """
+
+    __slots__ = ()
+
+    def _process_dates(self, row: tuple):
+
+        self.date_created = row[DATE_CREATED]
+        self.date_modified = row[DATE_MODIFIED]
+
+    def _process_style(self, row: tuple):
+
+        self.style = row[STYLE]
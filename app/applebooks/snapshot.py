@@ -0,0 +1,165 @@
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from ..utilities import utilities
+from .db import AppleBooksDB
+from .defaults import AppleBooksPaths
+from .errors import AppleBooksError
+
+
+log = logging.getLogger(__name__)
+
+
+class AppleBooksSnapshot:
+    """ Snapshot the AppleBooks databases using the SQLite backup API. Only the
+    *.sqlite file AppleBooksDB would query is copied. Reading it through a
+    read-only connection gives a consistent copy that includes any pages still
+    in the write-ahead log. A snapshot is skipped when the source database
+    hasn't changed since the previous one. """
+
+    def __init__(self, paths: AppleBooksPaths = None):
+
+        self._paths = paths or AppleBooksPaths()
+        self._jobs = [
+            (
+                self._paths.src_bklibrary_dir,
+                self._paths.local_bklibrary_dir,
+            ),
+            (
+                self._paths.src_aeannotation_dir,
+                self._paths.local_aeannotation_dir,
+            ),
+        ]
+
+        self.updated = []
+
+    def run(self, src_dirs: list = None) -> int:
+        """ Snapshot both databases and return the number of bytes written.
+        When src_dirs is given only the databases in those directories are
+        checked for changes. The others are only snapshot if they haven't been
+        yet. The directories of the snapshots that were written are kept in
+        updated. """
+
+        signatures = self._load_signatures()
+
+        jobs = [
+            (src_dir, dest_dir)
+            for src_dir, dest_dir in self._jobs
+            if src_dirs is None
+            or src_dir in src_dirs
+            or not any(dest_dir.glob("*.sqlite"))
+        ]
+
+        if not jobs:
+            log.info("Skipping snapshots of unchanged databases.")
+            return 0
+
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = [
+                executor.submit(self._snapshot, src_dir, dest_dir, signatures)
+                for src_dir, dest_dir in jobs
+            ]
+            results = [future.result() for future in futures]
+
+        for dest_dir, signature, bytes_written in results:
+
+            signatures[dest_dir.name] = signature
+
+            if bytes_written:
+                self.updated.append(dest_dir)
+
+        self._save_signatures(signatures)
+
+        return sum(bytes_written for _, _, bytes_written in results)
+
+    def _snapshot(
+        self, src_dir: pathlib.Path, dest_dir: pathlib.Path, signatures: dict
+    ) -> tuple:
+
+        src_file = AppleBooksDB()._get_sqlite_file(path=src_dir)
+        dest_file = dest_dir / src_file.name
+
+        signature = self._signature(src_file)
+
+        if dest_file.exists() and signatures.get(dest_dir.name) == signature:
+            log.info(f"Skipping snapshot of unchanged {src_file.name}.")
+            return dest_dir, signature, 0
+
+        log.info(f"Snapshotting {src_file.name}...")
+
+        utilities.make_dir(path=dest_dir)
+
+        # Remove databases left over from previous snapshots so AppleBooksDB
+        # only finds the current one.
+        for stale_file in dest_dir.glob("*.sqlite"):
+            if stale_file.name != src_file.name:
+                stale_file.unlink()
+
+        dest_file_tmp = dest_file.with_suffix(".tmp")
+
+        # Both connections are closed even when the backup fails so neither
+        # file is left open.
+        try:
+            with contextlib.closing(
+                sqlite3.connect(f"{src_file.as_uri()}?mode=ro", uri=True)
+            ) as src, contextlib.closing(sqlite3.connect(dest_file_tmp)) as dest:
+                src.backup(dest)
+        except sqlite3.Error as error:
+            raise AppleBooksError(f"SQLite Error: {repr(error)}")
+        except Exception as error:
+            raise AppleBooksError(f"Unexpected Error: {repr(error)}")
+
+        os.replace(dest_file_tmp, dest_file)
+
+        return dest_dir, signature, dest_file.stat().st_size
+
+    @staticmethod
+    def _signature(sqlite_file: pathlib.Path) -> dict:
+        """ Build a signature of the database from its size, mtime and the file
+        change counter stored in the header at offset 24. Commits that are
+        still in the write-ahead log don't touch the main file so the -wal
+        file's size and mtime are included as well. """
+
+        stat = sqlite_file.stat()
+
+        with open(sqlite_file, "rb") as f:
+            header = f.read(100)
+
+        signature = {
+            "name": sqlite_file.name,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "change_counter": int.from_bytes(header[24:28], "big"),
+        }
+
+        wal_file = sqlite_file.with_name(f"{sqlite_file.name}-wal")
+
+        try:
+            wal_stat = wal_file.stat()
+        except FileNotFoundError:
+            pass
+        else:
+            signature["wal_size"] = wal_stat.st_size
+            signature["wal_mtime"] = wal_stat.st_mtime_ns
+
+        return signature
+
+    def _load_signatures(self) -> dict:
+
+        try:
+            with open(self._paths.snapshot_json, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        except Exception as error:
+            raise AppleBooksError(f"Unexpected Error: {repr(error)}")
+
+    def _save_signatures(self, signatures: dict) -> None:
+
+        with open(self._paths.snapshot_json, "w") as f:
+            json.dump(signatures, f, indent=4)
@@ -0,0 +1,483 @@
+import json
+import logging
+import marshal
+import sqlite3
+from collections import Counter
+
+from ..changes import ChangeSet
+from ..config import config
+from ..utilities import utilities
+from .db import AppleBooksDB
+from .defaults import AppleBooksDefaults, AppleBooksPaths
+from .errors import AppleBooksError
+from .filters import AppleBooksFilters
+from .models import Source
+
+
+log = logging.getLogger(__name__)
+
+
+class SyncedSource:
+    """ Source along with its Annotations as they were exported by an
+    incremental run. Its serialization and those of its Annotations are kept
+    encoded like JSONWriter writes them so they're never encoded again. It's
+    only decoded when a format needs the serialization itself. """
+
+    __slots__ = ("id", "encoded", "annotations", "_data")
+
+    def __init__(self, id_: str, encoded: str, annotations: list, data: dict = None):
+
+        self.id = id_
+        self.encoded = encoded
+        self.annotations = annotations
+
+        self._data = data
+
+    def serialize(self) -> dict:
+
+        if self._data is not None:
+            return self._data
+
+        return json.loads(self.encoded)
+
+
+class SyncedAnnotation:
+    """ Annotation as it was exported by an incremental run along with the
+    hash it was exported with. See SyncedSource. """
+
+    __slots__ = ("id", "encoded", "digest", "_data")
+
+    def __init__(self, id_: str, encoded: str, digest: str, data: dict = None):
+
+        self.id = id_
+        self.encoded = encoded
+        self.digest = digest
+
+        self._data = data
+
+    def serialize(self, source=True) -> dict:
+
+        data = self._data
+
+        if data is None:
+            data = json.loads(self.encoded)
+
+        if not source:
+            data = {key: value for key, value in data.items() if key != "source"}
+
+        return data
+
+
+class AppleBooksSync:
+    """ Incrementally sync annotations against the state saved by the
+    previous run in sync.sqlite. The state holds a high-water mark i.e. the
+    latest date_modified seen, the id of every annotation queried along with
+    its source and, for each source, its row, the number of annotations
+    queried and its outputs i.e. the Source and its Annotations as they were
+    exported. See SyncedSource.
+
+    Only annotations modified since the high-water mark along with any
+    tombstones are queried. The sources they belong to, along with those whose
+    rows changed, are queried again in full and processed. Every other source
+    is restored from its outputs so the cost of a run grows with the number
+    of changes rather than the size of the library. The state is only valid
+    for the filters and note syntax it was synced with. """
+
+    # Bump whenever the outputs saved or the way they're produced change.
+    version = 1
+
+    # Number of ids looked up per query. Kept well below SQLite's limit on the
+    # number of parameters.
+    batch_size = 500
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS sources (
+            id TEXT PRIMARY KEY,
+            row BLOB,
+            count INTEGER NOT NULL,
+            outputs BLOB
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS annotations (
+            id TEXT PRIMARY KEY,
+            source_id TEXT NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(
+        self,
+        db: AppleBooksDB,
+        paths: AppleBooksPaths = None,
+        filters: AppleBooksFilters = None,
+    ):
+
+        self._db = db
+        self._paths = paths or AppleBooksPaths()
+        self._filters = filters or AppleBooksFilters()
+
+        # Ids of the sources in the order they're exported in.
+        self.sources = []
+
+        self.count_restored = 0
+        self.count_processed = 0
+
+        self._connection = None
+        self._is_full = False
+        self._date_modified = None
+        self._rows = {}
+        self._dirty = {}
+
+    def __enter__(self):
+
+        self.open()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def query(self, sources: list) -> list:
+        """ Query the annotations of the sources that changed since the
+        previous run. sources are the rows of every source as queried by
+        AppleBooksDB.query_sources_db. Annotations are ordered like those of
+        AppleBooksDB.query_annotations_db. The remaining sources are restored
+        by restore once the state is opened. """
+
+        self.sources = [source["source_id"] for source in sources]
+        self._rows = {
+            source["source_id"]: (
+                source["source_id"],
+                source["source_name"],
+                source["source_author"],
+                source["source_path"],
+            )
+            for source in sources
+        }
+
+        connection = self._connect()
+
+        try:
+            annotations = self._query(connection)
+        finally:
+            connection.close()
+
+        if annotations is None:
+            annotations = self._full_sync()
+
+        counts = Counter(row["source_id"] or "" for row in annotations)
+
+        # The count and ids of the annotations of each source queried.
+        self._dirty = {source_id: [counts[source_id], []] for source_id in self._dirty}
+
+        for row in annotations:
+            self._dirty[row["source_id"] or ""][1].append(row["id"])
+
+        return annotations
+
+    def restore(self, source_id: str) -> SyncedSource:
+        """ Restore a source that didn't change along with its Annotations.
+        Returns None when it changed or had no annotations exported. """
+
+        if source_id in self._dirty:
+            return None
+
+        (outputs,) = self._connection.execute(
+            "SELECT outputs FROM sources WHERE id = ?;", (source_id,)
+        ).fetchone() or (None,)
+
+        if outputs is None:
+            return None
+
+        encoded, annotations = marshal.loads(outputs)
+
+        self.count_restored += 1
+
+        return SyncedSource(
+            source_id,
+            encoded,
+            [SyncedAnnotation(*annotation) for annotation in annotations],
+        )
+
+    def put(self, source: Source, annotations: list) -> SyncedSource:
+        """ Save the outputs of a source that changed once it's processed and
+        return it as a SyncedSource. """
+
+        synced = []
+
+        for annotation in annotations:
+
+            data = annotation.serialize()
+            encoded = json.dumps(data, indent=4, ensure_ascii=False)
+
+            synced.append(
+                SyncedAnnotation(annotation.id, encoded, ChangeSet.hash(data), data)
+            )
+
+        data = source.serialize()
+        encoded = json.dumps(data, indent=4, ensure_ascii=False)
+        outputs = (encoded, [(a.id, a.encoded, a.digest) for a in synced])
+
+        self._save_source(source.id, outputs=marshal.dumps(outputs))
+
+        self.count_processed += 1
+
+        return SyncedSource(source.id, encoded, synced, data)
+
+    def open(self) -> None:
+
+        self._connection = self._connect()
+
+        self._connection.execute("BEGIN")
+
+        if self._is_full:
+            self._connection.execute("DELETE FROM sources")
+            self._connection.execute("DELETE FROM annotations")
+
+        dirty = sorted(self._dirty)
+
+        for start in range(0, len(dirty), self.batch_size):
+
+            batch = dirty[start : start + self.batch_size]
+            placeholders = ", ".join("?" for _ in batch)
+
+            self._connection.execute(
+                f"DELETE FROM annotations WHERE source_id IN ({placeholders});",
+                batch,
+            )
+
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO annotations (id, source_id) VALUES (?, ?);",
+            (
+                (id_, source_id)
+                for source_id, (_, ids) in self._dirty.items()
+                for id_ in ids
+            ),
+        )
+
+        # Sources that turn out to have nothing to export keep their count
+        # without any outputs.
+        for source_id in dirty:
+            self._save_source(source_id, outputs=None)
+
+    def close(self) -> None:
+
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?);",
+            [
+                ("signature", self._signature()),
+                ("date_modified", json.dumps(self._date_modified)),
+            ],
+        )
+
+        self._connection.execute("DELETE FROM sources WHERE count = 0")
+        self._connection.execute("COMMIT")
+        self._connection.close()
+        self._connection = None
+
+        log.info(
+            f"Restored {self.count_restored} unchanged sources and processed "
+            f"{self.count_processed} changed sources."
+        )
+
+    def abort(self) -> None:
+
+        self._connection.execute("ROLLBACK")
+        self._connection.close()
+        self._connection = None
+
+    def _query(self, connection: sqlite3.Connection):
+        """ Query the annotations of the sources that changed since the state
+        was saved. Returns None when the state can't be used. """
+
+        meta = dict(connection.execute("SELECT key, value FROM meta;"))
+
+        if not meta:
+            log.info("No previous sync found. Querying all annotations...")
+            return None
+
+        if meta["signature"] != self._signature():
+            log.info(
+                "Filters or note syntax changed since previous sync. Querying all "
+                "annotations..."
+            )
+            return None
+
+        date_modified = json.loads(meta["date_modified"])
+        changes = self._db.query_annotations_db_since(date_modified=date_modified)
+
+        previous = {
+            source_id: (row, count)
+            for source_id, row, count in connection.execute(
+                "SELECT id, row, count FROM sources;"
+            )
+        }
+
+        # Sources that changed, those that annotations were added to, modified
+        # in or deleted from along with those an annotation was moved from.
+        dirty = {
+            source_id
+            for source_id, (row, _) in previous.items()
+            if marshal.loads(row) != self._rows.get(source_id)
+        }
+
+        # Annotations modified at the high-water mark itself are queried again
+        # in case others were modified at the same time. Those already synced
+        # are skipped.
+        synced = self._synced_ids(
+            connection,
+            [row["id"] for row in changes if row["date_modified"] == date_modified],
+        )
+
+        changes = [
+            row for row in changes if row["id"] not in synced or row["is_deleted"]
+        ]
+
+        count_updated = 0
+        count_deleted = 0
+
+        for row in changes:
+            if row["is_deleted"] or row["text"] is None:
+                count_deleted += 1
+            else:
+                dirty.add(row["source_id"] or "")
+                count_updated += 1
+
+        dirty.update(self._source_ids(connection, [row["id"] for row in changes]))
+
+        annotations = self._db.query_annotations_db(source_ids=list(dirty))
+        count = sum(
+            count
+            for source_id, (_, count) in previous.items()
+            if source_id not in dirty
+        )
+
+        if count + len(annotations) != self._db.count_annotations_db():
+            """ Annotations were removed from the database without leaving a
+            tombstone behind. The restored sources can't be trusted to match a
+            full rebuild so we fall back to one. """
+            log.warning("Annotation count mismatch. Querying all annotations...")
+            return None
+
+        log.info(
+            f"Synced {count_updated} updated and {count_deleted} deleted "
+            f"annotations since {date_modified}."
+        )
+
+        self._dirty = dirty
+        self._date_modified = self._max_date_modified(changes, default=date_modified)
+
+        return annotations
+
+    def _full_sync(self) -> list:
+
+        annotations = self._db.query_annotations_db()
+
+        self._is_full = True
+        self._dirty = {row["source_id"] or "" for row in annotations}
+        self._date_modified = self._max_date_modified(annotations)
+
+        return annotations
+
+    def _source_ids(self, connection: sqlite3.Connection, ids: list) -> set:
+        """ Ids of the sources the annotations with ids belonged to. """
+
+        source_ids = set()
+
+        for start in range(0, len(ids), self.batch_size):
+
+            batch = ids[start : start + self.batch_size]
+            placeholders = ", ".join("?" for _ in batch)
+
+            source_ids.update(
+                source_id
+                for (source_id,) in connection.execute(
+                    f"""
+                    SELECT DISTINCT source_id
+                    FROM annotations
+                    WHERE id IN ({placeholders});
+                    """,
+                    batch,
+                )
+            )
+
+        return source_ids
+
+    def _synced_ids(self, connection: sqlite3.Connection, ids: list) -> set:
+        """ Ids of the annotations with ids that were synced. """
+
+        synced = set()
+
+        for start in range(0, len(ids), self.batch_size):
+
+            batch = ids[start : start + self.batch_size]
+            placeholders = ", ".join("?" for _ in batch)
+
+            synced.update(
+                id_
+                for (id_,) in connection.execute(
+                    f"SELECT id FROM annotations WHERE id IN ({placeholders});",
+                    batch,
+                )
+            )
+
+        return synced
+
+    def _save_source(self, source_id: str, outputs: bytes) -> None:
+
+        count, _ = self._dirty[source_id]
+
+        self._connection.execute(
+            """
+            INSERT OR REPLACE INTO sources (id, row, count, outputs)
+            VALUES (?, ?, ?, ?);
+            """,
+            (source_id, marshal.dumps(self._rows.get(source_id)), count, outputs),
+        )
+
+    @staticmethod
+    def _max_date_modified(rows: list, default: float = 0.0) -> float:
+
+        dates = [r["date_modified"] for r in rows if r["date_modified"] is not None]
+
+        return max(dates, default=default)
+
+    def _signature(self) -> str:
+        """ Everything the saved state depends on besides the databases. """
+
+        return json.dumps(
+            {
+                "version": self.version,
+                "applebooks": AppleBooksDefaults.version,
+                "marshal": marshal.version,
+                "filters": self._filters.serialize(),
+                "tag_prefix": config.tag_prefix,
+                "collection_prefix": config.collection_prefix,
+                "starred_collection": config.starred_collection,
+            }
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+
+        utilities.make_dir(path=self._paths.state_dir)
+
+        try:
+            # Transactions are managed explicitly.
+            connection = sqlite3.connect(self._paths.sync_sqlite, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(self.schema)
+        except sqlite3.Error as error:
+            raise AppleBooksError(f"SQLite Error: {repr(error)}")
+        except Exception as error:
+            raise AppleBooksError(f"Unexpected Error: {repr(error)}")
+
+        return connection
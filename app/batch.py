@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import pathlib
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .applebooks import AppleBooks
+from .applebooks.defaults import AppleBooksDefaults, AppleBooksPaths
+from .config import config
+from .errors import ApplicationError
+from .export import process_pool
+from .utilities import utilities
+
+
+log = logging.getLogger(__name__)
+
+
+# Where a user's Books library is kept relative to their home directory.
+CONTAINER = pathlib.PurePath("Library/Containers/com.apple.iBooksX/Data/Documents")
+
+# Matches runs of characters that aren't safe to use in a directory name.
+RE_UNSAFE = re.compile(r"[^\w.-]+")
+
+
+def parse_library(value: str) -> tuple:
+    """ Parse a library given as NAME=ROOT or ROOT into its name and root.
+    Without a name it's named after its root e.g. /Users/alice with Books'
+    container directories left out becomes Users-alice. """
+
+    name, separator, root = value.partition("=")
+
+    if not separator:
+        name, root = "", value
+
+    root = pathlib.Path(root).expanduser()
+
+    if not name:
+
+        parts = root.resolve().parts
+
+        if parts[-len(CONTAINER.parts) :] == CONTAINER.parts:
+            parts = parts[: -len(CONTAINER.parts)]
+
+        name = "-".join(parts[1:])
+
+    name = RE_UNSAFE.sub("-", name).strip("-.")
+
+    if not name:
+        raise ApplicationError(f"Couldn't name library @ {root}.")
+
+    return name, root
+
+
+def parse_libraries(values: list) -> dict:
+    """ Parse libraries given as NAME=ROOT or ROOT, see parse_library, into a
+    dict mapping their names to their roots. Raises an ApplicationError when
+    more than one library ends up with the same name. """
+
+    libraries = [parse_library(value) for value in values]
+
+    names = [name for name, _ in libraries]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+
+    if duplicates:
+        raise ApplicationError(
+            f"More than one library named {', '.join(duplicates)}. "
+            "Name them with NAME=ROOT."
+        )
+
+    return dict(libraries)
+
+
+class BatchExport:
+    """ Export several Books libraries at once e.g. those of every user
+    account or archived containers copied from other machines. libraries maps
+    the name of each library to its root, the directory holding its BKLibrary
+    and AEAnnotation databases.
+
+    Each library is exported by its own AppleBooks to its own directories, see
+    AppleBooksPaths.for_library. Up to jobs libraries are exported at a time
+    by a pool of threads so their databases are snapshot and queried
+    concurrently. Annotations are processed in a single pool of worker
+    processes shared by all libraries, with as many workers as config
+    allows, which bounds the parallelism of the batch as a whole. A library
+    that fails doesn't stop the others.
+
+    The summary of a batch, with the timings of every library and stage, is
+    saved to summary.json in the libraries' day directory. """
+
+    def __init__(self, libraries: dict, jobs: int = None, filters: dict = None):
+
+        self.libraries = libraries
+        self.jobs = jobs or min(len(libraries), 4)
+        self.filters = filters
+
+        self.exports = {}
+        self.summary = None
+        self.libraries_dir = None
+
+    def run(self) -> dict:
+        """ Export every library and return the summary. """
+
+        config.reload()
+
+        workers = config.workers or os.cpu_count()
+
+        log.info(
+            f"Exporting {len(self.libraries)} libraries with {self.jobs} jobs "
+            f"and {workers} workers..."
+        )
+
+        date = datetime.utcnow().isoformat()
+        start = time.perf_counter()
+
+        # Kept for the whole batch even if it runs past midnight.
+        self.libraries_dir = AppleBooksDefaults.libraries_dir
+
+        with process_pool(workers) as executor:
+
+            # Each AppleBooks checks whether Books is running as it's created
+            # so they're all created up front.
+            self.exports = {
+                name: AppleBooks(
+                    paths=AppleBooksPaths.for_library(name=name, src_root_dir=root),
+                    filters=self.filters,
+                    executor=executor,
+                )
+                for name, root in self.libraries.items()
+            }
+
+            with ThreadPoolExecutor(max_workers=self.jobs) as threads:
+                results = dict(
+                    zip(self.exports, threads.map(self._export, self.exports))
+                )
+
+        self.summary = {
+            "date": date,
+            "jobs": self.jobs,
+            "workers": workers,
+            "wall_time": time.perf_counter() - start,
+            "failed": [name for name, result in results.items() if "error" in result],
+            "libraries": results,
+        }
+
+        self._save_summary(self.libraries_dir / "summary.json")
+
+        return self.summary
+
+    def _export(self, name: str) -> dict:
+        """ Export a single library. Runs in a thread. """
+
+        applebooks = self.exports[name]
+
+        log.info(f"Exporting library {name} from {applebooks.paths.src_root_dir}...")
+
+        result = {
+            "src_root_dir": str(applebooks.paths.src_root_dir),
+            "local_root_dir": str(applebooks.paths.local_root_dir),
+        }
+
+        start = time.perf_counter()
+
+        try:
+            applebooks.run()
+        except ApplicationError as error:
+            log.error(f"Export of library {name} failed. {repr(error)}")
+            result["error"] = repr(error)
+        else:
+            result["count_sources"] = applebooks.export.count_sources
+            result["count_annotations"] = applebooks.export.count_annotations
+
+        result["wall_time"] = time.perf_counter() - start
+        result["stages"] = {
+            stage: stats["wall_time"]
+            for stage, stats in applebooks.stats.serialize().items()
+        }
+
+        return result
+
+    def _save_summary(self, path: pathlib.Path) -> None:
+
+        log.info(f"Saving batch summary to {path}...")
+
+        utilities.make_dir(path=path.parent)
+
+        with open(path, "w") as f:
+            json.dump(self.summary, f, indent=4)
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import uuid
+
+from .errors import ApplicationError
+
+
+log = logging.getLogger(__name__)
+
+
+# Compact encoder used to hash annotations. Serialized annotations always have
+# their keys in the same order so they aren't sorted.
+ENCODER = json.JSONEncoder(
+    ensure_ascii=False, check_circular=False, separators=(",", ":")
+)
+
+
+class ChangeSet:
+    """ Annotations added, modified and deleted since the last successful
+    export. Every serialized annotation is hashed as it's exported and
+    compared with the hash it had in the previous export.
+
+    The previous hashes are read from a sidecar saved by commit so the
+    previous export is never parsed. The sidecar has the shape {"annotations":
+    {<annotation_id>: <hash>}, "files": {<name>: {"path": <path>, "hash":
+    <hash>}}, "token": <token>} where files are the outputs of the export along
+    with the hash of their contents, see JSONWriter, and token identifies the
+    export, see AnnotationDatabase.
+
+    The changes are saved as {"added": [<change>], "modified": [<change>],
+    "deleted": [<change>], "metadata": {...}} where each change is {"id":
+    <annotation_id>, "hash": <hash>} and modified changes also hold their
+    "previous_hash". Deleted changes hold the hash the annotation had. """
+
+    def __init__(self, path: pathlib.Path):
+
+        self.path = path
+
+        # Identifies this export once it's committed. See AnnotationDatabase.
+        self.token = uuid.uuid4().hex
+
+        self.added = []
+        self.modified = []
+
+        self._previous = None
+        self._hashes = {}
+        self._files = {}
+
+    @property
+    def previous_files(self) -> dict:
+        """ Outputs of the previous export keyed by their name. """
+        return self._load()["files"]
+
+    @property
+    def previous_token(self) -> str:
+        """ Token of the previous export. None when it didn't save one. """
+        return self._load().get("token")
+
+    @property
+    def deleted(self) -> list:
+
+        return [
+            {"id": id_, "hash": digest}
+            for id_, digest in self._load()["annotations"].items()
+            if id_ not in self._hashes
+        ]
+
+    def add(self, annotation: dict, digest: str = None) -> bool:
+        """ Hash a serialized Annotation and compare it with the previous
+        export. digest is its hash when that's already known. Returns whether
+        it was added or modified. """
+
+        id_ = annotation["id"]
+        digest = digest or self.hash(annotation)
+
+        self._hashes[id_] = digest
+
+        previous = self._load()["annotations"].get(id_)
+
+        if previous is None:
+            self.added.append({"id": id_, "hash": digest})
+        elif previous != digest:
+            self.modified.append({"id": id_, "hash": digest, "previous_hash": previous})
+        else:
+            return False
+
+        return True
+
+    def add_file(self, name: str, path: pathlib.Path, digest: str) -> None:
+        """ Record an output of the export along with the hash of its
+        contents. """
+
+        self._files[name] = {"path": str(path), "hash": digest}
+
+    def serialize(self) -> dict:
+
+        return {
+            "added": self.added,
+            "modified": self.modified,
+            "deleted": self.deleted,
+        }
+
+    def save(self, path: pathlib.Path, metadata: dict) -> int:
+        """ Save the changes along with metadata to path. Returns the number of
+        bytes written. """
+
+        data = self.serialize()
+
+        log.info(
+            f"Saving {len(data['added'])} added, {len(data['modified'])} modified "
+            f"and {len(data['deleted'])} deleted annotations to {path}..."
+        )
+
+        self._dump({**data, "metadata": metadata}, path, indent=4)
+
+        return path.stat().st_size
+
+    def commit(self) -> None:
+        """ Save the hashes of this export to the sidecar so the next export is
+        compared with it. Only called once the export succeeded. """
+
+        data = {"annotations": self._hashes, "files": self._files, "token": self.token}
+
+        self._dump(data, self.path)
+
+        self._previous = data
+
+    @staticmethod
+    def hash(annotation: dict) -> str:
+        """ Hash of a serialized Annotation independent of the format it's
+        written in. """
+
+        data = ENCODER.encode(annotation).encode("utf-8")
+
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def _load(self) -> dict:
+
+        if self._previous is not None:
+            return self._previous
+
+        try:
+            with open(self.path, "r") as f:
+                self._previous = json.load(f)
+        except FileNotFoundError:
+            self._previous = {"annotations": {}, "files": {}}
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        return self._previous
+
+    @staticmethod
+    def _dump(data: dict, path: pathlib.Path, indent: int = None) -> None:
+
+        path_tmp = path.with_name(f"{path.name}.tmp")
+
+        try:
+            with open(path_tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=indent, ensure_ascii=False)
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        os.replace(path_tmp, path)
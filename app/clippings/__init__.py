@@ -0,0 +1,231 @@
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+from collections import defaultdict
+from concurrent.futures import Executor
+from typing import Iterator
+
+from ..applebooks.models import Source
+from ..origins import Origin
+from ..utilities import utilities
+from .defaults import ClippingsDefaults, ClippingsPaths
+from .errors import ClippingsError
+from .models import ClippingsAnnotation, parse_clippings
+
+
+log = logging.getLogger(__name__)
+
+
+class Clippings(Origin):
+    """ Export the highlights and notes of a Kindle's My Clippings.txt. The
+    Kindle appends every highlight, note and bookmark made on it to the file.
+
+    Each highlight is exported as an Annotation of its book. A note is
+    exported with the highlight it was made on, the one ending where the
+    note is, or on its own when there's none. Bookmarks are skipped. Books
+    are identified by their title and author. Filters only apply to Books
+    libraries. """
+
+    name = ClippingsDefaults.name
+
+    def __init__(self, paths: ClippingsPaths = None):
+
+        self.paths = paths or ClippingsPaths()
+
+        self._clippings = []
+
+    @classmethod
+    def from_config(
+        cls, settings: dict, filters: dict = None, executor: Executor = None
+    ) -> "Clippings":
+        """ settings may set the path of the clippings file. """
+
+        path = settings.get("path")
+
+        if path is None:
+            return cls()
+
+        return cls(paths=ClippingsPaths(src_file=pathlib.Path(path).expanduser()))
+
+    def snapshot(self):
+        """ Copy the clippings file to local_file unless it's unchanged since
+        the previous snapshot. """
+
+        src_file = self.paths.src_file
+        local_file = self.paths.local_file
+
+        try:
+            stat = src_file.stat()
+        except FileNotFoundError:
+            raise ClippingsError(f"Couldn't find clippings file @ {src_file}.")
+
+        try:
+            local_stat = local_file.stat()
+        except FileNotFoundError:
+            local_stat = None
+
+        if local_stat is not None and (stat.st_size, stat.st_mtime_ns) == (
+            local_stat.st_size,
+            local_stat.st_mtime_ns,
+        ):
+            log.info(f"Clippings file unchanged. Skipping snapshot of {src_file}.")
+            return
+
+        log.info(f"Copying clippings file {src_file} to {local_file}...")
+
+        utilities.make_dir(path=self.paths.state_dir)
+
+        local_file_tmp = local_file.with_name(f"{local_file.name}.tmp")
+
+        try:
+            shutil.copy2(src_file, local_file_tmp)
+        except Exception as error:
+            raise ClippingsError(f"Unexpected Error: {repr(error)}")
+
+        os.replace(local_file_tmp, local_file)
+
+    def query(self):
+
+        try:
+            with open(self.paths.local_file, "r", encoding="utf-8-sig") as f:
+                self._clippings = parse_clippings(f.read())
+        except Exception as error:
+            raise ClippingsError(f"Unexpected Error: {repr(error)}")
+
+    def process(self) -> Iterator[tuple]:
+        """ Yield each book with highlights or notes, ordered by title, along
+        with its Annotations in the order they were clipped. """
+
+        log.info("Processing clippings.")
+
+        clippings_by_book = defaultdict(list)
+
+        for clipping in self._clippings:
+            if clipping.kind in ("highlight", "note"):
+                clippings_by_book[(clipping.title, clipping.author)].append(clipping)
+
+        sources = []
+
+        for (title, author), clippings in clippings_by_book.items():
+            source_id = self._hash("source", title, author or "")
+            sources.append((title, source_id, author, clippings))
+
+        for title, source_id, author, clippings in sorted(sources):
+
+            source = Source((source_id, title, author, None))
+            annotations = self._process_book(source, clippings)
+
+            for annotation in annotations:
+                source.add_annotation(annotation)
+
+            yield source, annotations
+
+    def _process_book(self, source: Source, clippings: list) -> list:
+
+        highlights = {}
+        notes = defaultdict(list)
+
+        for clipping in clippings:
+
+            position = clipping.location or clipping.page
+
+            if clipping.kind == "note":
+                notes[position[0] if position else None].append(clipping)
+                continue
+
+            key = self._hash(
+                "highlight", source.id, repr(position), clipping.content
+            )
+
+            # The same highlight is clipped again when it's edited.
+            highlights[key] = (clipping, position)
+
+        annotations = []
+        ends = {}
+
+        for key, (clipping, position) in highlights.items():
+            if position is not None:
+                ends[position[1]] = key
+
+        attached = defaultdict(list)
+        loose = []
+
+        for start, _notes in notes.items():
+
+            if start in ends:
+                attached[ends[start]].extend(_notes)
+            else:
+                loose.extend(_notes)
+
+        for key, (clipping, position) in highlights.items():
+
+            _notes = "\n".join(note.content for note in attached[key])
+
+            annotations.append(
+                self._annotation(key, source, clipping, position, notes=_notes)
+            )
+
+        for clipping in loose:
+
+            position = clipping.location or clipping.page
+            key = self._hash("note", source.id, repr(position), clipping.content)
+
+            annotations.append(
+                self._annotation(
+                    key, source, clipping, position, notes=clipping.content, text=""
+                )
+            )
+
+        return annotations
+
+    @staticmethod
+    def _annotation(
+        key: str,
+        source: Source,
+        clipping,
+        position: tuple,
+        notes: str,
+        text: str = None,
+    ) -> ClippingsAnnotation:
+
+        row = (
+            key,
+            source.id,
+            source.name,
+            source.author,
+            clipping.content if text is None else text,
+            notes,
+            None,
+            None,
+            clipping.date,
+            clipping.date,
+            position,
+        )
+
+        return ClippingsAnnotation(row)
+
+    @staticmethod
+    def _hash(*values: str) -> str:
+        """ Stable id derived from values. """
+
+        data = "\x1f".join(values).encode("utf-8")
+
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    @property
+    def metadata(self) -> dict:
+
+        metadata = {
+            "src_file": str(self.paths.src_file),
+            "count_clippings": len(self._clippings),
+        }
+
+        return metadata
+
+    @property
+    def snapshot_files(self) -> dict:
+        """ The clippings file as it was snapshot. """
+
+        return {pathlib.Path(self.paths.local_file.name): self.paths.local_file}
@@ -0,0 +1,57 @@
+import os
+import pathlib
+
+from ..defaults import AppDefaults, ExportPaths, classproperty
+
+
+class ClippingsDefaults:
+
+    name = "clippings"
+
+    # clippings data
+    src_file = pathlib.Path(
+        os.environ.get(
+            "HLTS_CLIPPINGS_FILE", AppDefaults.home / "Documents/My Clippings.txt"
+        )
+    )
+
+    # local data
+    @classproperty
+    def local_root_dir(cls) -> pathlib.Path:
+        return AppDefaults.day_dir / "clippings"
+
+    # persistent data
+    state_dir = AppDefaults.root_dir / "clippings"
+
+    # misc
+    separator = "=========="
+    date_formats = (
+        "%A, %B %d, %Y %I:%M:%S %p",
+        "%A, %d %B %Y %H:%M:%S",
+    )
+
+
+class ClippingsPaths(ExportPaths):
+    """ All paths used by a clippings file. The file is snapshot to state_dir
+    before it's read. Each defaults to its ClippingsDefaults counterpart. See
+    ExportPaths for the paths of the export itself. """
+
+    def __init__(
+        self,
+        src_file: pathlib.Path = None,
+        local_root_dir: pathlib.Path = None,
+        state_dir: pathlib.Path = None,
+        database_file: pathlib.Path = None,
+    ):
+
+        super().__init__(
+            local_root_dir=local_root_dir or ClippingsDefaults.local_root_dir,
+            state_dir=state_dir or ClippingsDefaults.state_dir,
+            database_file=database_file,
+        )
+
+        # clippings data
+        self.src_file = src_file or ClippingsDefaults.src_file
+
+        # persistent data
+        self.local_file = self.state_dir / "clippings.txt"
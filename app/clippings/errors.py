@@ -0,0 +1,6 @@
+from ..errors import ApplicationError
+
+
+class ClippingsError(ApplicationError):
+    def __init__(self, message):
+        super().__init__(message)
@@ -0,0 +1,153 @@
+import logging
+import re
+from collections import namedtuple
+from datetime import datetime
+from typing import Optional
+
+from ..applebooks.epubcfi import format_location
+from ..applebooks.models import (
+    DATE_CREATED,
+    DATE_MODIFIED,
+    LOCATION,
+    STYLE,
+    Annotation,
+)
+from .defaults import ClippingsDefaults
+
+
+log = logging.getLogger(__name__)
+
+
+# A single highlight, note or bookmark of a clippings file. location and page
+# are (start, end) tuples of integers or None when the clipping has neither.
+Clipping = namedtuple(
+    "Clipping", ["title", "author", "kind", "location", "page", "date", "content"]
+)
+
+# Title (Author) with the author in the last pair of parentheses.
+RE_TITLE = re.compile(r"(?P<title>.*?)\s*\((?P<author>[^()]*)\)\s*")
+
+# - Your Highlight on page 12 | Location 180-182 | Added on Sunday, ...
+RE_KIND = re.compile(r"-\s*Your\s+(?P<kind>\w+)", re.IGNORECASE)
+RE_POSITION = re.compile(
+    r"\b(?P<unit>page|location)\s+(?P<start>\d+)(?:-(?P<end>\d+))?", re.IGNORECASE
+)
+RE_DATE = re.compile(r"Added on\s+(?P<date>.+)", re.IGNORECASE)
+
+
+def parse_clippings(text: str) -> list:
+    """ Parse the text of a Kindle's My Clippings.txt into Clippings in the
+    order they appear. Each entry is made up of the title and author of its
+    book, a line describing what kind of clipping it is, where it is and when
+    it was added, an empty line and its content. Entries are separated by a
+    line of equals signs. Entries that can't be parsed are skipped. """
+
+    clippings = []
+
+    for entry in text.split(ClippingsDefaults.separator):
+
+        lines = entry.strip("\ufeff\r\n").splitlines()
+
+        if not lines:
+            continue
+
+        clipping = _parse_entry(lines)
+
+        if clipping is None:
+            log.warning(f"Couldn't parse clipping {entry.strip()[:50]}...")
+            continue
+
+        clippings.append(clipping)
+
+    return clippings
+
+
+def _parse_entry(lines: list) -> Optional[Clipping]:
+
+    if len(lines) < 2:
+        return None
+
+    heading = lines[0].strip("\ufeff ")
+    match = RE_KIND.match(lines[1].strip())
+
+    if not heading or match is None:
+        return None
+
+    title, author = heading, None
+    title_match = RE_TITLE.fullmatch(heading)
+
+    if title_match is not None:
+        title, author = title_match.group("title", "author")
+
+    positions = {}
+    date = None
+
+    for part in lines[1].split("|"):
+
+        for position in RE_POSITION.finditer(part):
+
+            start = int(position.group("start"))
+            end = int(position.group("end") or start)
+
+            positions[position.group("unit").lower()] = (start, end)
+
+        date_match = RE_DATE.search(part)
+
+        if date_match is not None:
+            date = _parse_date(date_match.group("date").strip())
+
+    return Clipping(
+        title=title,
+        author=author,
+        kind=match.group("kind").lower(),
+        location=positions.get("location"),
+        page=positions.get("page"),
+        date=date,
+        content="\n".join(lines[2:]).strip(),
+    )
+
+
+def _parse_date(date: str) -> Optional[str]:
+    """ Converts the date a clipping was added to ISO8601. Dates are in the
+    Kindle's local time. """
+
+    for date_format in ClippingsDefaults.date_formats:
+        try:
+            return datetime.strptime(date, date_format).isoformat()
+        except ValueError:
+            continue
+
+    log.warning(f"Couldn't parse clipping date {date}.")
+
+    return None
+
+
+class ClippingsAnnotation(Annotation):
+    """ Annotation created from a highlight of a clippings file along with any
+    note made on it. Its row holds dates already converted to ISO8601 and its
+    location as a (start, end) tuple. Notes are tokenized like those of
+    Books. """
+
+    __slots__ = ()
+
+    origin = ClippingsDefaults.name
+
+    def _process_dates(self, row: tuple):
+
+        self.date_created = row[DATE_CREATED]
+        self.date_modified = row[DATE_MODIFIED]
+
+    def _process_style(self, row: tuple):
+
+        self.style = row[STYLE]
+
+    def _process_location(self, row: tuple):
+
+        location = row[LOCATION]
+        key = None
+
+        if location is not None:
+            key = tuple((i,) for i in location)
+
+        self.location = format_location(key)
+        self.location_key = key or ()
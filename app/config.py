@@ -3,18 +3,69 @@ import logging
 
 from .defaults import AppDefaults
 from .errors import ApplicationError
+from .utilities import utilities
 
 
 log = logging.getLogger(__name__)
 
 
 class Config:
+    """ Settings read from config.json. Importing the module doesn't touch the
+    file. It's only read once a setting is first used and read again by reload
+    when it's been modified since. Settings assigned directly are kept until
+    then. """
+
     def __init__(self):
 
+        self._loaded = False
+        self._mtime = None
+
+    def __getattr__(self, name):
+        """ Only called for settings that haven't been read yet. """
+
+        if name.startswith("_") or self._loaded:
+            raise AttributeError(name)
+
+        self._load()
+
+        return getattr(self, name)
+
+    def __setattr__(self, name, value):
+
+        if not name.startswith("_") and not self._loaded:
+            self._load()
+
+        super().__setattr__(name, value)
+
+    def reload(self) -> bool:
+        """ Read config.json again if it was modified since it was last read.
+        Returns whether it was. """
+
+        if self._loaded and self._stat() == self._mtime:
+            return False
+
+        if self._loaded:
+            log.info(f"Reloading {AppDefaults.config_file}...")
+
         self._load()
 
+        return True
+
     def _load(self):
 
+        # Set first so the settings below are assigned without loading again.
+        self._loaded = True
+
+        try:
+            self._read()
+        except BaseException:
+            self._loaded = False
+            raise
+
+        self._mtime = self._stat()
+
+    def _read(self):
+
         try:
             with open(AppDefaults.config_file, "r") as f:
                 data = json.load(f)
@@ -22,6 +73,20 @@ class Config:
                     self.tag_prefix = data["tag_prefix"]
                     self.collection_prefix = data["collection_prefix"]
                     self.starred_collection = data["starred_collection"]
+                    # Optional settings fall back to their defaults so that
+                    # config files written by older versions stay valid.
+                    self.incremental = data.get("incremental", False)
+                    self.annotations_format = data.get("annotations_format", "json")
+                    self.sources_format = data.get("sources_format", "json")
+                    self.workers = data.get("workers", 1)
+                    self.chunk_size = data.get("chunk_size", 5000)
+                    self.store = data.get("store", False)
+                    self.store_compression = data.get("store_compression", "none")
+                    self.pushdown = data.get("pushdown", False)
+                    self.filters = data.get("filters", {})
+                    self.cache_size = data.get("cache_size", 0)
+                    self.shards = data.get("shards", False)
+                    self.origins = data.get("origins", {"applebooks": {}})
                 except KeyError as error:
                     self._load_error(error)
                     self._set_defaults()
@@ -53,20 +118,55 @@ class Config:
         self.tag_prefix = "#"
         self.collection_prefix = "@"
         self.starred_collection = "star"
+        self.incremental = False
+        self.annotations_format = "json"
+        self.sources_format = "json"
+        self.workers = 1
+        self.chunk_size = 5000
+        self.store = False
+        self.store_compression = "none"
+        self.pushdown = False
+        self.filters = {}
+        self.cache_size = 0
+        self.shards = False
+        self.origins = {"applebooks": {}}
 
     def _save(self):
 
         log.info(f"Saving {AppDefaults.config_file}...")
 
+        # config.json is written before the app has created root_dir when it's
+        # first run.
+        utilities.make_dir(path=AppDefaults.root_dir)
+
         with open(AppDefaults.config_file, "w") as f:
             json.dump(self._serialize(), f, indent=4)
 
+    def _stat(self):
+
+        try:
+            return AppDefaults.config_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
     def _serialize(self):
 
         config = {
             "tag_prefix": self.tag_prefix,
             "collection_prefix": self.collection_prefix,
             "starred_collection": self.starred_collection,
+            "incremental": self.incremental,
+            "annotations_format": self.annotations_format,
+            "sources_format": self.sources_format,
+            "workers": self.workers,
+            "chunk_size": self.chunk_size,
+            "store": self.store,
+            "store_compression": self.store_compression,
+            "pushdown": self.pushdown,
+            "filters": self.filters,
+            "cache_size": self.cache_size,
+            "shards": self.shards,
+            "origins": self.origins,
         }
 
         return config
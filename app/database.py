@@ -0,0 +1,320 @@
+import logging
+import pathlib
+import sqlite3
+
+from .defaults import AppDefaults
+from .errors import ApplicationError
+
+
+log = logging.getLogger(__name__)
+
+
+class AnnotationDatabase:
+    """ Persistent SQLite store of processed annotations with an FTS5 index
+    over their text and notes. The store is updated by every export inside a
+    single transaction so readers always see a complete export. Annotations
+    are written in batches with executemany.
+
+    Each export is identified by a token saved along with the store. When the
+    store was last written by the previous export, the one identified by
+    previous, only the annotations that changed since are written and
+    deleted. Otherwise the store is rebuilt from every annotation written. """
+
+    batch_size = 1000
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS annotations (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            origin TEXT,
+            source_id TEXT,
+            source_name TEXT,
+            source_author TEXT,
+            text TEXT,
+            notes TEXT,
+            date_created TEXT,
+            date_modified TEXT,
+            style TEXT,
+            epubcfi TEXT,
+            location TEXT,
+            is_starred INTEGER
+        );
+
+        CREATE INDEX IF NOT EXISTS annotations_source_id
+            ON annotations (source_id);
+        CREATE INDEX IF NOT EXISTS annotations_date_created
+            ON annotations (date_created);
+        CREATE INDEX IF NOT EXISTS annotations_style
+            ON annotations (style);
+
+        CREATE TABLE IF NOT EXISTS tags (
+            annotation_id TEXT NOT NULL,
+            tag TEXT NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag, annotation_id);
+        CREATE INDEX IF NOT EXISTS tags_annotation_id ON tags (annotation_id);
+
+        CREATE TABLE IF NOT EXISTS collections (
+            annotation_id TEXT NOT NULL,
+            collection TEXT NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS collections_collection
+            ON collections (collection, annotation_id);
+        CREATE INDEX IF NOT EXISTS collections_annotation_id
+            ON collections (annotation_id);
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS annotations_fts USING fts5(
+            text,
+            notes,
+            content='annotations',
+            content_rowid='rowid'
+        );
+
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(
+        self, path: pathlib.Path = None, token: str = None, previous: str = None
+    ):
+
+        self.path = path or AppDefaults.database_file
+        self.token = token
+        self.previous = previous
+
+        # Whether the store is being rebuilt rather than updated. See open.
+        self.is_rebuilt = True
+
+        self._connection = None
+        self._annotations = []
+        self._tags = []
+        self._collections = []
+
+    def __enter__(self):
+
+        self.open()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self) -> None:
+        """ Start updating the store or rebuilding it when it wasn't last
+        written by the previous export. Previously stored annotations stay
+        visible to readers until close. """
+
+        self._connection = self._connect()
+
+        self._connection.execute("BEGIN")
+
+        (token,) = self._connection.execute(
+            "SELECT value FROM meta WHERE key = 'token';"
+        ).fetchone() or (None,)
+
+        self.is_rebuilt = self.previous is None or token != self.previous
+
+        if not self.is_rebuilt:
+            log.info(f"Updating annotations in {self.path}...")
+            return
+
+        self._connection.execute("DELETE FROM annotations")
+        self._connection.execute("DELETE FROM tags")
+        self._connection.execute("DELETE FROM collections")
+        self._connection.execute(
+            "INSERT INTO annotations_fts(annotations_fts) VALUES('delete-all')"
+        )
+
+    def write(self, annotation: dict, is_changed: bool = True) -> None:
+        """ Queue a serialized Annotation to be written. Annotations that
+        didn't change since the previous export are only written when the
+        store is rebuilt. """
+
+        if not (is_changed or self.is_rebuilt):
+            return
+
+        metadata = annotation["metadata"]
+        source = annotation["source"]
+
+        self._annotations.append(
+            (
+                annotation["id"],
+                metadata["origin"],
+                source["id"],
+                source["name"],
+                source["author"],
+                "\n".join(annotation["text"]),
+                annotation["notes"],
+                metadata["date_created"],
+                metadata["date_modified"],
+                metadata["style"],
+                metadata["epubcfi"],
+                metadata["location"],
+                metadata["is_starred"],
+            )
+        )
+        self._tags.extend((annotation["id"], tag) for tag in annotation["tags"])
+        self._collections.extend(
+            (annotation["id"], collection) for collection in annotation["collections"]
+        )
+
+        if len(self._annotations) >= self.batch_size:
+            self._flush()
+
+    def delete(self, ids: list) -> None:
+        """ Delete the annotations with ids, those deleted since the previous
+        export. Nothing's left to delete when the store is rebuilt. """
+
+        if self.is_rebuilt:
+            return
+
+        self._flush()
+        self._delete(ids)
+
+    def close(self) -> None:
+
+        self._flush()
+
+        if self.is_rebuilt:
+            log.info(f"Indexing annotations in {self.path}...")
+
+            # Rebuild the full-text index from the annotations table in one
+            # pass rather than updating it row by row.
+            self._connection.execute(
+                "INSERT INTO annotations_fts(annotations_fts) VALUES('rebuild')"
+            )
+
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('token', ?);",
+            (self.token,),
+        )
+        self._connection.execute("COMMIT")
+        self._connection.close()
+
+    def abort(self) -> None:
+
+        self._connection.execute("ROLLBACK")
+        self._connection.close()
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """ Full-text search annotation text and notes. Results are ranked by
+        bm25 with the best match first. """
+
+        connection = self._connect()
+
+        try:
+            cursor = connection.execute(
+                """
+                SELECT
+                    annotations.id,
+                    annotations.source_name,
+                    annotations.source_author,
+                    annotations.text,
+                    annotations.notes,
+                    annotations.date_created,
+                    bm25(annotations_fts) as rank
+
+                FROM annotations_fts
+                JOIN annotations ON annotations.rowid = annotations_fts.rowid
+
+                WHERE annotations_fts MATCH ?
+
+                ORDER BY rank
+                LIMIT ?;
+                """,
+                (query, limit),
+            )
+            data = [dict(row) for row in cursor]
+        except sqlite3.OperationalError as error:
+            raise ApplicationError(f"Invalid search '{query}': {error}")
+        finally:
+            connection.close()
+
+        return data
+
+    def _flush(self) -> None:
+
+        ids = [(annotation[0],) for annotation in self._annotations]
+
+        if not self.is_rebuilt:
+            # Annotations that changed replace the ones previously stored.
+            self._delete([id_ for (id_,) in ids])
+
+        self._connection.executemany(
+            """
+            INSERT INTO annotations (
+                id, origin, source_id, source_name, source_author, text, notes,
+                date_created, date_modified, style, epubcfi, location, is_starred
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """,
+            self._annotations,
+        )
+        self._connection.executemany(
+            "INSERT INTO tags (annotation_id, tag) VALUES (?, ?);", self._tags
+        )
+        self._connection.executemany(
+            "INSERT INTO collections (annotation_id, collection) VALUES (?, ?);",
+            self._collections,
+        )
+
+        if not self.is_rebuilt:
+            self._connection.executemany(
+                """
+                INSERT INTO annotations_fts (rowid, text, notes)
+                SELECT rowid, text, notes FROM annotations WHERE id = ?;
+                """,
+                ids,
+            )
+
+        self._annotations = []
+        self._tags = []
+        self._collections = []
+
+    def _delete(self, ids: list) -> None:
+        """ Delete the annotations with ids along with their entries in the
+        full-text index, tags and collections. """
+
+        parameters = [(id_,) for id_ in ids]
+
+        # Entries of an external content index are deleted with the values
+        # they were indexed with.
+        self._connection.executemany(
+            """
+            INSERT INTO annotations_fts (annotations_fts, rowid, text, notes)
+            SELECT 'delete', rowid, text, notes FROM annotations WHERE id = ?;
+            """,
+            parameters,
+        )
+        self._connection.executemany(
+            "DELETE FROM annotations WHERE id = ?;", parameters
+        )
+        self._connection.executemany(
+            "DELETE FROM tags WHERE annotation_id = ?;", parameters
+        )
+        self._connection.executemany(
+            "DELETE FROM collections WHERE annotation_id = ?;", parameters
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+
+        try:
+            # Transactions are managed explicitly.
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(self.schema)
+        except sqlite3.Error as error:
+            raise ApplicationError(f"SQLite Error: {repr(error)}")
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        return connection
@@ -1,15 +1,78 @@
+import os
 from datetime import datetime
 from pathlib import Path
 
 
+class classproperty:
+    """ Class attribute computed every time it's read. """
+
+    def __init__(self, fget):
+        self.fget = fget
+
+    def __get__(self, instance, owner):
+        return self.fget(owner)
+
+
 class AppDefaults:
 
     home = Path.home()
-    date = datetime.now().strftime("%Y-%m-%d")
 
     name = "hlts-data"
 
-    root_dir = home / ".hlts-data"
+    root_dir = Path(os.environ.get("HLTS_DATA_ROOT", home / ".hlts-data"))
     config_file = root_dir / "config.json"
+    objects_dir = root_dir / "objects"
+    database_file = root_dir / "hlts.sqlite"
+
+    # The date and so the day directory move on at midnight while the app is
+    # running e.g. when watching.
+    @classproperty
+    def date(cls) -> str:
+        return datetime.now().strftime("%Y-%m-%d")
+
+    @classproperty
+    def day_dir(cls) -> Path:
+        return cls.root_dir / cls.date
+
+    # exports of several origins together
+    @classproperty
+    def export_dir(cls) -> Path:
+        return cls.day_dir / "export"
+
+    export_state_dir = root_dir / "export"
+
+
+class ExportPaths:
+    """ Paths of an export. Its files are written to local_root_dir and the
+    hashes they're compared against by the next export are kept in state_dir.
+    Each defaults to where several origins are exported together. The
+    annotation database defaults to the app's. """
+
+    def __init__(
+        self,
+        local_root_dir: Path = None,
+        state_dir: Path = None,
+        database_file: Path = None,
+    ):
+
+        self.local_root_dir = local_root_dir or AppDefaults.export_dir
+        self.state_dir = state_dir or AppDefaults.export_state_dir
+        self.database_file = database_file or AppDefaults.database_file
+
+        # local data
+        self.sources_json = self.local_root_dir / "sources.json"
+        self.annotations_json = self.local_root_dir / "annotations.json"
+        self.annotations_jsonl = self.local_root_dir / "annotations.jsonl"
+        self.index_json = self.local_root_dir / "index.json"
+        self.changes_json = self.local_root_dir / "changes.json"
+        self.sources_dir = self.local_root_dir / "sources"
+        self.manifest_json = self.local_root_dir / "manifest.json"
+        self.run_stats_json = self.local_root_dir / "run_stats.json"
+
+        # persistent data
+        self.hashes_json = self.state_dir / "hashes.json"
 
-    day_dir = root_dir / date
+    def output_file(self, name: str, suffix: str) -> Path:
+        """ Path of an export written with a format whose extension is
+        suffix. """
+        return self.local_root_dir / f"{name}{suffix}"
@@ -0,0 +1,376 @@
+import contextlib
+import json
+import logging
+import pathlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterable, Iterator
+
+from .changes import ChangeSet
+from .config import config
+from .database import AnnotationDatabase
+from .defaults import ExportPaths
+from .index import FacetIndex
+from .shards import ShardWriter
+from .stats import RunStats
+from .utilities import utilities
+from .writers import get_writer
+
+
+log = logging.getLogger(__name__)
+
+
+def process_pool(workers: int):
+    """ Pool of worker processes shared by exports run from threads. Workers
+    are spawned rather than forked as the threads are already running by the
+    time they're started. """
+
+    if workers <= 1:
+        return contextlib.nullcontext()
+
+    # Imported here as it's only needed with more than one worker.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+class Export:
+    """ Stream Sources and their Annotations to their respective files and the
+    annotation database and save the index of their tags and collections along
+    with the changes since the previous export. Files whose contents are
+    unchanged since the previous export are kept as they were.
+
+    run exports one or more origins together, see Origin. Each origin is
+    snapshot, queried and processed by its own thread so an export takes
+    about as long as its slowest origin rather than all of them put together.
+    Sources are still written in the order the origins are given in so the
+    files don't depend on which origin finishes first.
+
+    Each stage of run is recorded in stats under its name in stages or under
+    its own name when it's not in stages e.g. {"query": "query_database"}. """
+
+    # Number of Sources an origin processes ahead of those being written.
+    # Bounds the memory held by origins waiting for their turn.
+    queue_size = 256
+
+    def __init__(
+        self,
+        paths: ExportPaths = None,
+        stats: RunStats = None,
+        metadata: Callable[[], dict] = None,
+        stages: dict = None,
+    ):
+
+        self.paths = paths or ExportPaths()
+        self.stats = stats or RunStats()
+        self.index = FacetIndex()
+        self.changes = ChangeSet(self.paths.hashes_json)
+
+        self.origins = []
+        self.count_sources = 0
+        self.count_annotations = 0
+
+        # Metadata saved with every file. Defaults to that of the export.
+        self._metadata = metadata or (lambda: self.metadata)
+
+        self.stages = stages or {}
+
+    def run(self, origins: list):
+        """ Export origins together. """
+
+        self.origins = origins
+
+        log.info(f"Exporting {', '.join(o.name for o in origins)}...")
+
+        with self._stage("setup"):
+            self.setup()
+
+        with self._stage("snapshot"):
+            self._map(lambda origin: origin.snapshot(), origins)
+
+        with self._stage("query"):
+            self._map(lambda origin: origin.query(), origins)
+
+        # Origins process their Sources lazily so most of the work of
+        # processing is done while they're being saved.
+        with self._stage("process"):
+            sources = [origin.process() for origin in origins]
+
+        with self._stage("save"):
+            self.save(self._iter_sources(sources))
+
+        self.stats.save(self.paths.run_stats_json)
+
+    def setup(self):
+        """ Create local_root_dir and state_dir and empty local_root_dir. Just
+        incase app is run more than once a day. Outputs of the previous export
+        are kept so they can be reused if they're unchanged. """
+
+        utilities.make_dir(path=self.paths.local_root_dir)
+        utilities.make_dir(path=self.paths.state_dir)
+
+        previous = {
+            pathlib.Path(entry["path"])
+            for entry in self.changes.previous_files.values()
+        }
+
+        for path in self.paths.local_root_dir.iterdir():
+
+            if path in previous:
+                continue
+
+            if path.is_dir():
+                utilities.delete_dir(path=path)
+            else:
+                utilities.delete_file(path=path)
+
+    def save(self, sources: Iterable[tuple]):
+        """ Save each Source in sources along with its Annotations, given as
+        (Source, annotations) pairs, as they're yielded. """
+
+        sources_writer_class = get_writer(config.sources_format, nested=True)
+        annotations_writer_class = get_writer(config.annotations_format)
+
+        sources_file = self.paths.output_file("sources", sources_writer_class.suffix)
+        annotations_file = self.paths.output_file(
+            "annotations", annotations_writer_class.suffix
+        )
+        previous_files = self.changes.previous_files
+
+        log.info(f"Saving sources to {sources_file}...")
+        log.info(f"Saving annotations to {annotations_file}...")
+
+        sources_writer = sources_writer_class(
+            path=sources_file,
+            key="sources",
+            metadata=self._metadata,
+            previous=previous_files.get(sources_file.name),
+        )
+        annotations_writer = annotations_writer_class(
+            path=annotations_file,
+            key="annotations",
+            metadata=self._metadata,
+            previous=previous_files.get(annotations_file.name),
+        )
+
+        shards_writer = None
+
+        if config.shards:
+            log.info(f"Saving sources to {self.paths.sources_dir}...")
+
+            shards_writer = ShardWriter(
+                directory=self.paths.sources_dir,
+                manifest=self.paths.manifest_json,
+                metadata=self._metadata,
+                previous=previous_files.get(self.paths.manifest_json.name),
+            )
+
+        database = AnnotationDatabase(
+            path=self.paths.database_file,
+            token=self.changes.token,
+            previous=self.changes.previous_token,
+        )
+
+        with shards_writer or contextlib.nullcontext():
+
+            with sources_writer, annotations_writer, database:
+
+                for source, annotations in sources:
+
+                    for annotation in annotations:
+
+                        data = annotation.serialize()
+
+                        annotations_writer.write(data, encoded=annotation.encoded)
+                        is_changed = self.changes.add(data, digest=annotation.digest)
+                        database.write(data, is_changed=is_changed)
+                        self.index.add(data)
+
+                        self.count_annotations += 1
+
+                    data = None
+                    encoded = source.encoded
+
+                    if encoded is None and shards_writer is not None:
+                        # A source is encoded once for both its shard and
+                        # sources.json when that's written as JSON too.
+                        data = source.serialize()
+                        encoded = json.dumps(data, indent=4, ensure_ascii=False)
+
+                    if data is None and (
+                        encoded is None or not sources_writer.indented
+                    ):
+                        data = source.serialize()
+
+                    sources_writer.write(data, encoded=encoded)
+
+                    if shards_writer is not None:
+                        shards_writer.write(
+                            source.id, encoded, count=len(source.annotations)
+                        )
+
+                    self.count_sources += 1
+
+                database.delete([change["id"] for change in self.changes.deleted])
+
+        index_bytes_written = self.index.save(
+            self.paths.index_json,
+            metadata=self._metadata(),
+            previous=previous_files.get(self.paths.index_json.name),
+        )
+
+        outputs = {
+            sources_writer.path: sources_writer.hash,
+            annotations_writer.path: annotations_writer.hash,
+            self.paths.index_json: self.index.hash,
+        }
+        bytes_written = (
+            sources_writer.bytes_written
+            + annotations_writer.bytes_written
+            + index_bytes_written
+        )
+
+        if shards_writer is not None:
+            outputs[shards_writer.manifest] = shards_writer.hash
+            outputs[shards_writer.directory] = shards_writer.hash
+            bytes_written += shards_writer.bytes_written
+
+        bytes_written += self._save_changes(outputs=outputs)
+
+        self.stats.record(
+            rows_in=self.count_annotations,
+            rows_out=sources_writer.count + annotations_writer.count,
+            bytes_written=bytes_written,
+        )
+
+    def _save_changes(self, outputs: dict) -> int:
+        """ Save the changes since the previous export and commit outputs, the
+        hashes of the files written keyed by their path, for the next export
+        to compare with. Returns the number of bytes written. """
+
+        previous_files = self.changes.previous_files
+
+        for path, digest in outputs.items():
+            self.changes.add_file(name=path.name, path=path, digest=digest)
+
+        bytes_written = self.changes.save(
+            self.paths.changes_json, metadata=self._metadata()
+        )
+
+        self.changes.commit()
+
+        # Outputs of the previous export that weren't written again were only
+        # kept in case they could be reused.
+        for entry in previous_files.values():
+
+            path = pathlib.Path(entry["path"])
+
+            if path in outputs or path.parent != self.paths.local_root_dir:
+                continue
+
+            if path.is_dir():
+                utilities.delete_dir(path=path)
+            else:
+                utilities.delete_file(path=path)
+
+        return bytes_written
+
+    def _stage(self, name: str):
+        """ Record a stage of run in stats under its name in stages. """
+        return self.stats.stage(self.stages.get(name, name))
+
+    @staticmethod
+    def _map(function: Callable, origins: list) -> None:
+        """ Call function with each origin, each in its own thread. Raises the
+        error of the first origin that fails. """
+
+        if len(origins) == 1:
+            function(origins[0])
+            return
+
+        with ThreadPoolExecutor(max_workers=len(origins)) as threads:
+            list(threads.map(function, origins))
+
+    def _iter_sources(self, sources: list) -> Iterator[tuple]:
+        """ Yield the Sources of every origin along with their Annotations in
+        the order origins are given in. sources holds what each origin's
+        process returned. Every origin is processed by its own thread up to
+        queue_size Sources ahead of those being written. """
+
+        if len(sources) == 1:
+            yield from sources[0]
+            return
+
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in sources]
+
+        with ThreadPoolExecutor(max_workers=len(sources)) as threads:
+
+            for _sources, items in zip(sources, queues):
+                threads.submit(self._produce, _sources, items, stop)
+
+            try:
+                for items in queues:
+                    for item in iter(items.get, None):
+
+                        if isinstance(item, Exception):
+                            raise item
+
+                        yield item
+            finally:
+                # Stops the origins still processing when saving fails.
+                stop.set()
+
+    @staticmethod
+    def _produce(
+        sources: Iterator[tuple], items: queue.Queue, stop: threading.Event
+    ) -> None:
+        """ Put each Source of sources on items followed by None once it's
+        done or by the error it failed with. Runs in a thread until stop is
+        set. """
+
+        def put(item) -> bool:
+
+            while not stop.is_set():
+                try:
+                    items.put(item, timeout=0.1)
+                except queue.Full:
+                    continue
+                return True
+
+            return False
+
+        try:
+            for item in sources:
+                if not put(item):
+                    return
+        except Exception as error:
+            put(error)
+            return
+        finally:
+            # Generators are closed so they clean up straight away when
+            # they're stopped early. Other iterators have nothing to close.
+            close = getattr(sources, "close", None)
+
+            if close is not None:
+                close()
+
+        put(None)
+
+    @property
+    def metadata(self) -> dict:
+
+        metadata = {
+            "date": datetime.utcnow().isoformat(),
+            "count_sources": self.count_sources,
+            "count_annotations": self.count_annotations,
+            "origins": {origin.name: origin.metadata for origin in self.origins},
+            "stats": self.stats.serialize(),
+        }
+
+        return metadata
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+from collections import defaultdict
+
+from .errors import ApplicationError
+from .utilities import utilities
+
+
+log = logging.getLogger(__name__)
+
+
+class FacetIndex:
+    """ Inverted index of tags, collections and starred annotations built from
+    serialized annotations as they're exported. Every lookup is a dict access
+    returning annotation ids in export order, optionally narrowed down to a
+    single source.
+
+    The index is saved as {"tags": {<tag>: <entry>}, "collections":
+    {<collection>: <entry>}, "starred": <entry>, "metadata": {...}} where each
+    entry is {"count": <int>, "sources": {<source_id>: [<annotation_id>]}}. """
+
+    def __init__(self):
+
+        # facet -> value -> [annotation_id]
+        self._ids = {
+            "tags": defaultdict(list),
+            "collections": defaultdict(list),
+        }
+        # facet -> value -> source_id -> [annotation_id]
+        self._sources = {
+            "tags": defaultdict(lambda: defaultdict(list)),
+            "collections": defaultdict(lambda: defaultdict(list)),
+        }
+
+        self._starred_ids = []
+        self._starred_sources = defaultdict(list)
+
+        # Hash of the index's contents set once it's saved.
+        self.hash = None
+
+    def add(self, annotation: dict) -> None:
+        """ Index a serialized Annotation. """
+
+        id_ = annotation["id"]
+        source_id = annotation["source"]["id"]
+
+        for facet in self._ids:
+
+            # A value repeated in an annotation's notes is only indexed once.
+            for value in dict.fromkeys(annotation[facet]):
+                self._ids[facet][value].append(id_)
+                self._sources[facet][value][source_id].append(id_)
+
+        if annotation["metadata"]["is_starred"]:
+            self._starred_ids.append(id_)
+            self._starred_sources[source_id].append(id_)
+
+    def tagged(self, tag: str, source_id: str = None) -> list:
+        """ Ids of annotations tagged with tag. """
+
+        return self._lookup("tags", tag, source_id)
+
+    def in_collection(self, collection: str, source_id: str = None) -> list:
+        """ Ids of annotations in collection. """
+
+        return self._lookup("collections", collection, source_id)
+
+    def starred(self, source_id: str = None) -> list:
+        """ Ids of starred annotations. """
+
+        if source_id is None:
+            return list(self._starred_ids)
+
+        return list(self._starred_sources.get(source_id, []))
+
+    @property
+    def tags(self) -> dict:
+        """ Number of annotations for each tag. """
+
+        return {tag: len(ids) for tag, ids in self._ids["tags"].items()}
+
+    @property
+    def collections(self) -> dict:
+        """ Number of annotations in each collection. """
+
+        return {
+            collection: len(ids)
+            for collection, ids in self._ids["collections"].items()
+        }
+
+    def serialize(self) -> dict:
+
+        data = {
+            facet: {
+                value: self._serialize_entry(self._sources[facet][value])
+                for value in sorted(self._ids[facet])
+            }
+            for facet in self._ids
+        }
+        data["starred"] = self._serialize_entry(self._starred_sources)
+
+        return data
+
+    def save(self, path: pathlib.Path, metadata: dict, previous: dict = None) -> int:
+        """ Save the index along with metadata to path. Returns the number of
+        bytes written.
+
+        When previous, the {"path": ..., "hash": ...} of the index saved by a
+        previous export, has the same hash the previous index is kept, or
+        hardlinked to path, instead of being written again. """
+
+        data = self.serialize()
+
+        self.hash = hashlib.sha256(
+            json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        ).hexdigest()
+
+        previous = previous or {}
+        previous_path = pathlib.Path(previous.get("path", path))
+
+        if previous.get("hash") == self.hash and previous_path.is_file():
+
+            log.info(f"Keeping unchanged {previous_path}.")
+
+            if previous_path != path:
+                utilities.link_file(src=previous_path, dest=path)
+
+            return 0
+
+        log.info(f"Saving index to {path}...")
+
+        data["metadata"] = metadata
+
+        path_tmp = path.with_name(f"{path.name}.tmp")
+
+        try:
+            with open(path_tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        os.replace(path_tmp, path)
+
+        return path.stat().st_size
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "FacetIndex":
+        """ Load an index saved by a previous export. """
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise ApplicationError(f"Couldn't find index @ {path}.")
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        index = cls()
+
+        for facet in index._ids:
+            for value, entry in data[facet].items():
+                for source_id, ids in entry["sources"].items():
+                    index._ids[facet][value].extend(ids)
+                    index._sources[facet][value][source_id].extend(ids)
+
+        for source_id, ids in data["starred"]["sources"].items():
+            index._starred_ids.extend(ids)
+            index._starred_sources[source_id].extend(ids)
+
+        return index
+
+    def _lookup(self, facet: str, value: str, source_id: str = None) -> list:
+
+        if source_id is None:
+            return list(self._ids[facet].get(value, []))
+
+        sources = self._sources[facet].get(value, {})
+
+        return list(sources.get(source_id, []))
+
+    @staticmethod
+    def _serialize_entry(sources: dict) -> dict:
+
+        return {
+            "count": sum(len(ids) for ids in sources.values()),
+            "sources": {source_id: list(ids) for source_id, ids in sources.items()},
+        }
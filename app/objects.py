@@ -0,0 +1,170 @@
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import os
+import pathlib
+import shutil
+import stat
+
+from .defaults import AppDefaults
+from .errors import ApplicationError
+from .utilities import utilities
+
+
+log = logging.getLogger(__name__)
+
+
+class ObjectStore:
+    """ Content-addressed storage for the files of each day directory. Every
+    file is stored once as a blob named after the SHA-256 of its contents so
+    files that don't change between days cost no extra space. A day directory
+    keeps a manifest.json mapping its files to their blobs.
+
+    Uncompressed blobs are hardlinked back into the day directory so its
+    paths keep working. Compressed blobs replace the files in the day
+    directory which can be brought back with restore. """
+
+    compressions = {
+        "none": ("", open),
+        "gzip": (".gz", gzip.open),
+        "lzma": (".xz", lzma.open),
+    }
+
+    manifest_name = "manifest.json"
+
+    def __init__(self, root_dir: pathlib.Path = None, compression: str = "none"):
+
+        if compression not in self.compressions:
+            raise ApplicationError(f"Unknown compression '{compression}'.")
+
+        self.root_dir = root_dir or AppDefaults.objects_dir
+        self.compression = compression
+
+    def commit(self, day_dir: pathlib.Path, files: dict) -> dict:
+        """ Store files, a dict of paths relative to day_dir mapped to the
+        file to store, and write day_dir's manifest. Returns the manifest. """
+
+        manifest = {}
+        bytes_stored = 0
+
+        for name, path in sorted(files.items()):
+
+            digest, is_new = self.put(path)
+
+            if is_new:
+                bytes_stored += self._blob_path(digest).stat().st_size
+
+            manifest[str(name)] = {
+                "hash": digest,
+                "size": path.stat().st_size,
+                "compression": self.compression,
+            }
+
+            self._checkout(digest, day_dir / name, compression=self.compression)
+
+        with open(day_dir / self.manifest_name, "w") as f:
+            json.dump(manifest, f, indent=4)
+
+        log.info(f"Stored {len(manifest)} files adding {bytes_stored} bytes.")
+
+        return manifest
+
+    def put(self, path: pathlib.Path) -> tuple:
+        """ Store path as a blob unless an identical one is already stored.
+        Returns its hash and whether a new blob was written. """
+
+        digest = self._hash(path)
+        blob_path = self._blob_path(digest)
+
+        if blob_path.exists():
+            return digest, False
+
+        utilities.make_dir(path=blob_path.parent)
+
+        blob_path_tmp = blob_path.with_name(f"{blob_path.name}.tmp")
+        _, opener = self.compressions[self.compression]
+
+        try:
+            with open(path, "rb") as src, opener(blob_path_tmp, "wb") as dest:
+                shutil.copyfileobj(src, dest)
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        # Blobs are shared between days so they're made read-only to keep a
+        # hardlinked file from being changed in place.
+        os.chmod(blob_path_tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(blob_path_tmp, blob_path)
+
+        return digest, True
+
+    def restore(self, day_dir: pathlib.Path) -> None:
+        """ Restore every file listed in day_dir's manifest. """
+
+        try:
+            with open(day_dir / self.manifest_name, "r") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            raise ApplicationError(f"Couldn't find manifest @ {day_dir}.")
+
+        for name, entry in manifest.items():
+
+            path = day_dir / name
+
+            if path.exists():
+                continue
+
+            log.info(f"Restoring {path}...")
+
+            self._restore(entry["hash"], path, compression=entry["compression"])
+
+    def _checkout(self, digest: str, path: pathlib.Path, compression: str) -> None:
+        """ Replace path with a hardlink to its blob when it's uncompressed or
+        remove it otherwise. """
+
+        if compression == "none":
+            self._link(self._blob_path(digest, compression), path)
+            return
+
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _restore(self, digest: str, path: pathlib.Path, compression: str) -> None:
+
+        if compression == "none":
+            self._link(self._blob_path(digest, compression), path)
+            return
+
+        utilities.make_dir(path=path.parent)
+
+        _, opener = self.compressions[compression]
+
+        with opener(self._blob_path(digest, compression), "rb") as src:
+            with open(path, "wb") as dest:
+                shutil.copyfileobj(src, dest)
+
+    @staticmethod
+    def _link(blob_path: pathlib.Path, path: pathlib.Path) -> None:
+
+        utilities.make_dir(path=path.parent)
+        utilities.link_file(src=blob_path, dest=path)
+
+    def _blob_path(self, digest: str, compression: str = None) -> pathlib.Path:
+
+        suffix, _ = self.compressions[compression or self.compression]
+
+        return self.root_dir / digest[:2] / f"{digest[2:]}{suffix}"
+
+    @staticmethod
+    def _hash(path: pathlib.Path) -> str:
+
+        digest = hashlib.sha256()
+
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        return digest.hexdigest()
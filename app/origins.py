@@ -0,0 +1,67 @@
+from concurrent.futures import Executor
+from typing import Iterator
+
+from .defaults import ExportPaths
+from .export import Export
+
+
+class Origin:
+    """ Where annotations are exported from e.g. a Books library. An origin is
+    exported in stages:
+
+        snapshot: copy its data so it's read consistently.
+        query: read the snapshot.
+        process: return an iterator of each Source along with its
+            Annotations which processes them as it's iterated over. Sources
+            are yielded in the order they're exported in.
+
+    Export runs the stages of one or more origins and streams the Sources
+    they yield into a single set of files. The Annotations of an origin
+    serialize its name as their origin. """
+
+    name = None
+
+    # Names the stages of its own runs are recorded under, see Export.
+    stages = None
+
+    paths: ExportPaths
+
+    @classmethod
+    def from_config(
+        cls, settings: dict, filters: dict = None, executor: Executor = None
+    ) -> "Origin":
+        """ Create the origin from its settings in config.json's origins.
+        filters are those given on the command line and executor a pool of
+        worker processes it may process annotations in. """
+        raise NotImplementedError
+
+    def run(self, changed: list = None):
+        """ Export the origin on its own to its own paths. changed holds the
+        source directories that changed since the previous run when that's
+        known. Origins may use it to skip reading what hasn't changed. """
+
+        Export(paths=self.paths, stages=self.stages).run(origins=[self])
+
+    def snapshot(self) -> None:
+        pass
+
+    def query(self) -> None:
+        pass
+
+    def process(self) -> Iterator[tuple]:
+        """ Return an iterator of (Source, annotations) pairs. It's iterated
+        over while the export is saved, from a thread of its own when several
+        origins are exported together. Generators are closed once that thread
+        stops, even when it stops early, so they may clean up in finally. """
+        raise NotImplementedError
+
+    @property
+    def metadata(self) -> dict:
+        """ Saved with the metadata of an export of several origins. """
+        return {}
+
+    @property
+    def snapshot_files(self) -> dict:
+        """ Snapshots kept outside of local_root_dir keyed by their path
+        relative to it. They're stored along with the export. """
+        return {}
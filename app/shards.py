@@ -0,0 +1,235 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from .errors import ApplicationError
+from .utilities import utilities
+
+
+log = logging.getLogger(__name__)
+
+
+# Matches ids that are safe to use as file names as they are.
+RE_SAFE_NAME = re.compile(r"^[\w.-]+$")
+
+
+class ShardWriter:
+    """ Write each source along with its annotations to its own file under
+    directory so readers can load only the sources they need. Shards are
+    written by a pool of threads and hold exactly what a source is in
+    sources.json i.e. they have no metadata and only change when the source
+    does.
+
+    A manifest maps each source id to its shard as {"sources": {<source_id>:
+    {"file": <path relative to the manifest>, "count": <annotations>,
+    "bytes": <size>, "hash": <sha256>}}, "metadata": {...}}.
+
+    When previous, the {"path": ..., "hash": ...} of the manifest of a
+    previous export, lists a shard with the same hash the previous shard is
+    kept, or hardlinked, instead of being written again. The manifest itself
+    is treated the same way with hash covering its sources. """
+
+    # Maximum number of shards queued per thread.
+    queue_size = 4
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        manifest: pathlib.Path,
+        metadata: Callable[[], dict],
+        previous: dict = None,
+        workers: int = None,
+    ):
+
+        self.directory = directory
+        self.manifest = manifest
+        self.count = 0
+        self.bytes_written = 0
+        self.hash = None
+
+        self._metadata = metadata
+        self._previous = previous
+        self._workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self._previous_sources = {}
+        self._sources = {}
+        self._executor = None
+        self._pending = deque()
+
+    def __enter__(self):
+
+        self.open()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self) -> None:
+
+        utilities.make_dir(path=self.directory)
+
+        self._previous_sources = self._load_previous()
+        self._executor = ThreadPoolExecutor(max_workers=self._workers)
+
+    def write(self, source_id: str, encoded: str, count: int) -> None:
+        """ Queue a source encoded by json.dumps(..., indent=4,
+        ensure_ascii=False) along with its number of annotations. """
+
+        future = self._executor.submit(self._write, source_id, encoded, count)
+
+        self._pending.append((source_id, future))
+        self.count += 1
+
+        if len(self._pending) >= self._workers * self.queue_size:
+            self._collect()
+
+    def close(self) -> None:
+
+        while self._pending:
+            self._collect()
+
+        self._executor.shutdown()
+
+        # Shards of sources that are gone are only left over from a previous
+        # export in the same directory.
+        files = {
+            self.manifest.parent / entry["file"] for entry in self._sources.values()
+        }
+
+        for path in self.directory.glob("*.json"):
+            if path not in files:
+                utilities.delete_file(path=path)
+
+        self._save_manifest()
+
+    def abort(self) -> None:
+
+        for _, future in self._pending:
+            future.cancel()
+
+        self._executor.shutdown()
+
+    def _collect(self) -> None:
+
+        source_id, future = self._pending.popleft()
+
+        self._sources[source_id], bytes_written = future.result()
+        self.bytes_written += bytes_written
+
+    def _write(self, source_id: str, encoded: str, count: int) -> tuple:
+        """ Write a single shard unless it's unchanged. Runs in a thread.
+        Returns the shard's manifest entry and the number of bytes written. """
+
+        data = encoded.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+
+        path = self.directory / self._name(source_id)
+
+        entry = {
+            "file": str(path.relative_to(self.manifest.parent)),
+            "count": count,
+            "bytes": len(data),
+            "hash": digest,
+        }
+
+        previous = self._previous_sources.get(source_id, {})
+        previous_path = self._previous_dir / previous.get("file", "")
+
+        if previous.get("hash") == digest and previous_path.is_file():
+
+            if previous_path != path:
+                utilities.link_file(src=previous_path, dest=path)
+
+            return entry, 0
+
+        path_tmp = path.with_name(f"{path.name}.tmp")
+
+        try:
+            with open(path_tmp, "wb") as f:
+                f.write(data)
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        os.replace(path_tmp, path)
+
+        return entry, len(data)
+
+    def _save_manifest(self) -> None:
+
+        self.hash = hashlib.sha256(
+            json.dumps(self._sources, separators=(",", ":")).encode("utf-8")
+        ).hexdigest()
+
+        previous = self._previous or {}
+        previous_path = pathlib.Path(previous.get("path", self.manifest))
+
+        if previous.get("hash") == self.hash and previous_path.is_file():
+
+            log.info(f"Keeping unchanged {previous_path}.")
+
+            if previous_path != self.manifest:
+                utilities.link_file(src=previous_path, dest=self.manifest)
+
+            return
+
+        log.info(f"Saving manifest of {self.count} sources to {self.manifest}...")
+
+        data = {"sources": self._sources, "metadata": self._metadata()}
+
+        path_tmp = self.manifest.with_name(f"{self.manifest.name}.tmp")
+
+        try:
+            with open(path_tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        os.replace(path_tmp, self.manifest)
+
+        self.bytes_written += self.manifest.stat().st_size
+
+    def _load_previous(self) -> dict:
+        """ Shards listed by the previous manifest keyed by their source id. """
+
+        if self._previous is None:
+            return {}
+
+        path = pathlib.Path(self._previous["path"])
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        return data["sources"]
+
+    @property
+    def _previous_dir(self) -> pathlib.Path:
+
+        if self._previous is None:
+            return self.manifest.parent
+
+        return pathlib.Path(self._previous["path"]).parent
+
+    @staticmethod
+    def _name(source_id: str) -> str:
+        """ File name of a source's shard. Ids that aren't safe to use as file
+        names are hashed. """
+
+        if RE_SAFE_NAME.match(source_id or ""):
+            return f"{source_id}.json"
+
+        return f"{hashlib.sha256(str(source_id).encode('utf-8')).hexdigest()}.json"
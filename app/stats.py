@@ -0,0 +1,193 @@
+import json
+import logging
+import pathlib
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    """ The resource module is only available on Unix. """
+    resource = None
+
+
+log = logging.getLogger(__name__)
+
+
+class StageStats:
+    """ Measurements for a single stage of a run. Wall and CPU time are
+    measured by RunStats while rows and bytes are recorded by the stage. CPU
+    time only covers the current process. The tracemalloc peak is only
+    measured while tracemalloc is tracing e.g. when run with --profile. """
+
+    __slots__ = (
+        "name",
+        "wall_time",
+        "cpu_time",
+        "rows_in",
+        "rows_out",
+        "bytes_written",
+        "tracemalloc_peak",
+        "max_rss",
+    )
+
+    def __init__(self, name: str):
+
+        self.name = name
+        self.wall_time = None
+        self.cpu_time = None
+        self.rows_in = None
+        self.rows_out = None
+        self.bytes_written = None
+        self.tracemalloc_peak = None
+        self.max_rss = None
+
+    def serialize(self):
+
+        data = {
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "bytes_written": self.bytes_written,
+            "tracemalloc_peak": self.tracemalloc_peak,
+            "max_rss": self.max_rss,
+        }
+
+        return data
+
+
+class Stopwatch:
+    """ Accumulates the wall and CPU time spent between each start and the
+    following stop. """
+
+    __slots__ = ("wall_time", "cpu_time", "_wall_start", "_cpu_start")
+
+    def __init__(self):
+
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+
+        self._wall_start = None
+        self._cpu_start = None
+
+    def start(self) -> None:
+
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def stop(self) -> None:
+
+        self.wall_time += time.perf_counter() - self._wall_start
+        self.cpu_time += time.process_time() - self._cpu_start
+
+
+class RunStats:
+    """ Collects StageStats for each stage of a run. """
+
+    def __init__(self):
+
+        self.stages = {}
+        self._current = None
+
+        # Wall and CPU time attributed to other stages while the current one
+        # runs. See attribute.
+        self._attributed = [0.0, 0.0]
+
+    @contextmanager
+    def stage(self, name: str):
+
+        stage = StageStats(name)
+
+        self.stages[name] = stage
+        self._current = stage
+        self._attributed = [0.0, 0.0]
+
+        is_tracing = tracemalloc.is_tracing()
+
+        if is_tracing and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        try:
+            yield stage
+        finally:
+            wall_time, cpu_time = self._attributed
+
+            stage.wall_time = time.perf_counter() - wall_start - wall_time
+            stage.cpu_time = time.process_time() - cpu_start - cpu_time
+
+            if is_tracing:
+                stage.tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+
+            stage.max_rss = self._max_rss()
+
+            self._current = None
+
+            log.debug(f"Stage {name} took {stage.wall_time:.3f}s.")
+
+    def record(self, stage: str = None, **kwargs) -> None:
+        """ Record rows_in, rows_out and/or bytes_written for the current
+        stage or, once it's over, for the stage named stage e.g. rows that
+        were streamed through it. Does nothing when there's no such stage. """
+
+        if stage is None:
+            _stage = self._current
+        else:
+            _stage = self.stages.get(stage)
+
+        if _stage is None:
+            return
+
+        for key, value in kwargs.items():
+            setattr(_stage, key, value)
+
+    def attribute(self, stage: str, wall_time: float, cpu_time: float) -> None:
+        """ Attribute wall and CPU time spent during the current stage to the
+        stage named stage once it's over e.g. time spent in a lazy stage while
+        the current stage iterates over it. The time is added to that stage
+        and subtracted from the current one. Does nothing when there's no such
+        stage. """
+
+        _stage = self.stages.get(stage)
+
+        if _stage is None or _stage is self._current or _stage.wall_time is None:
+            return
+
+        _stage.wall_time += wall_time
+        _stage.cpu_time += cpu_time
+
+        if self._current is not None:
+            self._attributed[0] += wall_time
+            self._attributed[1] += cpu_time
+
+    @staticmethod
+    def _max_rss():
+        """ Peak resident set size of the process so far in bytes. """
+
+        if resource is None:
+            return None
+
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+    def serialize(self):
+        """ Serialize all completed stages. """
+        return {
+            name: stage.serialize()
+            for name, stage in self.stages.items()
+            if stage.wall_time is not None
+        }
+
+    def save(self, path: pathlib.Path) -> None:
+
+        log.info(f"Saving run stats to {path}...")
+
+        with open(path, "w") as f:
+            json.dump(self.serialize(), f, indent=4)
@@ -20,6 +20,16 @@ class Utilities:
         except Exception as error:
             raise ApplicationError(f"Unexpected Error: {repr(error)}")
 
+    @staticmethod
+    def delete_file(path: pathlib.PosixPath) -> None:
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
     @staticmethod
     def make_dir(path: pathlib.PosixPath) -> None:
 
@@ -38,5 +48,22 @@ class Utilities:
         except Exception as error:
             raise ApplicationError(f"Unexpected Error: {repr(error)}")
 
+    @staticmethod
+    def link_file(src: pathlib.PosixPath, dest: pathlib.PosixPath) -> None:
+        """ Replace dest with a hardlink to src. """
+
+        dest_tmp = dest.with_name(f"{dest.name}.tmp")
+
+        try:
+            os.link(src, dest_tmp)
+        except OSError:
+            """ Hardlinks aren't supported across file systems and on some
+            file systems at all so we fall back to copying the file. """
+            shutil.copyfile(src, dest_tmp)
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        os.replace(dest_tmp, dest)
+
 
 utilities = Utilities()
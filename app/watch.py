@@ -0,0 +1,248 @@
+import logging
+import os
+import pathlib
+import re
+import select
+import struct
+import time
+
+from .errors import ApplicationError
+
+
+log = logging.getLogger(__name__)
+
+
+# Matches SQLite database files along with their write-ahead log and rollback
+# journal. Shared memory files change on every read so they're ignored.
+RE_DATABASE = re.compile(r"\.sqlite(?:-wal|-journal)?$")
+
+
+class Watcher:
+    """ Block until the databases in any of directories change. A burst of
+    changes, like the several writes of a single SQLite transaction, is
+    debounced into one by waiting until nothing has changed for debounce
+    seconds. """
+
+    def __init__(self, directories: list, debounce: float = 1.0):
+
+        self.directories = [pathlib.Path(directory) for directory in directories]
+        self.debounce = debounce
+
+        for directory in self.directories:
+            if not directory.is_dir():
+                raise ApplicationError(f"Couldn't find directory @ {directory}.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def wait(self) -> set:
+        """ Wait for changes and return the directories that changed. """
+
+        changed = self._wait(timeout=None)
+
+        while True:
+
+            more = self._wait(timeout=self.debounce)
+
+            if not more:
+                return changed
+
+            changed |= more
+
+    def close(self) -> None:
+        pass
+
+    def _wait(self, timeout: float = None) -> set:
+        """ Wait up to timeout seconds, or forever when it's None, for changes
+        and return the directories that changed. """
+        raise NotImplementedError
+
+
+class InotifyWatcher(Watcher):
+    """ Watcher using Linux's inotify through libc. """
+
+    IN_MODIFY = 0x00000002
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = 0o00004000
+    IN_CLOEXEC = 0o02000000
+
+    # Only events that change the contents of files. Readers of a database in
+    # WAL mode open its log for writing so closing or touching it is ignored.
+    mask = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+    event = struct.Struct("iIII")
+
+    def __init__(self, directories: list, debounce: float = 1.0):
+
+        super().__init__(directories, debounce=debounce)
+
+        self._fd = None
+
+        # Imported here as ctypes is slow to import and only needed to watch.
+        import ctypes
+        import ctypes.util
+
+        libc_name = ctypes.util.find_library("c")
+
+        if libc_name is None:
+            raise OSError("Couldn't find libc.")
+
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        # Raises AttributeError when libc doesn't provide inotify.
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+
+        self._fd = inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed.")
+
+        self._directories = {}
+
+        for directory in self.directories:
+
+            wd = inotify_add_watch(self._fd, os.fsencode(directory), self.mask)
+
+            if wd < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), f"Couldn't watch {directory}.")
+
+            self._directories[wd] = directory
+
+    def close(self) -> None:
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _wait(self, timeout: float = None) -> set:
+
+        changed = set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while not changed:
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+
+            if remaining is not None and remaining <= 0:
+                break
+
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+
+            if not readable:
+                break
+
+            changed |= self._read()
+
+        return changed
+
+    def _read(self) -> set:
+
+        changed = set()
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+
+        while offset < len(data):
+
+            wd, mask, _, length = self.event.unpack_from(data, offset)
+            offset += self.event.size
+            name = data[offset : offset + length].rstrip(b"\0").decode()
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                """ Events were dropped so any of the directories might have
+                changed. """
+                changed.update(self.directories)
+            elif wd in self._directories and RE_DATABASE.search(name):
+                changed.add(self._directories[wd])
+
+        return changed
+
+
+class PollingWatcher(Watcher):
+    """ Watcher comparing the size and modification time of the databases
+    every interval seconds. """
+
+    def __init__(
+        self, directories: list, debounce: float = 1.0, interval: float = 2.0
+    ):
+
+        super().__init__(directories, debounce=debounce)
+
+        self.interval = interval
+
+        self._signatures = {d: self._signature(d) for d in self.directories}
+
+    def _wait(self, timeout: float = None) -> set:
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+
+            changed = set()
+
+            for directory in self.directories:
+
+                signature = self._signature(directory)
+
+                if signature != self._signatures[directory]:
+                    self._signatures[directory] = signature
+                    changed.add(directory)
+
+            if changed:
+                return changed
+
+            if deadline is None:
+                time.sleep(self.interval)
+                continue
+
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                return changed
+
+            time.sleep(min(self.interval, remaining))
+
+    @staticmethod
+    def _signature(directory: pathlib.Path) -> dict:
+
+        signature = {}
+
+        for path in directory.iterdir():
+
+            if not RE_DATABASE.search(path.name):
+                continue
+
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            signature[path.name] = (stat.st_size, stat.st_mtime_ns)
+
+        return signature
+
+
+def watcher(directories: list, debounce: float = 1.0, interval: float = 2.0):
+    """ Create an InotifyWatcher where inotify is available falling back to a
+    PollingWatcher everywhere else. """
+
+    try:
+        return InotifyWatcher(directories, debounce=debounce)
+    except (OSError, AttributeError) as error:
+        log.info(f"Polling for changes every {interval}s. {repr(error)}")
+        return PollingWatcher(directories, debounce=debounce, interval=interval)
@@ -0,0 +1,523 @@
+import csv
+import gc
+import gzip
+import hashlib
+import io
+import json
+import logging
+import lzma
+import marshal
+import os
+import pathlib
+import struct
+from typing import Callable, Iterator
+
+from .errors import ApplicationError
+from .utilities import utilities
+
+
+log = logging.getLogger(__name__)
+
+
+class Writer:
+    """ Stream items into a file one at a time. Only the item currently being
+    written is held in memory. Subclasses define the format through
+    _write_header, _format_item and _write_footer and how it's read back
+    through load.
+
+    metadata is called once all items have been written so it can report
+    final counts. Output is written to a temporary file and only moved into
+    place once the writer is closed without an error.
+
+    hash is the SHA-256 of the items as they were formatted, leaving out the
+    metadata. When previous, the {"path": ..., "hash": ...} of the same output
+    of a previous export, has the same hash the previous file is kept, or
+    hardlinked to path, instead of being replaced. """
+
+    # File extension of the format.
+    suffix = ""
+
+    # Whether items are written as bytes rather than text.
+    binary = False
+
+    # Whether items can hold nested lists and dicts e.g. a source along with
+    # its annotations.
+    nested = True
+
+    # Whether items are written as json.dumps(..., indent=4) encodes them so
+    # write can be given an item already encoded instead of the item itself.
+    indented = False
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        key: str,
+        metadata: Callable[[], dict],
+        previous: dict = None,
+    ):
+
+        self.path = path
+        self.count = 0
+        self.bytes_written = 0
+        self.hash = None
+        self.is_unchanged = False
+
+        self._key = key
+        self._metadata = metadata
+        self._previous = previous
+        self._path_tmp = path.with_name(f"{path.name}.tmp")
+        self._file = None
+        self._hash = hashlib.sha256()
+
+    def __enter__(self):
+
+        self.open()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self) -> None:
+
+        try:
+            self._file = self._open(self._path_tmp, "w")
+        except Exception as error:
+            raise ApplicationError(f"Unexpected Error: {repr(error)}")
+
+        self._write_header()
+
+    def write(self, item: dict, encoded: str = None) -> None:
+        """ Write item. encoded is item as already encoded by
+        json.dumps(item, indent=4, ensure_ascii=False) to save encoding it
+        again where the format allows. item may be None when encoded is given
+        to an indented writer. """
+
+        data = self._format_item(item, encoded=encoded)
+
+        self._file.write(data)
+        self._hash.update(data if self.binary else data.encode("utf-8"))
+        self.count += 1
+
+    def close(self) -> None:
+
+        self._write_footer(self._metadata())
+
+        self._file.close()
+
+        self.hash = self._hash.hexdigest()
+        self.bytes_written = self._path_tmp.stat().st_size
+
+        previous = self._previous or {}
+        previous_path = pathlib.Path(previous.get("path", self.path))
+
+        if previous.get("hash") == self.hash and previous_path.is_file():
+
+            log.info(f"Keeping unchanged {previous_path}.")
+
+            self.is_unchanged = True
+            os.remove(self._path_tmp)
+
+            if previous_path != self.path:
+                utilities.link_file(src=previous_path, dest=self.path)
+
+            return
+
+        os.replace(self._path_tmp, self.path)
+
+    def abort(self) -> None:
+
+        self._file.close()
+
+        try:
+            os.remove(self._path_tmp)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def load(cls, path: pathlib.Path, key: str = "annotations") -> dict:
+        """ Read a file written by the writer back as {"<key>": [<items>],
+        "metadata": {...}}. key is only needed by formats that don't store
+        it. """
+        raise NotImplementedError
+
+    @classmethod
+    def _open(cls, path: pathlib.Path, mode: str):
+
+        if cls.binary:
+            return open(path, f"{mode}b")
+
+        return open(path, mode, encoding="utf-8")
+
+    def _write_header(self) -> None:
+        pass
+
+    def _format_item(self, item: dict, encoded: str = None):
+        raise NotImplementedError
+
+    def _write_footer(self, metadata: dict) -> None:
+        pass
+
+
+class JSONWriter(Writer):
+    """ Stream items into a JSON document. The document has the shape
+    {"<key>": [<items>], "metadata": {...}} and is byte-for-byte what
+    json.dump(..., indent=4, ensure_ascii=False) produces for the same
+    data. """
+
+    suffix = ".json"
+    indent = 4
+    indented = True
+
+    @classmethod
+    def load(cls, path: pathlib.Path, key: str = "annotations") -> dict:
+
+        with cls._open(path, "r") as f:
+            return json.load(f)
+
+    def _write_header(self) -> None:
+
+        self._file.write(f"{{\n{self._pad(1)}{self._dumps(self._key)}: [")
+
+    def _format_item(self, item: dict, encoded: str = None) -> str:
+
+        separator = "," if self.count else ""
+
+        if encoded is None:
+            encoded = self._dumps(item, level=2)
+        else:
+            encoded = encoded.replace("\n", f"\n{self._pad(2)}")
+
+        return f"{separator}\n{self._pad(2)}{encoded}"
+
+    def _write_footer(self, metadata: dict) -> None:
+
+        closing = f"\n{self._pad(1)}]" if self.count else "]"
+        metadata = self._dumps(metadata, level=1)
+
+        self._file.write(f'{closing},\n{self._pad(1)}"metadata": {metadata}\n}}')
+
+    def _pad(self, level: int) -> str:
+        return " " * self.indent * level
+
+    def _dumps(self, value, level: int = 0) -> str:
+
+        data = json.dumps(value, indent=self.indent, ensure_ascii=False)
+
+        return data.replace("\n", f"\n{self._pad(level)}")
+
+
+class CompactJSONWriter(JSONWriter):
+    """ Stream items into a JSON document without any whitespace. It's what
+    json.dump(..., separators=(",", ":"), ensure_ascii=False) produces and is
+    encoded by the json module's C encoder. """
+
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    indented = False
+
+    def _write_header(self) -> None:
+
+        self._file.write(f"{{{self.encoder.encode(self._key)}:[")
+
+    def _format_item(self, item: dict, encoded: str = None) -> str:
+
+        separator = "," if self.count else ""
+
+        return f"{separator}{self.encoder.encode(item)}"
+
+    def _write_footer(self, metadata: dict) -> None:
+
+        self._file.write(f'],"metadata":{self.encoder.encode(metadata)}}}')
+
+
+class GzipJSONWriter(CompactJSONWriter):
+    """ Compact JSON compressed with gzip. """
+
+    suffix = ".json.gz"
+    compresslevel = 6
+
+    @classmethod
+    def _open(cls, path: pathlib.Path, mode: str):
+        return gzip.open(
+            path, f"{mode}t", encoding="utf-8", compresslevel=cls.compresslevel
+        )
+
+
+class XZJSONWriter(CompactJSONWriter):
+    """ Compact JSON compressed with xz. Smaller than gzip but several times
+    slower to write. """
+
+    suffix = ".json.xz"
+
+    @classmethod
+    def _open(cls, path: pathlib.Path, mode: str):
+        return lzma.open(path, f"{mode}t", encoding="utf-8")
+
+
+class JSONLinesWriter(Writer):
+    """ Stream items into a JSON Lines file with one item per line. The last
+    line holds the metadata as {"metadata": {...}}. """
+
+    suffix = ".jsonl"
+
+    @classmethod
+    def load(cls, path: pathlib.Path, key: str = "annotations") -> dict:
+
+        with cls._open(path, "r") as f:
+            items = [json.loads(line) for line in f]
+
+        metadata = items.pop()["metadata"] if items else None
+
+        return {key: items, "metadata": metadata}
+
+    def _format_item(self, item: dict, encoded: str = None) -> str:
+        return f"{json.dumps(item, ensure_ascii=False)}\n"
+
+    def _write_footer(self, metadata: dict) -> None:
+
+        data = json.dumps({"metadata": metadata}, ensure_ascii=False)
+
+        self._file.write(f"{data}\n")
+
+
+class CSVWriter(Writer):
+    """ Stream serialized Annotations into a CSV file with one annotation per
+    row under a header of columns. Paragraphs of text are joined by newlines
+    and tags and collections by spaces. CSV has nowhere to keep metadata so
+    it's left out. """
+
+    suffix = ".csv"
+    nested = False
+
+    columns = (
+        "id",
+        "text",
+        "notes",
+        "source_id",
+        "source_name",
+        "source_author",
+        "tags",
+        "collections",
+        "date_created",
+        "date_modified",
+        "style",
+        "epubcfi",
+        "location",
+        "origin",
+        "is_starred",
+    )
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer)
+
+    @classmethod
+    def load(cls, path: pathlib.Path, key: str = "annotations") -> dict:
+
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            items = list(csv.DictReader(f))
+
+        return {key: items, "metadata": None}
+
+    @classmethod
+    def _open(cls, path: pathlib.Path, mode: str):
+        return open(path, mode, encoding="utf-8", newline="")
+
+    def _write_header(self) -> None:
+
+        self._file.write(self._format_row(self.columns))
+
+    def _format_item(self, item: dict, encoded: str = None) -> str:
+
+        source = item["source"]
+        metadata = item["metadata"]
+
+        return self._format_row(
+            (
+                item["id"],
+                "\n".join(item["text"]),
+                item["notes"],
+                source["id"],
+                source["name"],
+                source["author"],
+                " ".join(item["tags"]),
+                " ".join(item["collections"]),
+                metadata["date_created"],
+                metadata["date_modified"],
+                metadata["style"],
+                metadata["epubcfi"],
+                metadata["location"],
+                metadata["origin"],
+                int(metadata["is_starred"]),
+            )
+        )
+
+    def _format_row(self, row: tuple) -> str:
+
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._csv.writerow(row)
+
+        return self._buffer.getvalue()
+
+
+class RecordsWriter(Writer):
+    """ Stream items into a binary file of length-prefixed records for fast
+    reloading. The file starts with the magic bytes and the marshal version
+    the records were written with. Every record is a byte holding its kind,
+    the length of its data as an unsigned 32-bit big-endian integer and the
+    item serialized by marshal. The last record holds the metadata.
+
+    Records use marshal version 2 which every Python 3 reads. Later versions
+    share references between equal objects depending on their reference
+    counts so the same item wouldn't always be written the same way. """
+
+    suffix = ".records"
+    binary = True
+
+    magic = b"HLTSREC1"
+    marshal_version = 2
+    header = struct.Struct(">B")
+    record = struct.Struct(">BI")
+
+    ITEM = 0
+    METADATA = 1
+
+    @classmethod
+    def load(cls, path: pathlib.Path, key: str = "annotations") -> dict:
+        """ Read the whole file at once and unmarshal each record from a slice
+        of it rather than reading the records one at a time. The garbage
+        collector is paused meanwhile. Records can't hold reference cycles
+        but the collector would otherwise scan the items again and again as
+        they're created. """
+
+        with cls._open(path, "r") as f:
+            data = f.read()
+
+        items = []
+        metadata = None
+
+        is_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            for kind, value in cls._iter_data(data, path=path):
+                if kind == cls.ITEM:
+                    items.append(value)
+                else:
+                    metadata = value
+        finally:
+            if is_enabled:
+                gc.enable()
+
+        return {key: items, "metadata": metadata}
+
+    @classmethod
+    def iter_records(cls, path: pathlib.Path) -> Iterator[tuple]:
+        """ Yield the kind and value of each record in path. Records are read
+        one at a time so only the current one is held in memory. """
+
+        with cls._open(path, "r") as f:
+
+            cls._check_header(f.read(len(cls.magic) + cls.header.size), path=path)
+
+            while True:
+
+                data = f.read(cls.record.size)
+
+                if not data:
+                    break
+
+                kind, length = cls.record.unpack(data)
+
+                yield kind, marshal.loads(f.read(length))
+
+    @classmethod
+    def _iter_data(cls, data: bytes, path: pathlib.Path) -> Iterator[tuple]:
+        """ Yield the kind and value of each record in data, the contents of
+        the file at path. """
+
+        start = len(cls.magic) + cls.header.size
+
+        cls._check_header(data[:start], path=path)
+
+        view = memoryview(data)
+        unpack_from = cls.record.unpack_from
+        size = cls.record.size
+        end = len(data)
+
+        while start < end:
+
+            kind, length = unpack_from(data, start)
+            start += size
+
+            yield kind, marshal.loads(view[start : start + length])
+            start += length
+
+    @classmethod
+    def _check_header(cls, data: bytes, path: pathlib.Path) -> None:
+
+        magic = data[: len(cls.magic)]
+        (version,) = cls.header.unpack(data[len(cls.magic) :])
+
+        if magic != cls.magic:
+            raise ApplicationError(f"Not a records file @ {path}.")
+
+        if version > marshal.version:
+            raise ApplicationError(
+                f"Records @ {path} written with marshal version {version}."
+            )
+
+    def _write_header(self) -> None:
+
+        self._file.write(self.magic + self.header.pack(self.marshal_version))
+
+    def _format_item(self, item: dict, encoded: str = None) -> bytes:
+        return self._format_record(self.ITEM, item)
+
+    def _write_footer(self, metadata: dict) -> None:
+
+        self._file.write(self._format_record(self.METADATA, metadata))
+
+    def _format_record(self, kind: int, value) -> bytes:
+
+        data = marshal.dumps(value, self.marshal_version)
+
+        return self.record.pack(kind, len(data)) + data
+
+
+writers = {
+    "json": JSONWriter,
+    "json-compact": CompactJSONWriter,
+    "json-gzip": GzipJSONWriter,
+    "json-xz": XZJSONWriter,
+    "jsonl": JSONLinesWriter,
+    "csv": CSVWriter,
+    "records": RecordsWriter,
+}
+
+
+def get_writer(name: str, nested: bool = False) -> type:
+    """ Writer class registered as name. Raises an ApplicationError for
+    unknown formats and, when nested, for formats that can't hold nested
+    items. """
+
+    try:
+        writer = writers[name]
+    except KeyError:
+        raise ApplicationError(
+            f"Unknown format '{name}'. Choose from {', '.join(writers)}."
+        )
+
+    if nested and not writer.nested:
+        raise ApplicationError(f"Format '{name}' can't hold nested items.")
+
+    return writer
@@ -0,0 +1 @@
+from .library import SyntheticLibrary
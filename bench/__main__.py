@@ -0,0 +1,226 @@
+""" Time each stage of AppleBooks.run against synthetic libraries.
+
+    python -m bench --sizes 1000 100000 1000000 --output bench.json
+    python -m bench --sizes 1000 --compare bench.json
+    python -m bench --sizes 100000 --pushdown
+    python -m bench --sizes 100000 --cached
+
+Libraries and exports are written to a temporary directory so this runs on
+any platform without touching ~/.hlts-data. Annotations are streamed from
+the database through processing to disk so the save_data stage includes the
+time spent querying and processing them. """
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import sys
+import tempfile
+from datetime import datetime
+
+from .library import SyntheticLibrary
+
+
+# Stages timed in the stats of each run. Setup isn't timed.
+STAGES = ["copy_databases", "query_and_cache_data", "process_data", "save_data"]
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 100000, 1000000],
+        help="number of annotations in each library",
+    )
+    parser.add_argument(
+        "--sources",
+        type=int,
+        default=None,
+        help="number of sources in each library (default: one per 20 annotations)",
+    )
+    parser.add_argument("--notes", type=float, default=0.3)
+    parser.add_argument("--tags", type=int, default=2)
+    parser.add_argument("--cfi-depth", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--pushdown",
+        action="store_true",
+        help="also time each library with conversions pushed down into SQLite",
+    )
+    parser.add_argument(
+        "--cached",
+        action="store_true",
+        help="time each library with the annotation cache enabled, then again "
+        "with it populated",
+    )
+    parser.add_argument(
+        "--output", type=pathlib.Path, default=None, help="save results as JSON"
+    )
+    parser.add_argument(
+        "--compare",
+        type=pathlib.Path,
+        default=None,
+        help="compare against results previously saved with --output",
+    )
+
+    return parser.parse_args()
+
+
+def run(args, tmp_dir: pathlib.Path) -> list:
+
+    # Imported here so HLTS_DATA_ROOT is set before AppDefaults is evaluated.
+    from app.applebooks import AppleBooks
+    from app.applebooks.defaults import AppleBooksPaths
+    from app.config import config
+
+    results = []
+
+    for size in args.sizes:
+
+        sources = args.sources or min(max(size // 20, 1), 5000)
+
+        print(f"Generating library with {sources} sources and {size} annotations...")
+
+        library = SyntheticLibrary(
+            root_dir=tmp_dir / "libraries" / str(size),
+            sources=sources,
+            annotations=size,
+            notes=args.notes,
+            tags=args.tags,
+            cfi_depth=args.cfi_depth,
+            seed=args.seed,
+        ).generate()
+
+        for pushdown in [False, True] if args.pushdown else [False]:
+
+            config.pushdown = pushdown
+
+            name = f"{size}-pushdown" if pushdown else str(size)
+
+            paths = AppleBooksPaths(
+                src_root_dir=library.root_dir,
+                local_root_dir=tmp_dir / "exports" / name,
+                state_dir=tmp_dir / "state" / name,
+            )
+
+            # The cache is off by default. --cached enables it with room for
+            # every annotation.
+            config.cache_size = size if args.cached else 0
+
+            for cached in [False, True] if args.cached else [False]:
+
+                # The second run reuses the state_dir and so the annotation
+                # cache populated by the first.
+                applebooks = AppleBooks(paths=paths)
+                applebooks.run()
+
+                stages = {
+                    stage: applebooks.stats.stages[stage].wall_time
+                    for stage in STAGES
+                }
+
+                results.append(
+                    {
+                        "annotations": size,
+                        "sources": sources,
+                        "pushdown": pushdown,
+                        "cached": cached,
+                        "stages": stages,
+                        "total": sum(stages.values()),
+                    }
+                )
+
+    return results
+
+
+def report(results: list, baseline: list = None) -> None:
+
+    def key(result: dict) -> tuple:
+        return (
+            result["annotations"],
+            result.get("pushdown", False),
+            result.get("cached", False),
+        )
+
+    baseline = {key(r): r for r in baseline or []}
+    current = {key(r): r for r in results}
+
+    for result in results:
+
+        pushdown = result.get("pushdown", False)
+        cached = result.get("cached", False)
+
+        if cached:
+            # Cached results are compared with the same library's first run.
+            previous = current.get((result["annotations"], pushdown, False))
+        elif pushdown:
+            # Pushed down results are compared with the same library run
+            # through the Python conversions.
+            previous = current.get((result["annotations"], False, False))
+        else:
+            previous = baseline.get(key(result))
+
+        print(
+            f"\n{result['annotations']} annotations, {result['sources']} sources"
+            f"{' (pushdown)' if pushdown else ''}{' (cached)' if cached else ''}"
+        )
+
+        for stage, seconds in [*result["stages"].items(), ("total", result["total"])]:
+
+            line = f"  {stage:<24}{seconds:>10.3f}s"
+
+            if previous is not None:
+                if stage == "total":
+                    before = previous["total"]
+                else:
+                    stages = previous["stages"]
+                    # Results saved before the stages were timed from their
+                    # stats are keyed by the methods that ran them.
+                    before = stages.get(stage, stages.get(f"_{stage}"))
+                if before:
+                    line += f"{before:>10.3f}s{seconds / before:>8.2f}x"
+
+            print(line)
+
+
+def main():
+
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        tmp_dir = pathlib.Path(tmp)
+
+        data_root = pathlib.Path(os.environ.setdefault("HLTS_DATA_ROOT", tmp))
+        data_root.mkdir(parents=True, exist_ok=True)
+
+        results = run(args, tmp_dir)
+
+    data = {
+        "date": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+    baseline = None
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+
+    report(results, baseline=baseline)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=4)
+
+
+if __name__ == "__main__":
+
+    main()
+    sys.exit()
@@ -0,0 +1,165 @@
+""" Compare the export formats of app.writers on a synthetic library.
+
+    python -m bench.formats --size 100000
+    python -m bench.formats --size 100000 --formats json json-compact records
+
+The library's annotations are processed once and held in memory. Each format
+then writes them to a temporary directory and reads them back with its
+writer's load. Reports the bytes written along with the write and read
+times of each format. """
+
+import argparse
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+from .library import SyntheticLibrary
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.formats", description=__doc__
+    )
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument(
+        "--sources",
+        type=int,
+        default=None,
+        help="number of sources in the library (default: one per 20 annotations)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        default=None,
+        help="formats to compare (default: every registered format)",
+    )
+    parser.add_argument(
+        "--output", type=pathlib.Path, default=None, help="save results as JSON"
+    )
+
+    return parser.parse_args()
+
+
+def annotations(args, tmp_dir: pathlib.Path) -> list:
+    """ Serialized annotations of a synthetic library. """
+
+    # Imported here so HLTS_DATA_ROOT is set before AppDefaults is evaluated.
+    from app.applebooks import AppleBooks
+    from app.applebooks.defaults import AppleBooksPaths
+
+    sources = args.sources or min(max(args.size // 20, 1), 5000)
+
+    print(f"Generating library with {sources} sources and {args.size} annotations...")
+
+    library = SyntheticLibrary(
+        root_dir=tmp_dir / "library",
+        sources=sources,
+        annotations=args.size,
+        seed=args.seed,
+    ).generate()
+
+    paths = AppleBooksPaths(
+        src_root_dir=library.root_dir,
+        local_root_dir=tmp_dir / "export",
+        state_dir=tmp_dir / "state",
+    )
+
+    applebooks = AppleBooks(paths=paths)
+
+    applebooks.export.setup()
+    applebooks.snapshot()
+    applebooks.query()
+
+    return [a.serialize() for _, group in applebooks.process() for a in group]
+
+
+def run(args, tmp_dir: pathlib.Path) -> list:
+
+    from app.writers import get_writer, writers
+
+    items = annotations(args, tmp_dir)
+    metadata = {"count_annotations": len(items)}
+
+    results = []
+
+    for name in args.formats or writers:
+
+        writer_class = get_writer(name)
+        path = tmp_dir / f"annotations{writer_class.suffix}"
+
+        print(f"Writing {name}...")
+
+        start = time.perf_counter()
+
+        writer = writer_class(path=path, key="annotations", metadata=lambda: metadata)
+
+        with writer:
+            for item in items:
+                writer.write(item)
+
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        data = writer_class.load(path, key="annotations")
+        read_time = time.perf_counter() - start
+
+        results.append(
+            {
+                "format": name,
+                "annotations": len(data["annotations"]),
+                "bytes_written": path.stat().st_size,
+                "write_time": write_time,
+                "read_time": read_time,
+            }
+        )
+
+        os.remove(path)
+
+    return results
+
+
+def report(results: list) -> None:
+
+    baseline = next((r for r in results if r["format"] == "json"), results[0])
+
+    print(f"\n{'format':<16}{'bytes':>14}{'size':>8}{'write':>10}{'read':>10}")
+
+    for result in results:
+
+        size = result["bytes_written"] / baseline["bytes_written"]
+
+        print(
+            f"{result['format']:<16}{result['bytes_written']:>14,}{size:>7.2f}x"
+            f"{result['write_time']:>9.3f}s{result['read_time']:>9.3f}s"
+        )
+
+
+def main():
+
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        tmp_dir = pathlib.Path(tmp)
+
+        data_root = pathlib.Path(os.environ.setdefault("HLTS_DATA_ROOT", tmp))
+        data_root.mkdir(parents=True, exist_ok=True)
+
+        results = run(args, tmp_dir)
+
+    report(results)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"size": args.size, "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+
+    main()
+    sys.exit()
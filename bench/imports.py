@@ -0,0 +1,184 @@
+""" Time importing the app with python -X importtime and check it against a
+budget.
+
+    python -m bench.imports
+    python -m bench.imports --modules app app.applebooks.models --budget 0.1
+
+Each module is imported in a fresh interpreter with HLTS_DATA_ROOT pointing at
+a directory that doesn't exist. Reports the median cumulative import time of
+each module over a number of runs. Exits with an error when any module takes
+longer than the budget, creates files or imports one of the modules that are
+only meant to be imported when they're used. """
+
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+
+# Modules that are slow to import and only needed by some runs.
+DEFERRED = ["psutil", "multiprocessing", "ctypes"]
+
+# Maximum median import time of each module in seconds.
+BUDGET = 0.15
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.imports", description=__doc__
+    )
+    parser.add_argument("--modules", nargs="+", default=["app"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=BUDGET,
+        help=f"maximum median import time of each module in seconds "
+        f"(default: {BUDGET})",
+    )
+    parser.add_argument(
+        "--output", type=pathlib.Path, default=None, help="save results as JSON"
+    )
+
+    return parser.parse_args()
+
+
+def import_module(module: str, tmp_dir: pathlib.Path) -> tuple:
+    """ Import module in a fresh interpreter. Returns its cumulative import time
+    in seconds and the names of every module imported along with it. Raises a
+    RuntimeError holding the last line of the traceback if the import
+    fails. """
+
+    env = {
+        **os.environ,
+        "HLTS_DATA_ROOT": str(tmp_dir / "data"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    }
+
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR,
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+
+    # import time: self [us] | cumulative | imported package
+    imports = {}
+
+    for line in process.stderr.splitlines():
+
+        if not line.startswith("import time:"):
+            continue
+
+        _, cumulative, name = line.split("|")
+
+        if cumulative.strip().isdigit():
+            imports[name.strip()] = int(cumulative) / 1e6
+
+    return imports[module], set(imports)
+
+
+def run(args, tmp_dir: pathlib.Path) -> list:
+
+    results = []
+
+    for module in args.modules:
+
+        module_dir = tmp_dir / module
+        module_dir.mkdir()
+
+        times = []
+        imported = set()
+
+        try:
+            for _ in range(args.runs):
+                seconds, names = import_module(module, module_dir)
+                times.append(seconds)
+                imported |= names
+        except RuntimeError as error:
+            results.append({"module": module, "error": str(error)})
+            continue
+
+        results.append(
+            {
+                "module": module,
+                "median": statistics.median(times),
+                "min": min(times),
+                "max": max(times),
+                "deferred": sorted(
+                    name for name in imported if name.split(".")[0] in DEFERRED
+                ),
+                "files": sorted(
+                    str(path.relative_to(module_dir))
+                    for path in module_dir.rglob("*")
+                ),
+            }
+        )
+
+    return results
+
+
+def report(results: list, budget: float) -> bool:
+    """ Print results. Returns whether every module is within budget. """
+
+    ok = True
+
+    print(f"\n{'module':<32}{'median':>10}{'min':>10}{'max':>10}")
+
+    for result in results:
+
+        if "error" in result:
+            print(f"{result['module']:<32}{'failed':>10}\n  {result['error']}")
+            ok = False
+            continue
+
+        print(
+            f"{result['module']:<32}{result['median']:>9.3f}s"
+            f"{result['min']:>9.3f}s{result['max']:>9.3f}s"
+        )
+
+        if result["median"] > budget:
+            print(f"  Over budget of {budget:.3f}s.")
+            ok = False
+
+        if result["deferred"]:
+            print(f"  Imports {', '.join(result['deferred'])}.")
+            ok = False
+
+        if result["files"]:
+            print(f"  Creates {', '.join(result['files'])}.")
+            ok = False
+
+    return ok
+
+
+def main():
+
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args, pathlib.Path(tmp))
+
+    ok = report(results, budget=args.budget)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"budget": args.budget, "results": results}, f, indent=4)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+
+    main()
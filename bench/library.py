@@ -0,0 +1,258 @@
+import pathlib
+import random
+import sqlite3
+import uuid
+
+
+class SyntheticLibrary:
+    """ Generate a Books library with the same layout as the one found under
+    AppleBooksDefaults.src_root_dir i.e. a BKLibrary and an AEAnnotation
+    directory each holding a Core Data *.sqlite file. Tables use the column
+    names Books uses so AppleBooksDB can query them unchanged. Generation is
+    seeded so the same arguments always produce the same library. """
+
+    bklibrary_name = "BKLibrary-1-091020131601.sqlite"
+    aeannotation_name = "AEAnnotation_v10312011_1727_local.sqlite"
+
+    words = (
+        "the of and to in is was that for it with as his on be at by had are "
+        "but from or have an they which one you were her all she there would "
+        "their we him been has when who will more no if out so said what up "
+        "its about into than them can only other new some could time these "
+        "two may then do first any my now such like our over man me even most"
+    ).split()
+
+    def __init__(
+        self,
+        root_dir: pathlib.Path,
+        sources: int = 100,
+        annotations: int = 1000,
+        notes: float = 0.3,
+        tags: int = 2,
+        cfi_depth: int = 4,
+        deleted: float = 0.02,
+        seed: int = 0,
+    ):
+        """
+        root_dir: Directory the BKLibrary and AEAnnotation directories are
+            created in. Use it as AppleBooksPaths.src_root_dir.
+        sources: Number of books in the library.
+        annotations: Number of annotations across all books. Deleted
+            annotations are generated on top of these.
+        notes: Ratio of annotations that have notes.
+        tags: Maximum number of tags and collections in a note.
+        cfi_depth: Number of steps in the content path of each epubcfi.
+        deleted: Ratio of additional deleted annotations.
+        seed: Seed for the random number generator.
+        """
+
+        self.root_dir = root_dir
+        self.bklibrary_dir = root_dir / "BKLibrary"
+        self.aeannotation_dir = root_dir / "AEAnnotation"
+
+        self.sources = sources
+        self.annotations = annotations
+        self.notes = notes
+        self.tags = tags
+        self.cfi_depth = cfi_depth
+        self.deleted = deleted
+
+        self._random = random.Random(seed)
+
+    def generate(self) -> "SyntheticLibrary":
+
+        self.bklibrary_dir.mkdir(parents=True, exist_ok=True)
+        self.aeannotation_dir.mkdir(parents=True, exist_ok=True)
+
+        asset_ids = self._generate_bklibrary()
+        self._generate_aeannotation(asset_ids)
+
+        return self
+
+    def _generate_bklibrary(self) -> list:
+
+        sqlite_file = self.bklibrary_dir / self.bklibrary_name
+        self._delete(sqlite_file)
+
+        asset_ids = [self._uuid().replace("-", "") for _ in range(self.sources)]
+
+        rows = (
+            (
+                asset_id,
+                self._sentence(1, 6).title(),
+                self._sentence(2, 3).title(),
+                f"/Users/Shared/Books/{asset_id}.epub",
+                "Fiction",
+                self._date(),
+            )
+            for asset_id in asset_ids
+        )
+
+        connection = sqlite3.connect(sqlite_file)
+
+        with connection:
+            connection.execute(
+                """
+                CREATE TABLE ZBKLIBRARYASSET (
+                    Z_PK INTEGER PRIMARY KEY,
+                    Z_ENT INTEGER,
+                    Z_OPT INTEGER,
+                    ZASSETID VARCHAR,
+                    ZTITLE VARCHAR,
+                    ZAUTHOR VARCHAR,
+                    ZPATH VARCHAR,
+                    ZGENRE VARCHAR,
+                    ZCREATIONDATE TIMESTAMP
+                );
+                """
+            )
+            connection.executemany(
+                """
+                INSERT INTO ZBKLIBRARYASSET (
+                    Z_ENT, Z_OPT, ZASSETID, ZTITLE, ZAUTHOR, ZPATH, ZGENRE,
+                    ZCREATIONDATE
+                )
+                VALUES (1, 1, ?, ?, ?, ?, ?, ?);
+                """,
+                rows,
+            )
+
+        connection.close()
+
+        return asset_ids
+
+    def _generate_aeannotation(self, asset_ids: list) -> None:
+
+        sqlite_file = self.aeannotation_dir / self.aeannotation_name
+        self._delete(sqlite_file)
+
+        count_deleted = int(self.annotations * self.deleted)
+
+        rows = (
+            self._annotation(asset_ids, is_deleted=index >= self.annotations)
+            for index in range(self.annotations + count_deleted)
+        )
+
+        connection = sqlite3.connect(sqlite_file)
+
+        with connection:
+            connection.execute(
+                """
+                CREATE TABLE ZAEANNOTATION (
+                    Z_PK INTEGER PRIMARY KEY,
+                    Z_ENT INTEGER,
+                    Z_OPT INTEGER,
+                    ZANNOTATIONDELETED INTEGER,
+                    ZANNOTATIONISUNDERLINE INTEGER,
+                    ZANNOTATIONSTYLE INTEGER,
+                    ZANNOTATIONTYPE INTEGER,
+                    ZANNOTATIONCREATIONDATE TIMESTAMP,
+                    ZANNOTATIONMODIFICATIONDATE TIMESTAMP,
+                    ZANNOTATIONASSETID VARCHAR,
+                    ZANNOTATIONLOCATION VARCHAR,
+                    ZANNOTATIONNOTE VARCHAR,
+                    ZANNOTATIONREPRESENTATIVETEXT VARCHAR,
+                    ZANNOTATIONSELECTEDTEXT VARCHAR,
+                    ZANNOTATIONUUID VARCHAR
+                );
+                """
+            )
+            connection.execute(
+                """
+                CREATE INDEX Z_AEAnnotation_byAssetID
+                ON ZAEANNOTATION (ZANNOTATIONASSETID);
+                """
+            )
+            connection.executemany(
+                """
+                INSERT INTO ZAEANNOTATION (
+                    Z_ENT, Z_OPT, ZANNOTATIONDELETED, ZANNOTATIONISUNDERLINE,
+                    ZANNOTATIONSTYLE, ZANNOTATIONTYPE, ZANNOTATIONCREATIONDATE,
+                    ZANNOTATIONMODIFICATIONDATE, ZANNOTATIONASSETID,
+                    ZANNOTATIONLOCATION, ZANNOTATIONNOTE,
+                    ZANNOTATIONREPRESENTATIVETEXT, ZANNOTATIONSELECTEDTEXT,
+                    ZANNOTATIONUUID
+                )
+                VALUES (1, 1, ?, ?, ?, 2, ?, ?, ?, ?, ?, ?, ?, ?);
+                """,
+                rows,
+            )
+
+        connection.close()
+
+    def _annotation(self, asset_ids: list, is_deleted: bool) -> tuple:
+
+        style = self._random.randint(0, 5)
+        date_created = self._date()
+        date_modified = date_created + self._random.uniform(0, 3600 * 24 * 30)
+        text = self._paragraphs()
+
+        return (
+            int(is_deleted),
+            int(style == 0),
+            style,
+            date_created,
+            date_modified,
+            self._random.choice(asset_ids),
+            self._epubcfi(),
+            self._note(),
+            text,
+            text,
+            self._uuid(),
+        )
+
+    def _paragraphs(self) -> str:
+
+        paragraphs = [
+            self._sentence(8, 60) for _ in range(self._random.choice((1, 1, 1, 2, 3)))
+        ]
+
+        # Books stores curly quotes and often a trailing new line.
+        return "\n".join(f"“{p}”" for p in paragraphs) + "\n"
+
+    def _note(self):
+
+        if self._random.random() >= self.notes:
+            return None
+
+        tokens = [self._sentence(0, 12)]
+
+        for _ in range(self._random.randint(0, self.tags)):
+            tokens.append(f"#{self._random.choice(self.words)}")
+
+        for _ in range(self._random.randint(0, self.tags)):
+            tokens.append(f"@{self._random.choice(self.words + ['star'])}")
+
+        return " ".join(token for token in tokens if token)
+
+    def _epubcfi(self) -> str:
+
+        spine = self._random.randint(1, 60) * 2
+        path = "".join(
+            f"/{self._random.randint(1, 200) * 2}" for _ in range(self.cfi_depth)
+        )
+        start = self._random.randint(0, 400)
+        end = start + self._random.randint(1, 400)
+
+        return f"epubcfi(/6/{spine}[chapter{spine // 2:03}]!{path},/1:{start},/1:{end})"
+
+    @staticmethod
+    def _delete(sqlite_file: pathlib.Path) -> None:
+
+        try:
+            sqlite_file.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _sentence(self, minimum: int, maximum: int) -> str:
+
+        length = self._random.randint(minimum, maximum)
+
+        return " ".join(self._random.choices(self.words, k=length))
+
+    def _date(self) -> float:
+        """ Seconds since 2001-01-01 i.e. a Core Data timestamp. """
+        return self._random.uniform(3e8, 6e8)
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self._random.getrandbits(128), version=4)).upper()
@@ -1,14 +1,141 @@
 #!/usr/bin/env python3
 
+import argparse
+import cProfile
+import pathlib
 import sys
+import tracemalloc
 
 from app import App
+from app.applebooks.defaults import AppleBooksDefaults
+from app.applebooks.filters import AppleBooksFilters
+from app.batch import parse_libraries
+from app.defaults import AppDefaults
+from app.errors import ApplicationError
 
 
-app = App()
+def parse_args():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        type=pathlib.Path,
+        nargs="?",
+        const=AppDefaults.day_dir / "profile.pstats",
+        default=None,
+        help=(
+            "dump a cProfile of the run to PROFILE (default: profile.pstats in the "
+            "day directory) and trace memory allocations"
+        ),
+    )
+
+    filters = parser.add_argument_group(
+        "filters", "only export matching annotations, overriding config.json filters"
+    )
+    filters.add_argument(
+        "--source-id", dest="source_ids", action="append", help="repeatable"
+    )
+    filters.add_argument("--author", dest="authors", action="append", help="repeatable")
+    filters.add_argument("--created-after", help="ISO date or days ago e.g. 7d")
+    filters.add_argument("--created-before", help="ISO date or days ago e.g. 7d")
+    filters.add_argument("--modified-after", help="ISO date or days ago e.g. 7d")
+    filters.add_argument("--modified-before", help="ISO date or days ago e.g. 7d")
+    filters.add_argument(
+        "--style",
+        dest="styles",
+        action="append",
+        choices=AppleBooksDefaults.styles.values(),
+        help="repeatable",
+    )
+    filters.add_argument("--starred", action="store_true", default=None)
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    restore = subparsers.add_parser(
+        "restore", help="restore a day directory from the object store"
+    )
+    restore.add_argument("date", help="date of the day directory e.g. 2020-01-31")
+
+    watch = subparsers.add_parser(
+        "watch", help="export again whenever the Books databases change"
+    )
+    watch.add_argument(
+        "--debounce",
+        type=float,
+        default=1.0,
+        help="seconds without changes to wait for before exporting (default: 1)",
+    )
+    watch.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        help="seconds between polls where inotify isn't available (default: 2)",
+    )
+
+    batch = subparsers.add_parser(
+        "batch", help="export several Books libraries at once"
+    )
+    batch.add_argument(
+        "libraries",
+        nargs="+",
+        metavar="[NAME=]ROOT",
+        help="directory holding a library's BKLibrary and AEAnnotation databases",
+    )
+    batch.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of libraries exported at a time (default: up to 4)",
+    )
+
+    search = subparsers.add_parser(
+        "search", help="full-text search the text and notes of annotations"
+    )
+    search.add_argument("query", help="FTS5 query e.g. 'memory NOT forget'")
+    search.add_argument(
+        "--limit", type=int, default=20, help="maximum number of results"
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "batch":
+
+        try:
+            args.libraries = parse_libraries(args.libraries)
+        except ApplicationError as error:
+            parser.error(str(error))
+
+    return args
 
 
 if __name__ == "__main__":
 
-    app.run()
+    args = parse_args()
+
+    filters = {
+        key: getattr(args, key)
+        for key in AppleBooksFilters.keys
+        if getattr(args, key) is not None
+    }
+
+    app = App(filters=filters)
+
+    if args.command == "restore":
+        app.restore(date=args.date)
+    elif args.command == "watch":
+        app.watch(debounce=args.debounce, interval=args.interval)
+    elif args.command == "batch":
+        summary = app.batch(libraries=args.libraries, jobs=args.jobs)
+        sys.exit(1 if summary["failed"] else 0)
+    elif args.command == "search":
+        app.search(query=args.query, limit=args.limit)
+    elif args.profile is None:
+        app.run()
+    else:
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.runcall(app.run)
+        profiler.dump_stats(args.profile)
+        tracemalloc.stop()
+
     sys.exit()
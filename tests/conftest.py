@@ -0,0 +1,184 @@
+""" Fixtures shared by the tests. Every test runs against synthetic Books
+libraries generated by bench.library and writes to temporary directories so
+~/.hlts-data is never touched. """
+
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+
+import pytest
+
+# AppDefaults reads the root directory once when app is first imported so it's
+# pointed at a temporary directory before any test imports app.
+DATA_ROOT = pathlib.Path(tempfile.mkdtemp(prefix="hlts-data-"))
+os.environ["HLTS_DATA_ROOT"] = str(DATA_ROOT)
+
+from app.applebooks import AppleBooks  # noqa: E402
+from app.applebooks.defaults import AppleBooksPaths  # noqa: E402
+from app.config import config  # noqa: E402
+from bench.library import SyntheticLibrary  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def data_root():
+
+    yield DATA_ROOT
+
+    shutil.rmtree(DATA_ROOT, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def books_closed(monkeypatch):
+    """ Books may well be open on the machine running the tests. """
+
+    monkeypatch.setattr(
+        AppleBooks, "_is_applebooks_running", staticmethod(lambda: False)
+    )
+
+
+@pytest.fixture(autouse=True)
+def settings():
+    """ config with every setting a test changes restored afterwards. """
+
+    saved = config._serialize()
+
+    yield config
+
+    for name, value in saved.items():
+        setattr(config, name, value)
+
+
+@pytest.fixture
+def make_library(tmp_path):
+    """ Generate a synthetic library named name under tmp_path. """
+
+    def make_library(name: str = "library", **kwargs) -> SyntheticLibrary:
+        root_dir = tmp_path / "libraries" / name
+
+        return SyntheticLibrary(root_dir=root_dir, **kwargs).generate()
+
+    return make_library
+
+
+@pytest.fixture
+def make_paths(tmp_path):
+    """ Paths exporting the library at root to their own directories under
+    tmp_path. """
+
+    def make_paths(root: pathlib.Path, name: str = "export") -> AppleBooksPaths:
+
+        return AppleBooksPaths(
+            src_root_dir=root,
+            local_root_dir=tmp_path / "exports" / name,
+            state_dir=tmp_path / "state" / name,
+            database_file=tmp_path / "state" / name / "hlts.sqlite",
+        )
+
+    return make_paths
+
+
+@pytest.fixture
+def export(make_paths):
+    """ Export the library at root and return the AppleBooks that exported
+    it. """
+
+    def export(root: pathlib.Path, name: str = "export", **kwargs) -> AppleBooks:
+
+        applebooks = AppleBooks(paths=make_paths(root, name=name), **kwargs)
+        applebooks.run()
+
+        return applebooks
+
+    return export
+
+
+@pytest.fixture
+def edit_library():
+    """ Edit, delete and add an annotation of a library the way Books does,
+    leaving a tombstone behind for the deleted one. Returns the ids of the
+    edited, deleted and added annotations. """
+
+    def edit_library(library: SyntheticLibrary) -> tuple:
+
+        sqlite_file = library.aeannotation_dir / library.aeannotation_name
+        latest = "(SELECT MAX(ZANNOTATIONMODIFICATIONDATE) FROM ZAEANNOTATION) + 60"
+
+        with sqlite3.connect(sqlite_file) as connection:
+
+            (edited, pk_edited), (deleted, pk_deleted) = [
+                connection.execute(
+                    f"""
+                    SELECT ZANNOTATIONUUID, Z_PK
+                    FROM ZAEANNOTATION
+                    WHERE ZANNOTATIONDELETED = 0
+                        AND ZANNOTATIONSELECTEDTEXT IS NOT NULL
+                    ORDER BY Z_PK {order}
+                    LIMIT 1;
+                    """
+                ).fetchone()
+                for order in ["ASC", "DESC"]
+            ]
+
+            connection.execute(
+                f"""
+                UPDATE ZAEANNOTATION
+                SET ZANNOTATIONNOTE = 'Edited #incremental',
+                    ZANNOTATIONMODIFICATIONDATE = {latest}
+                WHERE Z_PK = ?;
+                """,
+                (pk_edited,),
+            )
+            connection.execute(
+                f"""
+                UPDATE ZAEANNOTATION
+                SET ZANNOTATIONDELETED = 1, ZANNOTATIONMODIFICATIONDATE = {latest}
+                WHERE Z_PK = ?;
+                """,
+                (pk_deleted,),
+            )
+            connection.execute(
+                f"""
+                INSERT INTO ZAEANNOTATION (
+                    Z_ENT, Z_OPT, ZANNOTATIONDELETED, ZANNOTATIONISUNDERLINE,
+                    ZANNOTATIONSTYLE, ZANNOTATIONTYPE, ZANNOTATIONCREATIONDATE,
+                    ZANNOTATIONMODIFICATIONDATE, ZANNOTATIONASSETID,
+                    ZANNOTATIONLOCATION, ZANNOTATIONNOTE,
+                    ZANNOTATIONREPRESENTATIVETEXT, ZANNOTATIONSELECTEDTEXT,
+                    ZANNOTATIONUUID
+                )
+                SELECT
+                    Z_ENT, Z_OPT, 0, ZANNOTATIONISUNDERLINE, ZANNOTATIONSTYLE,
+                    ZANNOTATIONTYPE, ZANNOTATIONCREATIONDATE, {latest},
+                    ZANNOTATIONASSETID, ZANNOTATIONLOCATION, 'Added @new',
+                    ZANNOTATIONREPRESENTATIVETEXT, 'Added text.', 'added-annotation'
+                FROM ZAEANNOTATION
+                WHERE Z_PK = ?;
+                """,
+                (pk_edited,),
+            )
+
+        connection.close()
+
+        return edited, deleted, "added-annotation"
+
+    return edit_library
+
+
+def load(path: pathlib.Path) -> dict:
+    """ Contents of an exported JSON file without its metadata, which differs
+    between exports. """
+
+    with open(path, "r") as f:
+        data = json.load(f)
+
+    data.pop("metadata", None)
+
+    return data
+
+
+@pytest.fixture(name="load")
+def load_fixture():
+    return load
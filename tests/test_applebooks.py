@@ -0,0 +1,235 @@
+import sqlite3
+import time
+from datetime import datetime
+
+import pytest
+
+from app.applebooks.db import AppleBooksDB
+from app.applebooks.models import Annotation, Source
+
+
+def nested_loop(applebooks) -> tuple:
+    """ Sources with their Annotations joined by comparing every annotation
+    against every source like the export did before annotations were grouped
+    by source. Returns the Sources that have annotations and every Annotation
+    in the order they were created. """
+
+    db = AppleBooksDB(paths=applebooks.paths, filters=applebooks.filters)
+
+    sources = []
+    annotations = []
+
+    for _source in db.query_sources_db():
+
+        source = Source(
+            (
+                _source["source_id"],
+                _source["source_name"],
+                _source["source_author"],
+                _source["source_path"],
+            )
+        )
+
+        for _annotation in db.query_annotations_db():
+            if _annotation["source_id"] == _source["source_id"]:
+                annotation = Annotation(Annotation.row({**_annotation, **_source}))
+                source.add_annotation(annotation)
+                annotations.append(annotation)
+
+        if source.has_annotations:
+            sources.append(source)
+
+    return sources, annotations
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"incremental": True},
+        {"pushdown": True},
+        {"workers": 2, "chunk_size": 50},
+    ],
+    ids=["default", "incremental", "pushdown", "workers"],
+)
+def test_export_matches_nested_loop(make_library, export, load, settings, options):
+
+    for name, value in options.items():
+        setattr(settings, name, value)
+
+    library = make_library(sources=20, annotations=500)
+    applebooks = export(library.root_dir)
+
+    sources, annotations = nested_loop(applebooks)
+
+    assert sources
+    assert load(applebooks.paths.sources_json) == {
+        "sources": [source.serialize() for source in sources]
+    }
+    assert load(applebooks.paths.annotations_json) == {
+        "annotations": [annotation.serialize() for annotation in annotations]
+    }
+
+
+def test_export_scales_linearly(make_library, export, settings):
+
+    # Every annotation is processed rather than restored from the cache.
+    settings.cache_size = 0
+
+    durations = []
+
+    for size in (2000, 8000):
+
+        library = make_library(name=str(size), sources=size // 20, annotations=size)
+
+        start = time.perf_counter()
+        export(library.root_dir, name=str(size))
+        durations.append(time.perf_counter() - start)
+
+    # Four times the annotations. Comparing every annotation against every
+    # source takes sixteen times as long.
+    assert durations[1] / durations[0] < 8
+
+
+def test_export_records_streamed_rows(make_library, export):
+
+    library = make_library(sources=20, annotations=500)
+    applebooks = export(library.root_dir)
+
+    stages = applebooks.stats.stages
+    count = applebooks.export.count_annotations
+
+    assert stages["query_and_cache_data"].rows_out == count
+    assert stages["process_data"].rows_in == count
+    assert stages["process_data"].rows_out == count
+
+
+def test_export_records_time_of_streamed_stages(make_library, export):
+
+    library = make_library(sources=20, annotations=500)
+
+    start = time.perf_counter()
+    applebooks = export(library.root_dir)
+    duration = time.perf_counter() - start
+
+    stages = applebooks.stats.stages
+
+    # Rows are queried and processed while they're saved. The time spent doing
+    # so is recorded for the query and process stages and not the save stage.
+    for name in ["query_and_cache_data", "process_data", "save_data"]:
+        assert stages[name].wall_time > 0
+        assert stages[name].cpu_time > 0
+
+    assert sum(stage.wall_time for stage in stages.values()) <= duration
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        0.0,
+        1.5,
+        # Ties rounded half to even.
+        1700000000.0078125,
+        1700000000.0234375,
+        # Microseconds carried over into the seconds.
+        1700000000.9999996,
+        1700000000.9999994,
+        1700000000.0000004,
+        -0.0000004,
+        -0.9999996,
+        -86400.25,
+        978307200.123456,
+    ],
+)
+def test_convert_date_pushdown(timestamp):
+
+    connection = sqlite3.connect(":memory:")
+    expression = AppleBooksDB._convert_date("date")
+
+    (date,) = connection.execute(
+        f"SELECT {expression} FROM (SELECT ? as date);", (timestamp,)
+    ).fetchone()
+
+    connection.close()
+
+    assert date == datetime.utcfromtimestamp(timestamp).isoformat()
+
+
+def notes(text: str) -> tuple:
+    """ The notes of an annotation made from text split into what's left of
+    them, tags, collections and whether it's starred. """
+
+    annotation = Annotation(
+        Annotation.row(
+            {
+                "id": "annotation",
+                "text": "Text.",
+                "notes": text,
+                "style": 3,
+                "epubcfi": None,
+                "date_created": 0.0,
+                "date_modified": 0.0,
+            }
+        )
+    )
+
+    return (
+        annotation.notes,
+        annotation.tags,
+        annotation.collections,
+        annotation.is_starred,
+    )
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Note #one #two @a @b", ("Note", ["one", "two"], ["a", "b"], False)),
+        ("#tag\nNext line", ("Next line", ["tag"], [], False)),
+        ("#dup #dup", ("", ["dup", "dup"], [], False)),
+        # Prefixes inside a word aren't tokens.
+        ("email@example.com C#sharp", ("email@example.com C#sharp", [], [], False)),
+        # A token ends at the next prefix of its own kind, which isn't a token
+        # as it's inside a word...
+        ("#one#two", ("#two", ["one"], [], False)),
+        ("@a@b", ("@b", [], ["a"], False)),
+        # ...but runs on through a prefix of the other kind.
+        ("#one@a", ("", ["one@a"], [], False)),
+        ("@a#one", ("", [], ["a#one"], False)),
+        # The starred collection stars an annotation instead.
+        ("Note #tag @star", ("Note", ["tag"], [], True)),
+        ("@star @a", ("", [], ["a"], True)),
+        ("@star@a", ("@a", [], [], True)),
+        ("@starred", ("", [], ["starred"], False)),
+        ("x@star", ("x@star", [], [], False)),
+    ],
+)
+def test_annotation_notes(settings, text, expected):
+
+    settings.tag_prefix = "#"
+    settings.collection_prefix = "@"
+    settings.starred_collection = "star"
+
+    assert notes(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("+tag ::col #notag @nocol", ("#notag @nocol", ["tag"], ["col"], False)),
+        ("a+b c::d", ("a+b c::d", [], [], False)),
+        ("+one+two", ("+two", ["one"], [], False)),
+        ("::a::b", ("::b", [], ["a"], False)),
+        # Any character of a prefix ends a token of its kind.
+        ("::a:b", (":b", [], ["a"], False)),
+        ("Note ::fav", ("Note", [], [], True)),
+        ("Note ::star", ("Note", [], ["star"], False)),
+    ],
+)
+def test_annotation_notes_with_other_prefixes(settings, text, expected):
+
+    settings.tag_prefix = "+"
+    settings.collection_prefix = "::"
+    settings.starred_collection = "fav"
+
+    assert notes(text) == expected
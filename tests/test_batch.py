@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from app.batch import BatchExport, parse_libraries
+from app.errors import ApplicationError
+
+
+def test_batch_matches_single_exports(tmp_path, make_library, export, load):
+
+    libraries = {
+        "first": make_library("first", sources=10, annotations=200, seed=1).root_dir,
+        "second": make_library("second", sources=20, annotations=300, seed=2).root_dir,
+        # Holds no databases.
+        "missing": tmp_path / "missing",
+    }
+
+    batch = BatchExport(libraries=libraries, jobs=3)
+    summary = batch.run()
+
+    assert summary["failed"] == ["missing"]
+
+    counts = {}
+
+    for name in ["first", "second"]:
+
+        paths = batch.exports[name].paths
+        single = export(libraries[name], name=name)
+
+        assert load(paths.sources_json) == load(single.paths.sources_json)
+        assert load(paths.annotations_json) == load(single.paths.annotations_json)
+
+        counts[name] = single.export.count_annotations
+
+    with open(batch.libraries_dir / "summary.json", "r") as f:
+        saved = json.load(f)
+
+    assert saved == json.loads(json.dumps(summary))
+    assert set(saved) == {"date", "jobs", "workers", "wall_time", "failed", "libraries"}
+    assert saved["jobs"] == 3
+    assert set(saved["libraries"]) == set(libraries)
+
+    for name, result in saved["libraries"].items():
+
+        assert result["src_root_dir"] == str(libraries[name])
+        assert result["wall_time"] >= 0
+
+        if name == "missing":
+            assert "Couldn't find AppleBooks database" in result["error"]
+            assert "count_annotations" not in result
+        else:
+            assert "error" not in result
+            assert result["count_annotations"] == counts[name]
+            assert set(result["stages"]) >= {"copy_databases", "save_data"}
+
+
+def test_parse_libraries_names_libraries(tmp_path):
+
+    container = "Library/Containers/com.apple.iBooksX/Data/Documents"
+
+    libraries = parse_libraries(
+        [f"/Users/alice/{container}", "/Users/bob", "archive 2019=/Volumes/Backup"]
+    )
+
+    assert {name: str(root) for name, root in libraries.items()} == {
+        "Users-alice": f"/Users/alice/{container}",
+        "Users-bob": "/Users/bob",
+        "archive-2019": "/Volumes/Backup",
+    }
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["archive=/Volumes/A", "archive=/Volumes/B"],
+        # Only the same once unsafe characters are replaced.
+        ["archive 2019=/Volumes/A", "archive/2019=/Volumes/B"],
+        [
+            "/Users/alice/Library/Containers/com.apple.iBooksX/Data/Documents",
+            "/Users/alice",
+        ],
+    ],
+)
+def test_parse_libraries_rejects_duplicate_names(values):
+
+    with pytest.raises(ApplicationError, match="More than one library named"):
+        parse_libraries(values)
@@ -0,0 +1,75 @@
+from app.applebooks.cache import AnnotationCache
+from app.applebooks.models import Annotation
+
+
+def make_rows(count: int, date_modified: float = 600000000.0) -> list:
+
+    return [
+        (
+            f"annotation-{i}",
+            "source",
+            "Title",
+            "Author",
+            f"Text {i}",
+            "Notes #tag",
+            3,
+            f"epubcfi(/6/4!/4/{i * 2}/1:0)",
+            500000000.0,
+            date_modified,
+            None,
+        )
+        for i in range(count)
+    ]
+
+
+def cache_run(path, rows: list, max_size: int = 100) -> AnnotationCache:
+    """ Look rows up and cache those that miss like a run does. """
+
+    with AnnotationCache(path, max_size=max_size) as cache:
+
+        annotations = cache.get(rows)
+        misses = [row for row, a in zip(rows, annotations) if a is None]
+
+        cache.put(misses, Annotation.from_rows(misses))
+
+    return cache
+
+
+def test_cache_restores_unmodified_annotations(tmp_path):
+
+    path = tmp_path / "cache.sqlite"
+    rows = make_rows(10)
+
+    cache_run(path, rows)
+
+    with AnnotationCache(path, max_size=100) as cache:
+        modified = make_rows(10, date_modified=700000000.0)
+        annotations = cache.get(rows[:5] + modified[5:])
+
+    assert cache.hits == 5
+    assert cache.misses == 5
+    assert [a.serialize() for a in annotations[:5]] == [
+        a.serialize() for a in Annotation.from_rows(rows[:5])
+    ]
+
+
+def test_cache_never_evicts_records_used_by_the_current_run(tmp_path):
+
+    path = tmp_path / "cache.sqlite"
+    rows = make_rows(150)
+
+    # Larger than max_size so the first run's records are all kept.
+    assert cache_run(path, rows).size == 150
+
+    # Half of them are used again so only records of the other half are
+    # evicted.
+    cache = cache_run(path, rows[75:])
+
+    assert cache.hits == 75
+    assert cache.size == 100
+
+    cache = cache_run(path, rows)
+
+    assert cache.hits == 100
+    assert cache.misses == 50
+    assert cache.size == 150
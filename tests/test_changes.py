@@ -0,0 +1,156 @@
+import hashlib
+import json
+
+from app.applebooks import AppleBooks
+from app.applebooks.defaults import AppleBooksPaths
+from app.changes import ChangeSet
+
+
+def outputs(paths: AppleBooksPaths) -> list:
+    """ Files written by an export that are kept when they're unchanged. """
+
+    return [
+        paths.sources_json,
+        paths.annotations_json,
+        paths.index_json,
+        paths.manifest_json,
+        *sorted(paths.sources_dir.iterdir()),
+    ]
+
+
+def stat(paths: AppleBooksPaths) -> dict:
+    """ The inode and modification time of each output keyed by its path
+    relative to local_root_dir. """
+
+    return {
+        path.relative_to(paths.local_root_dir): (
+            path.stat().st_ino,
+            path.stat().st_mtime_ns,
+        )
+        for path in outputs(paths)
+    }
+
+
+def test_export_keeps_unchanged_outputs(
+    tmp_path, make_library, settings, load, edit_library
+):
+
+    settings.shards = True
+
+    library = make_library(sources=20, annotations=500)
+
+    def export(day: str) -> AppleBooks:
+        """ Export to a day directory of its own. Every export shares the
+        state it's compared against. """
+
+        applebooks = AppleBooks(
+            paths=AppleBooksPaths(
+                src_root_dir=library.root_dir,
+                local_root_dir=tmp_path / "exports" / day,
+                state_dir=tmp_path / "state",
+                database_file=tmp_path / "state" / "hlts.sqlite",
+            )
+        )
+        applebooks.run()
+
+        return applebooks
+
+    first = export("day-1")
+    second = export("day-2")
+
+    # Unchanged outputs are hardlinked from the previous export.
+    assert stat(second.paths) == stat(first.paths)
+    assert load(second.paths.changes_json) == {
+        "added": [],
+        "modified": [],
+        "deleted": [],
+    }
+
+    # And kept as they were when exported to the same directory again.
+    before = stat(second.paths)
+    second = export("day-2")
+
+    assert stat(second.paths) == before
+
+    hashes = ChangeSet(second.paths.hashes_json)._load()["annotations"]
+
+    edited, deleted, added = edit_library(library)
+
+    third = export("day-3")
+
+    changes = load(third.paths.changes_json)
+    annotations = load(third.paths.annotations_json)["annotations"]
+    digests = {a["id"]: ChangeSet.hash(a) for a in annotations}
+
+    assert changes == {
+        "added": [{"id": added, "hash": digests[added]}],
+        "modified": [
+            {"id": edited, "hash": digests[edited], "previous_hash": hashes[edited]}
+        ],
+        "deleted": [{"id": deleted, "hash": hashes[deleted]}],
+    }
+
+    # Only the outputs holding the annotations that changed are written again.
+    sources = {
+        a["id"]: a["source"]["id"]
+        for a in annotations + load(second.paths.annotations_json)["annotations"]
+    }
+    shards = load(third.paths.manifest_json)["sources"]
+
+    written = {
+        third.paths.sources_json,
+        third.paths.annotations_json,
+        third.paths.index_json,
+        third.paths.manifest_json,
+        *(
+            third.paths.local_root_dir / shards[sources[id_]]["file"]
+            for id_ in [edited, deleted, added]
+        ),
+    }
+
+    current = stat(third.paths)
+    previous = stat(second.paths)
+
+    assert {
+        third.paths.local_root_dir / path
+        for path, (inode, _) in current.items()
+        if inode != previous.get(path, (None,))[0]
+    } == written
+    assert len(written) < len(current)
+
+    # The hashes saved for the next export round trip: they match the
+    # annotations and files of this export.
+    saved = ChangeSet(third.paths.hashes_json)._load()
+
+    assert saved["annotations"] == digests
+
+    files = saved["files"]
+
+    # Files written by a JSONWriter are hashed without their metadata.
+    for key, path in [
+        ("sources", third.paths.sources_json),
+        ("annotations", third.paths.annotations_json),
+    ]:
+        with open(path, "r", encoding="utf-8") as f:
+            contents = f.read()
+
+        header = f'{{\n    "{key}": ['
+        items = contents[len(header) : contents.rindex('\n    ],\n    "metadata"')]
+
+        assert files[path.name]["hash"] == hashlib.sha256(
+            items.encode("utf-8")
+        ).hexdigest()
+
+    index = load(third.paths.index_json)
+    manifest = load(third.paths.manifest_json)["sources"]
+
+    assert files["index.json"]["hash"] == hashlib.sha256(
+        json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+    assert files["manifest.json"]["hash"] == hashlib.sha256(
+        json.dumps(manifest, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+    assert {entry["path"] for entry in files.values()} == {
+        str(path) for path in [*outputs(third.paths)[:4], third.paths.sources_dir]
+    }
+    assert ChangeSet(third.paths.hashes_json).previous_files == files
@@ -0,0 +1,177 @@
+import json
+import pathlib
+
+from app.applebooks import AppleBooks
+from app.clippings import Clippings
+from app.clippings.defaults import ClippingsPaths
+from app.clippings.models import Clipping, parse_clippings
+from app.defaults import ExportPaths
+from app.export import Export
+
+
+CLIPPINGS_FILE = pathlib.Path(__file__).parent / "fixtures" / "My Clippings.txt"
+
+
+def make_clippings(tmp_path: pathlib.Path, name: str = "clippings") -> Clippings:
+    """ Clippings of the fixture exported to their own directories under
+    tmp_path. """
+
+    return Clippings(
+        paths=ClippingsPaths(
+            src_file=CLIPPINGS_FILE,
+            local_root_dir=tmp_path / "exports" / name,
+            state_dir=tmp_path / "state" / name,
+            database_file=tmp_path / "state" / name / "hlts.sqlite",
+        )
+    )
+
+
+def test_parse_clippings():
+
+    with open(CLIPPINGS_FILE, "r", encoding="utf-8-sig") as f:
+        clippings = parse_clippings(f.read())
+
+    left_hand = ("The Left Hand of Darkness", "Le Guin, Ursula K.")
+    meditations = ("Meditations", None)
+
+    # The entry that isn't a clipping is skipped.
+    assert clippings == [
+        Clipping(
+            *left_hand,
+            "highlight",
+            (180, 182),
+            (12, 12),
+            "2020-03-01T10:15:30",
+            "Light is the left hand of darkness.",
+        ),
+        Clipping(
+            *left_hand,
+            "note",
+            (182, 182),
+            (12, 12),
+            "2020-03-01T10:16:02",
+            "Yin and yang #theme",
+        ),
+        Clipping(
+            *left_hand, "bookmark", (455, 455), (30, 30), "2020-03-01T11:02:45", ""
+        ),
+        Clipping(
+            *left_hand,
+            "highlight",
+            (180, 182),
+            (12, 12),
+            "2020-03-02T20:05:00",
+            "Light is the left hand of darkness.",
+        ),
+        Clipping(
+            *meditations,
+            "highlight",
+            (40, 41),
+            None,
+            "2020-03-03T21:30:00",
+            "You have power over your mind.\nNot outside events.",
+        ),
+        Clipping(
+            *meditations,
+            "note",
+            (99, 99),
+            None,
+            "2020-03-03T21:45:10",
+            "Reread book two.",
+        ),
+    ]
+
+
+def test_clippings_export(tmp_path, load):
+
+    clippings = make_clippings(tmp_path)
+    clippings.run()
+
+    sources = load(clippings.paths.sources_json)["sources"]
+    annotations = load(clippings.paths.annotations_json)["annotations"]
+
+    # Books are ordered by title and bookmarks are skipped.
+    assert [(s["name"], s["author"]) for s in sources] == [
+        ("Meditations", None),
+        ("The Left Hand of Darkness", "Le Guin, Ursula K."),
+    ]
+    assert [len(s["annotations"]) for s in sources] == [2, 1]
+
+    highlight, note, edited = annotations
+
+    assert highlight["text"] == [
+        "You have power over your mind.",
+        "Not outside events.",
+    ]
+    assert highlight["metadata"]["location"] == "0040"
+
+    # A note on nothing is exported on its own.
+    assert note["text"] == []
+    assert note["notes"] == "Reread book two."
+
+    # The highlight clipped again once it was edited is exported once along
+    # with the note made where it ends.
+    assert edited["text"] == ["Light is the left hand of darkness."]
+    assert edited["tags"] == ["theme"]
+    assert edited["metadata"]["date_created"] == "2020-03-02T20:05:00"
+    assert {a["metadata"]["origin"] for a in annotations} == {"clippings"}
+
+
+def test_combined_export_follows_each_origin(
+    tmp_path, make_library, make_paths, export, load
+):
+
+    library = make_library(sources=10, annotations=200)
+
+    applebooks = export(library.root_dir, name="applebooks")
+    clippings = make_clippings(tmp_path)
+    clippings.run()
+
+    combined = Export(
+        paths=ExportPaths(
+            local_root_dir=tmp_path / "exports" / "combined",
+            state_dir=tmp_path / "state" / "combined",
+            database_file=tmp_path / "state" / "combined" / "hlts.sqlite",
+        )
+    )
+    combined.run(
+        origins=[
+            AppleBooks(paths=make_paths(library.root_dir, name="combined")),
+            make_clippings(tmp_path, name="combined-clippings"),
+        ]
+    )
+
+    # Sources are written in the order the origins are given in.
+    for path in ["sources_json", "annotations_json"]:
+
+        single = [
+            load(getattr(origin.paths, path)) for origin in [applebooks, clippings]
+        ]
+        key = "sources" if path == "sources_json" else "annotations"
+
+        assert load(getattr(combined.paths, path)) == {
+            key: single[0][key] + single[1][key]
+        }
+
+    with open(combined.paths.annotations_json, "r") as f:
+        metadata = json.load(f)["metadata"]
+
+    assert set(metadata["origins"]) == {"applebooks", "clippings"}
+    assert metadata["count_annotations"] == applebooks.export.count_annotations + 3
+
+    assert list(combined.stats.stages) == [
+        "setup",
+        "snapshot",
+        "query",
+        "process",
+        "save",
+    ]
+
+    # An origin run on its own records its stages under its own names.
+    assert list(applebooks.stats.stages) == [
+        "setup",
+        "copy_databases",
+        "query_and_cache_data",
+        "process_data",
+        "save_data",
+    ]
@@ -0,0 +1,130 @@
+import logging
+import re
+import sqlite3
+
+from app.applebooks import AppleBooks
+from app.database import AnnotationDatabase
+
+
+def tokens(text: str) -> list:
+    """ Tokens of text as the full-text index's default tokenizer splits
+    them. """
+    return re.findall(r"\w+", text.lower())
+
+
+def contains(text: str, phrase: list) -> bool:
+
+    words = tokens(text)
+
+    return any(
+        words[start : start + len(phrase)] == phrase for start in range(len(words))
+    )
+
+
+def dump(path) -> dict:
+    """ Every row of the store except for rowids, which differ between a
+    rebuilt and an updated store. """
+
+    connection = sqlite3.connect(path)
+
+    try:
+        data = {
+            table: sorted(connection.execute(f"SELECT {columns} FROM {table};"))
+            for table, columns in [
+                (
+                    "annotations",
+                    "id, origin, source_id, source_name, source_author, text, "
+                    "notes, date_created, date_modified, style, epubcfi, "
+                    "location, is_starred",
+                ),
+                ("tags", "annotation_id, tag"),
+                ("collections", "annotation_id, collection"),
+            ]
+        }
+        data["fts"] = sorted(
+            connection.execute(
+                """
+                SELECT annotations.id, annotations_fts.text, annotations_fts.notes
+                FROM annotations_fts
+                JOIN annotations ON annotations.rowid = annotations_fts.rowid;
+                """
+            )
+        )
+        connection.execute(
+            "INSERT INTO annotations_fts(annotations_fts) VALUES('integrity-check')"
+        )
+    finally:
+        connection.close()
+
+    return data
+
+
+def test_search(make_library, export, load):
+
+    library = make_library(sources=20, annotations=500)
+    applebooks = export(library.root_dir)
+
+    annotations = load(applebooks.paths.annotations_json)["annotations"]
+    database = AnnotationDatabase(path=applebooks.paths.database_file)
+
+    def search(query: str) -> set:
+        return {
+            result["id"]
+            for result in database.search(query=query, limit=len(annotations))
+        }
+
+    text = {a["id"]: "\n".join(a["text"]) for a in annotations}
+    notes = {a["id"]: a["notes"] for a in annotations}
+
+    # A phrase taken from the middle of the first annotation.
+    phrase = tokens(text[annotations[0]["id"]])[2:5]
+    query = '"' + " ".join(phrase) + '"'
+
+    assert annotations[0]["id"] in search(query)
+    assert search(query) == {
+        id_
+        for id_ in text
+        if contains(text[id_], phrase) or contains(notes[id_], phrase)
+    }
+
+    # A word only searched for in notes.
+    word = tokens(next(n for n in notes.values() if n))[0]
+
+    assert search(f"notes:{word}") == {
+        id_ for id_ in notes if word in tokens(notes[id_])
+    }
+    assert search(f"notes:{word}") != search(word)
+
+
+def test_export_applies_changes_to_the_database(
+    caplog, make_library, make_paths, edit_library
+):
+
+    library = make_library(sources=20, annotations=500)
+
+    updated = AppleBooks(paths=make_paths(library.root_dir, name="updated"))
+    updated.run()
+
+    edited, deleted, added = edit_library(library)
+
+    caplog.clear()
+
+    with caplog.at_level(logging.INFO, logger="app.database"):
+        updated.run()
+
+    # Only the changes are applied to the database of the previous export.
+    assert "Updating annotations" in caplog.text
+    assert "Indexing annotations" not in caplog.text
+
+    rebuilt = AppleBooks(paths=make_paths(library.root_dir, name="rebuilt"))
+    rebuilt.run()
+
+    data = dump(updated.paths.database_file)
+
+    assert data == dump(rebuilt.paths.database_file)
+    assert deleted not in {row[0] for row in data["annotations"]}
+
+    database = AnnotationDatabase(path=updated.paths.database_file)
+
+    assert {r["id"] for r in database.search(query="edited")} == {edited}
+    assert {r["id"] for r in database.search(query='"added text"')} == {added}
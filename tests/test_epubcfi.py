@@ -0,0 +1,104 @@
+import re
+
+import pytest
+
+from app.applebooks.epubcfi import format_location, parse_epubcfi
+from bench.library import SyntheticLibrary
+
+
+def legacy_location(epubcfi: str) -> str:
+    """ Location string as exported before epubcfis were parsed into keys.
+    Only handles ranges. """
+
+    core_parts = epubcfi[8:-1].split(",")
+    head_parts = (core_parts[0] + core_parts[1]).split(":")
+    offsets = [int(x) for x in re.findall(r"\/(\d+)", head_parts[0])]
+
+    try:
+        offsets.append(int(head_parts[1]))
+    except IndexError:
+        pass
+
+    return ".".join([f"{i:04}" for i in offsets])
+
+
+@pytest.mark.parametrize(
+    "epubcfi, key",
+    [
+        (
+            "epubcfi(/6/20[part01]!/4/182,/1:0,/3:23)",
+            ((6, 20, 4, 182, 1, 0), (6, 20, 4, 182, 3, 23)),
+        ),
+        # A range whose local paths are only character offsets.
+        ("epubcfi(/6/4!/4/10/1,:5,:12)", ((6, 4, 4, 10, 1, 5), (6, 4, 4, 10, 1, 12))),
+        # Not a range.
+        ("epubcfi(/6/4[chap01ref]!/4/2/1:3)", ((6, 4, 4, 2, 1, 3),) * 2),
+        ("epubcfi(/6/4)", ((6, 4),) * 2),
+        # Indirections through nested documents.
+        ("epubcfi(/6/4!/4/2!/2/1:0)", ((6, 4, 4, 2, 2, 1, 0),) * 2),
+        # Assertions holding the characters that separate a path's parts.
+        (
+            "epubcfi(/6/4[a/1:2,3]!/4/2[x^]y^,z]/1:0)",
+            ((6, 4, 4, 2, 1, 0),) * 2,
+        ),
+        ("epubcfi(/6/4!/4/2/1:3[;s=b])", ((6, 4, 4, 2, 1, 3),) * 2),
+        # Temporal and spatial offsets don't change the key.
+        ("epubcfi(/6/4!/4/2/1:3~1.5@20:30)", ((6, 4, 4, 2, 1, 3),) * 2),
+        # Steps over 9999.
+        ("epubcfi(/6/12000!/4/2/1:0)", ((6, 12000, 4, 2, 1, 0),) * 2),
+    ],
+)
+def test_parse_epubcfi(epubcfi, key):
+
+    assert parse_epubcfi(epubcfi) == key
+
+
+@pytest.mark.parametrize(
+    "epubcfi",
+    [
+        None,
+        "",
+        "/6/4!/4/2/1:0",
+        "epubcfi()x",
+        "epubcfi(/6/4!/4/2/1:0",
+        "epubcfi(/6/four)",
+        "epubcfi(/6/4[unclosed!/4/2)",
+        "epubcfi(/6/4!/4/2,/1:0)",
+    ],
+)
+def test_parse_epubcfi_invalid(epubcfi):
+
+    assert parse_epubcfi(epubcfi) is None
+    assert format_location(parse_epubcfi(epubcfi)) is None
+
+
+def test_keys_sort_in_reading_order():
+
+    epubcfis = [
+        "epubcfi(/6/10000!/4/2/1:0)",
+        "epubcfi(/6/4!/4/2/1:10)",
+        "epubcfi(/6/4!/4/2/1:9)",
+        "epubcfi(/6/9999!/4/2/1:0)",
+        "epubcfi(/6/4!/4/10/1:0)",
+    ]
+
+    keys = sorted(parse_epubcfi(epubcfi) for epubcfi in epubcfis)
+
+    assert [format_location(key) for key in keys] == [
+        "0006.0004.0004.0002.0001.0009",
+        "0006.0004.0004.0002.0001.0010",
+        "0006.0004.0004.0010.0001.0000",
+        "0006.9999.0004.0002.0001.0000",
+        "0006.10000.0004.0002.0001.0000",
+    ]
+
+
+def test_format_location_matches_legacy_location(tmp_path):
+
+    library = SyntheticLibrary(root_dir=tmp_path, cfi_depth=6)
+
+    for _ in range(1000):
+
+        epubcfi = library._epubcfi()
+
+        assert format_location(parse_epubcfi(epubcfi)) == legacy_location(epubcfi)
@@ -0,0 +1,43 @@
+import tracemalloc
+
+import pytest
+
+from app.applebooks.epubcfi import parse_epubcfi
+
+
+def traced_export(export, root, name: str) -> int:
+    """ Memory allocated by an export on top of what it still holds once it's
+    done i.e. its working set. What's held once it's done, the ids and hashes
+    of the changes, the index and memoized locations, grows with the library
+    by design. """
+
+    parse_epubcfi.cache_clear()
+    tracemalloc.start()
+
+    try:
+        export(root, name=name)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak - current
+
+
+@pytest.mark.parametrize("annotations_format", ["json", "jsonl"])
+def test_export_memory_is_flat(make_library, export, settings, annotations_format):
+
+    settings.annotations_format = annotations_format
+    settings.cache_size = 0
+    # Rows are processed a chunk at a time so chunks are kept small enough for
+    # both libraries to span several.
+    settings.chunk_size = 250
+
+    peaks = []
+
+    for size in (2000, 8000):
+        library = make_library(name=str(size), sources=size // 20, annotations=size)
+        peaks.append(traced_export(export, library.root_dir, name=str(size)))
+
+    # Four times the annotations. Holding them all before writing them takes
+    # about four times the memory.
+    assert peaks[1] < peaks[0] * 1.5
@@ -0,0 +1,261 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.applebooks import AppleBooks
+from app.applebooks.defaults import AppleBooksDefaults
+
+
+AUTHOR = "Ursula K. Le Guin"
+
+# A Core Data timestamp in the middle of the library's dates that some
+# annotations are created at exactly.
+BOUNDARY = 450000000.0
+BOUNDARY_DATE = datetime(2015, 4, 6, 8)
+
+
+def fetch(sqlite_file, query: str, *parameters) -> tuple:
+
+    with sqlite3.connect(sqlite_file) as connection:
+        row = connection.execute(query, parameters).fetchone()
+
+    connection.close()
+
+    return row
+
+
+def execute(sqlite_file, query: str, *parameters) -> None:
+
+    with sqlite3.connect(sqlite_file) as connection:
+        connection.execute(query, parameters)
+
+    connection.close()
+
+
+def created(annotation: dict) -> datetime:
+    return datetime.fromisoformat(annotation["metadata"]["date_created"])
+
+
+def modified(annotation: dict) -> datetime:
+    return datetime.fromisoformat(annotation["metadata"]["date_modified"])
+
+
+def days_ago(days: int) -> datetime:
+    return datetime.utcnow() - timedelta(days=days)
+
+
+# Filters along with whether they match an exported annotation.
+FILTERS = {
+    "source_ids": (
+        {"source_ids": ["source-1", "source-2"]},
+        lambda a: a["source"]["id"] in ["source-1", "source-2"],
+    ),
+    "authors": ({"authors": [AUTHOR]}, lambda a: a["source"]["author"] == AUTHOR),
+    # *_after filters are inclusive and *_before filters exclusive so the
+    # annotations created at the boundary only match the former.
+    "created_after": (
+        {"created_after": "2015-04-06T08:00:00"},
+        lambda a: created(a) >= BOUNDARY_DATE,
+    ),
+    "created_before": (
+        {"created_before": "2015-04-06"},
+        lambda a: created(a) < datetime(2015, 4, 6),
+    ),
+    "created_before_boundary": (
+        {"created_before": "2015-04-06T10:00:00+02:00"},
+        lambda a: created(a) < BOUNDARY_DATE,
+    ),
+    "modified_after": (
+        {"modified_after": "7d"},
+        lambda a: modified(a) >= days_ago(7),
+    ),
+    "modified_before": (
+        {"modified_before": "7d"},
+        lambda a: modified(a) < days_ago(7),
+    ),
+    "starred": ({"starred": True}, lambda a: a["metadata"]["is_starred"]),
+    "combined": (
+        {"authors": [AUTHOR], "created_after": "2015-04-06T08:00:00"},
+        lambda a: a["source"]["author"] == AUTHOR and created(a) >= BOUNDARY_DATE,
+    ),
+}
+
+
+@pytest.fixture
+def library(make_library):
+    """ A library with known source ids and authors, annotations created at
+    the boundary and annotations modified a day ago. """
+
+    library = make_library(sources=20, annotations=500)
+
+    now = datetime.utcnow().timestamp()
+    recent = now - 24 * 3600 - AppleBooksDefaults.ns_time_interval_since_1970
+
+    bklibrary_file = library.bklibrary_dir / library.bklibrary_name
+    aeannotation_file = library.aeannotation_dir / library.aeannotation_name
+
+    for pk in [1, 2]:
+
+        (asset_id,) = fetch(
+            bklibrary_file, "SELECT ZASSETID FROM ZBKLIBRARYASSET WHERE Z_PK = ?;", pk
+        )
+
+        execute(
+            bklibrary_file,
+            "UPDATE ZBKLIBRARYASSET SET ZASSETID = ? WHERE Z_PK = ?;",
+            f"source-{pk}",
+            pk,
+        )
+        execute(
+            aeannotation_file,
+            """
+            UPDATE ZAEANNOTATION
+            SET ZANNOTATIONASSETID = ?
+            WHERE ZANNOTATIONASSETID = ?;
+            """,
+            f"source-{pk}",
+            asset_id,
+        )
+
+    execute(
+        bklibrary_file,
+        "UPDATE ZBKLIBRARYASSET SET ZAUTHOR = ? WHERE Z_PK IN (3, 4);",
+        AUTHOR,
+    )
+
+    for column, date, offset in [
+        ("ZANNOTATIONCREATIONDATE", BOUNDARY, 0),
+        ("ZANNOTATIONMODIFICATIONDATE", recent, 5),
+    ]:
+        execute(
+            aeannotation_file,
+            f"""
+            UPDATE ZAEANNOTATION
+            SET {column} = ?
+            WHERE Z_PK IN (
+                SELECT Z_PK
+                FROM ZAEANNOTATION
+                WHERE ZANNOTATIONDELETED = 0
+                ORDER BY Z_PK
+                LIMIT 5 OFFSET ?
+            );
+            """,
+            date,
+            offset,
+        )
+
+    return library
+
+
+def filtered(applebooks: AppleBooks, matches, load) -> tuple:
+    """ The sources and annotations an unfiltered export would have if only
+    the annotations that match were exported. """
+
+    sources = []
+
+    for source in load(applebooks.paths.sources_json)["sources"]:
+
+        info = {key: source[key] for key in ["id", "name", "author"]}
+        annotations = [
+            a for a in source["annotations"] if matches({**a, "source": info})
+        ]
+
+        if annotations:
+            sources.append({**source, "annotations": annotations})
+
+    annotations = [
+        a for a in load(applebooks.paths.annotations_json)["annotations"] if matches(a)
+    ]
+
+    return {"sources": sources}, {"annotations": annotations}
+
+
+def assert_filtered(applebooks: AppleBooks, full: AppleBooks, matches, load):
+
+    sources, annotations = filtered(full, matches, load)
+    count = len(load(full.paths.annotations_json)["annotations"])
+
+    # Every filter matches some but not all of the library's annotations.
+    assert 0 < len(annotations["annotations"]) < count
+
+    assert load(applebooks.paths.sources_json) == sources
+    assert load(applebooks.paths.annotations_json) == annotations
+
+
+@pytest.mark.parametrize("filters, matches", FILTERS.values(), ids=list(FILTERS))
+@pytest.mark.parametrize("pushdown", [False, True], ids=["streamed", "pushdown"])
+def test_export_filters(library, export, load, settings, filters, matches, pushdown):
+
+    full = export(library.root_dir, name="full")
+
+    settings.pushdown = pushdown
+    settings.filters = filters
+
+    applebooks = export(library.root_dir, name="filtered")
+
+    assert_filtered(applebooks, full, matches, load)
+
+
+@pytest.mark.parametrize("filters, matches", FILTERS.values(), ids=list(FILTERS))
+def test_incremental_export_filters(
+    library, make_paths, export, load, settings, edit_library, filters, matches
+):
+
+    paths = make_paths(library.root_dir, name="incremental")
+
+    def run() -> AppleBooks:
+
+        settings.incremental = True
+        settings.filters = filters
+
+        applebooks = AppleBooks(paths=paths)
+        applebooks.run()
+
+        settings.incremental = False
+        settings.filters = {}
+
+        return applebooks
+
+    first = run()
+    full = export(library.root_dir, name="first")
+
+    assert first._sync.count_restored == 0
+    assert_filtered(first, full, matches, load)
+
+    edit_library(library)
+
+    # The same filters only query what changed.
+    second = run()
+    full = export(library.root_dir, name="second")
+
+    assert second._sync.count_restored > 0
+    assert_filtered(second, full, matches, load)
+
+
+@pytest.mark.parametrize("filters, matches", FILTERS.values(), ids=list(FILTERS))
+def test_incremental_export_queries_all_when_filters_change(
+    library, make_paths, export, load, settings, filters, matches
+):
+
+    paths = make_paths(library.root_dir, name="incremental")
+
+    settings.incremental = True
+
+    AppleBooks(paths=paths).run()
+
+    # Nothing changed in the library but the rows saved by the unfiltered run
+    # can't be reused once filtered.
+    settings.filters = filters
+
+    applebooks = AppleBooks(paths=paths)
+    applebooks.run()
+
+    assert applebooks._sync.count_restored == 0
+
+    settings.incremental = False
+    settings.filters = {}
+
+    full = export(library.root_dir, name="full")
+
+    assert_filtered(applebooks, full, matches, load)
@@ -0,0 +1,18 @@
+import argparse
+
+import pytest
+
+from bench import imports
+
+
+@pytest.mark.parametrize("module", ["app", "run"])
+def test_import_is_within_budget(tmp_path, module):
+
+    args = argparse.Namespace(modules=[module], runs=5)
+
+    (result,) = imports.run(args, tmp_path)
+
+    assert "error" not in result
+    assert result["median"] <= imports.BUDGET
+    assert result["deferred"] == []
+    assert result["files"] == []
@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+from app.index import FacetIndex
+from bench.library import SyntheticLibrary
+from test_clippings import make_clippings
+
+
+def facets(annotations: list, facet: str, source_id: str = None) -> dict:
+    """ Ids of annotations, those of source_id when given, keyed by each value
+    of facet in export order. """
+
+    ids = defaultdict(list)
+
+    for annotation in annotations:
+
+        if source_id is not None and annotation["source"]["id"] != source_id:
+            continue
+
+        for value in dict.fromkeys(annotation[facet]):
+            ids[value].append(annotation["id"])
+
+    return dict(ids)
+
+
+def test_index_matches_annotations(make_library, export, load):
+
+    library = make_library(sources=20, annotations=500)
+    applebooks = export(library.root_dir)
+
+    annotations = load(applebooks.paths.annotations_json)["annotations"]
+    source_ids = list(dict.fromkeys(a["source"]["id"] for a in annotations))
+
+    tags = facets(annotations, "tags")
+    collections = facets(annotations, "collections")
+    starred = [a["id"] for a in annotations if a["metadata"]["is_starred"]]
+
+    # Tags and collections are words of the library's notes. The starred
+    # collection stars an annotation instead.
+    assert tags and set(tags) <= set(SyntheticLibrary.words)
+    assert collections and set(collections) <= set(SyntheticLibrary.words)
+    assert starred
+
+    loaded = FacetIndex.load(applebooks.paths.index_json)
+
+    for index in [applebooks.index, loaded]:
+
+        assert index.tags == {tag: len(ids) for tag, ids in tags.items()}
+        assert index.collections == {c: len(ids) for c, ids in collections.items()}
+
+        for tag, ids in tags.items():
+            assert index.tagged(tag) == ids
+
+        for collection, ids in collections.items():
+            assert index.in_collection(collection) == ids
+
+        assert index.starred() == starred
+
+        for source_id in source_ids:
+
+            for tag in tags:
+                assert index.tagged(tag, source_id=source_id) == facets(
+                    annotations, "tags", source_id=source_id
+                ).get(tag, [])
+
+            for collection in collections:
+                assert index.in_collection(
+                    collection, source_id=source_id
+                ) == facets(annotations, "collections", source_id=source_id).get(
+                    collection, []
+                )
+
+            assert index.starred(source_id=source_id) == [
+                a["id"]
+                for a in annotations
+                if a["metadata"]["is_starred"] and a["source"]["id"] == source_id
+            ]
+
+        assert index.tagged("missing") == []
+        assert index.in_collection("star") == []
+        assert index.starred(source_id="missing") == []
+
+    assert loaded.serialize() == applebooks.index.serialize()
+
+
+def test_index_of_clippings(tmp_path, load):
+
+    clippings = make_clippings(tmp_path)
+    clippings.run()
+
+    annotations = load(clippings.paths.annotations_json)["annotations"]
+    edited = next(a for a in annotations if a["tags"])
+
+    index = FacetIndex.load(clippings.paths.index_json)
+
+    # The fixture's only tag is in a note of The Left Hand of Darkness.
+    assert edited["source"]["name"] == "The Left Hand of Darkness"
+    assert index.tags == {"theme": 1}
+    assert index.collections == {}
+    assert index.tagged("theme") == [edited["id"]]
+    assert index.tagged("theme", source_id=edited["source"]["id"]) == [edited["id"]]
+    assert index.starred() == []
@@ -0,0 +1,55 @@
+import pathlib
+import subprocess
+import sys
+
+from app import App
+from app.objects import ObjectStore
+
+
+ROOT_DIR = pathlib.Path(__file__).parent.parent
+
+
+def test_restore_compressed_day_directory(
+    monkeypatch, make_library, settings, data_root
+):
+
+    settings.store = True
+    settings.store_compression = "gzip"
+
+    library = make_library(sources=20, annotations=200)
+    settings.origins = {"applebooks": {"root": str(library.root_dir)}}
+
+    # The contents of every file as they were before they were stored along
+    # with the day directory they were stored for.
+    stored = {}
+    day_dirs = []
+    commit = ObjectStore.commit
+
+    def copy_and_commit(self, day_dir: pathlib.Path, files: dict) -> dict:
+
+        day_dirs.append(day_dir)
+        stored.update(
+            {day_dir / name: path.read_bytes() for name, path in files.items()}
+        )
+
+        return commit(self, day_dir, files)
+
+    monkeypatch.setattr(ObjectStore, "commit", copy_and_commit)
+
+    App().run()
+
+    (day_dir,) = day_dirs
+
+    # Compressed blobs replace the files of the day directory.
+    assert stored
+    assert not any(path.exists() for path in stored)
+
+    subprocess.run(
+        [sys.executable, "run.py", "restore", day_dir.name],
+        cwd=ROOT_DIR,
+        env={"HLTS_DATA_ROOT": str(data_root), "PATH": ""},
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+    assert {path: path.read_bytes() for path in stored} == stored
@@ -0,0 +1,45 @@
+import hashlib
+import json
+
+
+def test_manifest_matches_shards(make_library, export, load, settings):
+
+    settings.shards = True
+
+    library = make_library(sources=20, annotations=500)
+    applebooks = export(library.root_dir)
+    paths = applebooks.paths
+
+    sources = load(paths.sources_json)["sources"]
+    manifest = load(paths.manifest_json)["sources"]
+
+    files = {paths.local_root_dir / entry["file"] for entry in manifest.values()}
+
+    assert list(manifest) == [source["id"] for source in sources]
+    assert files == set(paths.sources_dir.iterdir())
+
+    # Each shard holds exactly what its source is in sources.json.
+    for source in sources:
+
+        entry = manifest[source["id"]]
+        data = (paths.local_root_dir / entry["file"]).read_bytes()
+
+        assert entry["count"] == len(source["annotations"])
+        assert entry["bytes"] == len(data)
+        assert entry["hash"] == hashlib.sha256(data).hexdigest()
+        assert json.loads(data) == source
+
+    def stat() -> dict:
+        return {
+            path: (path.stat().st_ino, path.stat().st_mtime_ns)
+            for path in [paths.manifest_json, *paths.sources_dir.iterdir()]
+        }
+
+    before = stat()
+
+    # Exporting the unchanged library again keeps the shards and the manifest
+    # as they were.
+    export(library.root_dir)
+
+    assert load(paths.manifest_json)["sources"] == manifest
+    assert stat() == before
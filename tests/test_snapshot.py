@@ -0,0 +1,107 @@
+import sqlite3
+
+from app.applebooks.snapshot import AppleBooksSnapshot
+
+
+def stat(snapshot: AppleBooksSnapshot) -> dict:
+    """ The inode and modification time of each database snapshot. """
+
+    return {
+        path: (path.stat().st_ino, path.stat().st_mtime_ns)
+        for _, dest_dir in snapshot._jobs
+        for path in dest_dir.glob("*.sqlite")
+    }
+
+
+def test_snapshot_skips_unchanged_databases(make_library, make_paths):
+
+    library = make_library(sources=5, annotations=50)
+    paths = make_paths(library.root_dir)
+
+    first = AppleBooksSnapshot(paths=paths)
+
+    assert first.run() > 0
+    assert first.updated == [paths.local_bklibrary_dir, paths.local_aeannotation_dir]
+
+    before = stat(first)
+
+    assert len(before) == 2
+
+    # Neither database changed so both snapshots are kept as they were...
+    second = AppleBooksSnapshot(paths=paths)
+
+    assert second.run() == 0
+    assert second.updated == []
+    assert stat(second) == before
+
+    # ...as they are when no database is reported as changed.
+    third = AppleBooksSnapshot(paths=paths)
+
+    assert third.run(src_dirs=[]) == 0
+    assert third.updated == []
+    assert stat(third) == before
+
+
+def test_snapshot_of_changes_only_in_the_write_ahead_log(make_library, make_paths):
+
+    library = make_library(sources=5, annotations=50)
+    paths = make_paths(library.root_dir)
+
+    sqlite_file = library.aeannotation_dir / library.aeannotation_name
+
+    # Books keeps its databases open in WAL mode. Without checkpoints commits
+    # stay in the -wal file and never touch the main database file.
+    connection = sqlite3.connect(sqlite_file, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL;")
+    connection.execute("PRAGMA wal_autocheckpoint=0;")
+
+    def edit(note: str) -> None:
+        connection.execute(
+            """
+            UPDATE ZAEANNOTATION
+            SET ZANNOTATIONNOTE = ?
+            WHERE Z_PK = (SELECT MIN(Z_PK) FROM ZAEANNOTATION);
+            """,
+            (note,),
+        )
+
+    def snapshot_note() -> str:
+
+        snapshot_file = paths.local_aeannotation_dir / library.aeannotation_name
+
+        with sqlite3.connect(snapshot_file) as snapshot:
+            (note,) = snapshot.execute(
+                """
+                SELECT ZANNOTATIONNOTE
+                FROM ZAEANNOTATION
+                WHERE Z_PK = (SELECT MIN(Z_PK) FROM ZAEANNOTATION);
+                """
+            ).fetchone()
+
+        snapshot.close()
+
+        return note
+
+    try:
+        edit("First")
+
+        assert AppleBooksSnapshot(paths=paths).run() > 0
+        assert snapshot_note() == "First"
+
+        main_file = (sqlite_file.stat().st_size, sqlite_file.stat().st_mtime_ns)
+
+        edit("Second " + "x" * 10000)
+
+        assert (sqlite_file.stat().st_size, sqlite_file.stat().st_mtime_ns) == (
+            main_file
+        )
+
+        # Only the annotations database is snapshot again and the snapshot
+        # includes the commit still in its log.
+        snapshot = AppleBooksSnapshot(paths=paths)
+
+        assert snapshot.run() > 0
+        assert snapshot.updated == [paths.local_aeannotation_dir]
+        assert snapshot_note().startswith("Second")
+    finally:
+        connection.close()
@@ -0,0 +1,100 @@
+import sqlite3
+
+from app.applebooks import AppleBooks
+
+
+def execute(sqlite_file, query: str, parameters: tuple = ()) -> None:
+
+    with sqlite3.connect(sqlite_file) as connection:
+        connection.execute(query, parameters)
+
+    connection.close()
+
+
+def test_incremental_runs_match_full_rebuilds(
+    make_library, make_paths, export, load, settings, edit_library
+):
+
+    library = make_library(sources=20, annotations=500)
+    paths = make_paths(library.root_dir, name="incremental")
+
+    def check(name: str) -> AppleBooks:
+
+        settings.incremental = True
+
+        applebooks = AppleBooks(paths=paths)
+        applebooks.run()
+
+        settings.incremental = False
+
+        full = export(library.root_dir, name=name)
+
+        assert load(paths.sources_json) == load(full.paths.sources_json)
+        assert load(paths.annotations_json) == load(full.paths.annotations_json)
+
+        return applebooks
+
+    first = check("first")
+
+    assert first._sync.count_processed == 20
+
+    edited, deleted, added = edit_library(library)
+
+    # Only the sources the annotations belong to are processed again.
+    second = check("second")
+
+    assert 1 <= second._sync.count_processed <= 3
+    assert second._sync.count_restored >= 17
+
+    annotations = load(paths.annotations_json)["annotations"]
+
+    assert "incremental" in next(a for a in annotations if a["id"] == edited)["tags"]
+    assert added in {a["id"] for a in annotations}
+    assert deleted not in {a["id"] for a in annotations}
+
+    # A source renamed in the library is processed again with all of its
+    # annotations.
+    execute(
+        library.bklibrary_dir / library.bklibrary_name,
+        "UPDATE ZBKLIBRARYASSET SET ZTITLE = 'Renamed' WHERE Z_PK = 1",
+    )
+
+    third = check("third")
+
+    assert third._sync.count_processed == 1
+
+    # An annotation removed without a tombstone can only be noticed by
+    # querying every annotation again.
+    execute(
+        library.aeannotation_dir / library.aeannotation_name,
+        "DELETE FROM ZAEANNOTATION WHERE Z_PK = 20",
+    )
+
+    fourth = check("fourth")
+
+    assert fourth._sync.count_processed == 20
+
+
+def test_incremental_run_queries_all_again_when_filters_change(
+    make_library, make_paths, export, load, settings
+):
+
+    library = make_library(sources=20, annotations=500)
+    paths = make_paths(library.root_dir, name="incremental")
+
+    settings.incremental = True
+
+    AppleBooks(paths=paths).run()
+
+    settings.filters = {"styles": ["yellow", "green"]}
+
+    applebooks = AppleBooks(paths=paths)
+    applebooks.run()
+
+    assert applebooks._sync.count_restored == 0
+
+    settings.incremental = False
+
+    full = export(library.root_dir, name="full")
+
+    assert load(paths.annotations_json) == load(full.paths.annotations_json)
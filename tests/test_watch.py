@@ -0,0 +1,101 @@
+import sqlite3
+
+import pytest
+
+from app.applebooks import AppleBooks
+from app.applebooks.db import AppleBooksDB
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """ Names of the AppleBooksDB queries run so far. """
+
+    queries = []
+
+    for name in ["query_sources_db", "query_annotations_db", "iter_annotations"]:
+
+        def query(self, *args, _name=name, _query=getattr(AppleBooksDB, name), **kw):
+
+            queries.append(_name)
+
+            return _query(self, *args, **kw)
+
+        monkeypatch.setattr(AppleBooksDB, name, query)
+
+    return queries
+
+
+def edit_note(library, notes: str) -> None:
+    """ Edit the notes of an annotation the way Books does. """
+
+    sqlite_file = library.aeannotation_dir / library.aeannotation_name
+
+    with sqlite3.connect(sqlite_file) as connection:
+        connection.execute(
+            """
+            UPDATE ZAEANNOTATION
+            SET ZANNOTATIONNOTE = ?,
+                ZANNOTATIONMODIFICATIONDATE = ZANNOTATIONMODIFICATIONDATE + 60
+            WHERE Z_PK = (
+                SELECT MIN(Z_PK) FROM ZAEANNOTATION WHERE ZANNOTATIONDELETED = 0
+            )
+            """,
+            (notes,),
+        )
+
+    connection.close()
+
+
+def test_warm_run_only_queries_changed_databases(
+    make_library, make_paths, export, load, queries
+):
+
+    library = make_library(sources=20, annotations=500)
+    paths = make_paths(library.root_dir, name="warm")
+
+    applebooks = AppleBooks(paths=paths, warm=True)
+    applebooks.run()
+
+    assert queries == ["query_sources_db", "query_annotations_db"]
+
+    # Nothing changed.
+    queries.clear()
+    applebooks.run(changed=[])
+
+    assert queries == []
+
+    edit_note(library, "Edited #watch")
+
+    queries.clear()
+    applebooks.run(changed=[paths.src_aeannotation_dir])
+
+    assert queries == ["query_annotations_db"]
+
+    cold = export(library.root_dir, name="cold")
+
+    assert load(paths.annotations_json) == load(cold.paths.annotations_json)
+    assert load(paths.sources_json) == load(cold.paths.sources_json)
+    assert "watch" in applebooks.index.tags
+
+
+def test_warm_run_queries_again_when_filters_change(
+    make_library, make_paths, load, settings, queries
+):
+
+    library = make_library(sources=20, annotations=500)
+    paths = make_paths(library.root_dir)
+
+    applebooks = AppleBooks(paths=paths, warm=True)
+    applebooks.run()
+
+    settings.filters = {"styles": ["yellow"]}
+
+    queries.clear()
+    applebooks.run(changed=[])
+
+    assert queries == ["query_sources_db", "query_annotations_db"]
+
+    annotations = load(paths.annotations_json)["annotations"]
+
+    assert annotations
+    assert {a["metadata"]["style"] for a in annotations} == {"yellow"}
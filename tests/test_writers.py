@@ -0,0 +1,49 @@
+import gc
+
+import pytest
+
+from app.writers import RecordsWriter, get_writer, writers
+
+
+ITEMS = [
+    {
+        "id": f"annotation-{i}",
+        "text": ["First paragraph.", "Second paragraph."],
+        "notes": "Notes",
+        "tags": ["tag"],
+        "collections": [],
+        "metadata": {"location": f"{i:04}", "is_starred": i % 2 == 0},
+    }
+    for i in range(100)
+]
+
+
+@pytest.mark.parametrize("name", [name for name in writers if writers[name].nested])
+def test_writer_loads_what_it_wrote(tmp_path, name):
+
+    writer_class = get_writer(name, nested=True)
+    path = tmp_path / f"annotations{writer_class.suffix}"
+
+    writer = writer_class(path=path, key="annotations", metadata=lambda: {"n": 100})
+
+    with writer:
+        for item in ITEMS:
+            writer.write(item)
+
+    assert writer_class.load(path) == {"annotations": ITEMS, "metadata": {"n": 100}}
+
+
+def test_records_load_matches_iter_records(tmp_path):
+
+    path = tmp_path / "annotations.records"
+
+    with RecordsWriter(path=path, key="annotations", metadata=lambda: {}) as writer:
+        for item in ITEMS:
+            writer.write(item)
+
+    records = list(RecordsWriter.iter_records(path))
+
+    assert records[-1] == (RecordsWriter.METADATA, {})
+    assert RecordsWriter.load(path)["annotations"] == [v for _, v in records[:-1]]
+    # The garbage collector is only paused while loading.
+    assert gc.isenabled()